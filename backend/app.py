@@ -3,17 +3,46 @@
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel, Field
 from typing import Optional
+from contextlib import asynccontextmanager
 import os
+import json
+import time
+import asyncio
 import logging
 from dotenv import load_dotenv
 
 # Import các module đã tách
 from geofilter import filter_shops_by_radius
-from gsheet_connector import add_shops_to_sheet_batch
-from gemini_service import get_gemini_service
-from places_service import search_nearby_shops, PLACES_API_ENABLED
+from gsheet_connector import enqueue_shops_for_sheet, get_write_queue, sheets_write_breaker
+from gemini_service import get_gemini_service, admission as gemini_admission, gemini_breaker, advice_cache, advice_flight
+from intent_classifier import classify_intent, INTENT_CHAT_ONLY
+from places_service import (
+    search_nearby_shops_progressive, 
+    stream_nearby_shops, 
+    search_cached_shops, 
+    get_endpoint_stats, 
+    start_http_client, 
+    close_http_client, 
+    overpass_breaker, 
+    search_flight,
+    PLACES_API_ENABLED
+)
+from tile_cache import get_tile_cache
+from spatial_index import get_shop_index
+from shop_catalog import get_shop_catalog, CATALOG_FIRST_ENABLED
+from circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+from metrics import (
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    STAGE_LATENCY,
+    UPSTREAM_TIMEOUTS,
+    counter,
+    histogram,
+    callback_metric
+)
 
 # Load biến môi trường từ file .env
 load_dotenv()
@@ -25,11 +54,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def _load_shop_catalog():
+    """Nạp danh mục Google Sheets một lần vào chỉ mục không gian (lỗi thì bỏ qua, không dùng dữ liệu mẫu)"""
+    try:
+        await get_shop_catalog().refresh(GOOGLE_SHEETS_ID)
+    except Exception as e:
+        logger.error(f"Không nạp được danh mục cửa hàng: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Khởi tạo và giải phóng tài nguyên dùng chung theo vòng đời ứng dụng"""
+    await start_http_client()
+    catalog_task = None
+    if GOOGLE_SHEETS_ID:
+        get_write_queue().start()
+    if GOOGLE_SHEETS_ID and CATALOG_FIRST_ENABLED:
+        # Snapshot định kỳ, mỗi lần đọc cũng nạp vào chỉ mục không gian dùng chung
+        get_shop_catalog().start(GOOGLE_SHEETS_ID)
+    elif GOOGLE_SHEETS_ID:
+        # Nạp nền để không chặn khởi động khi Google Sheets chậm
+        catalog_task = asyncio.create_task(_load_shop_catalog())
+    # Không cấu hình Google Sheets: chỉ mục chỉ gồm kết quả Overpass, không nạp dữ liệu mẫu
+    yield
+    if catalog_task is not None:
+        catalog_task.cancel()
+    await get_shop_catalog().stop()
+    await get_write_queue().stop()
+    await close_http_client()
+
+
 # Khởi tạo FastAPI app
 app = FastAPI(
     title="Fashion Shop Finder API",
     description="API tim kiem cua hang quan ao gan day va tu van thoi trang bang AI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Cấu hình CORS
@@ -63,10 +123,18 @@ class ShopResponse(BaseModel):
     item_suggestion: str
     promo_text: str
 
+class DegradedFlags(BaseModel):
+    """Đánh dấu các phần của response bị giảm chất lượng do hết thời gian chờ"""
+    shops: bool = False  # Chỉ dùng cửa hàng có sẵn trong cache
+    ai_message: bool = False  # Dùng phản hồi mặc định thay cho Gemini
+    persistence: bool = False  # Bỏ qua lưu vào Google Sheets
+
 class ChatResponse(BaseModel):
     """Schema cho response trả về client"""
     shops: list[ShopResponse]
     ai_message: str
+    intent: str = "shop_search"
+    degraded: DegradedFlags = Field(default_factory=DegradedFlags)
 
 # ===== Cấu hình từ biến môi trường =====
 GOOGLE_SHEETS_ID = os.getenv('GOOGLE_SHEETS_ID', '')
@@ -74,6 +142,141 @@ PRIORITY_RADIUS_KM = float(os.getenv('PRIORITY_RADIUS_KM', '20.0'))
 MAX_RADIUS_KM = float(os.getenv('MAX_RADIUS_KM', '500.0'))
 MAX_SHOPS = int(os.getenv('MAX_SHOPS', '30'))
 
+# Ngân sách thời gian cho /chat (giây): tổng và từng bước
+CHAT_DEADLINE_SECONDS = float(os.getenv('CHAT_DEADLINE_SECONDS', '15'))
+SEARCH_STAGE_SECONDS = float(os.getenv('SEARCH_STAGE_SECONDS', '8'))
+GEMINI_STAGE_SECONDS = float(os.getenv('GEMINI_STAGE_SECONDS', '10'))
+
+
+class LatencyBudget:
+    """Theo dõi thời gian còn lại của một request và chia thời hạn cho từng bước"""
+    
+    def __init__(self, total_seconds: float):
+        self.deadline = time.monotonic() + total_seconds
+    
+    def remaining(self) -> float:
+        """Số giây còn lại đến deadline tổng (có thể âm)"""
+        return self.deadline - time.monotonic()
+    
+    def stage_timeout(self, stage_seconds: float) -> float:
+        """Thời hạn cho một bước: không vượt quá ngân sách riêng của bước và thời gian còn lại"""
+        return max(0.0, min(stage_seconds, self.remaining()))
+    
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+# ===== Metrics =====
+CHAT_REQUESTS = counter(
+    'fashion_chat_requests_total',
+    'Số request /chat theo endpoint và loại câu hỏi',
+    ['endpoint', 'intent']
+)
+CHAT_DEGRADED = counter(
+    'fashion_chat_degraded_total',
+    'Số request phải giảm chất lượng theo từng phần của phản hồi',
+    ['part']
+)
+RESPONSE_BYTES = histogram(
+    'fashion_response_bytes',
+    'Kích thước phản hồi /chat (byte)',
+    ['endpoint'],
+    buckets=(512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+)
+SHOPS_RETURNED = histogram(
+    'fashion_shops_returned',
+    'Số cửa hàng trả về mỗi request',
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50)
+)
+
+CATALOG_LOOKUPS = counter(
+    'fashion_catalog_lookups_total',
+    'Số lần tìm trong danh mục Google Sheets trước khi gọi Overpass theo kết quả',
+    ['result']
+)
+
+# Các số liệu sau chỉ được đọc khi Prometheus scrape /metrics
+_BREAKER_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+_BREAKERS = {'overpass': overpass_breaker, 'gemini': gemini_breaker, 'google_sheets': sheets_write_breaker}
+
+callback_metric(
+    'fashion_cache_entries', 'Số phần tử đang có trong cache',
+    lambda: [
+        (('osm_tile',), len(get_tile_cache())),
+        (('gemini_advice',), advice_cache.stats()['entries']),
+        (('shop_index',), len(get_shop_index())),
+        (('shop_catalog',), len(get_shop_catalog()))
+    ],
+    ['cache']
+)
+callback_metric(
+    'fashion_cache_hits_total', 'Số lần tìm thấy trong cache',
+    lambda: [
+        (('osm_tile', 'memory'), get_tile_cache().hits),
+        (('gemini_advice', 'memory'), advice_cache.hits),
+        (('gemini_advice', 'disk'), advice_cache.disk_hits)
+    ],
+    ['cache', 'tier'], 'counter'
+)
+callback_metric(
+    'fashion_cache_misses_total', 'Số lần không có trong cache',
+    lambda: [(('osm_tile',), get_tile_cache().misses), (('gemini_advice',), advice_cache.misses)],
+    ['cache'], 'counter'
+)
+callback_metric(
+    'fashion_queue_depth', 'Số phần tử đang chờ trong hàng đợi',
+    lambda: [(('sheet_write',), get_write_queue().depth()), (('gemini_admission',), gemini_admission.queue_depth())],
+    ['queue']
+)
+callback_metric(
+    'fashion_gemini_admission_rejected_total', 'Số lời gọi Gemini bị từ chối vì hàng đợi đầy',
+    lambda: [((), gemini_admission.rejected)], metric_type='counter'
+)
+callback_metric(
+    'fashion_inflight_requests', 'Số lời gọi upstream đang chạy (sau khi gộp request)',
+    lambda: [(('overpass',), search_flight.in_flight()), (('gemini',), advice_flight.in_flight())],
+    ['service']
+)
+callback_metric(
+    'fashion_coalesced_requests_total', 'Số request được gộp vào lời gọi đang chạy',
+    lambda: [(('overpass',), search_flight.coalesced), (('gemini',), advice_flight.coalesced)],
+    ['service'], 'counter'
+)
+callback_metric(
+    'fashion_overpass_endpoint_latency_seconds', 'Độ trễ ước lượng (EWMA) của từng Overpass endpoint',
+    lambda: [((stats['url'],), stats['latency_seconds']) for stats in get_endpoint_stats() if stats['latency_seconds'] is not None],
+    ['endpoint']
+)
+callback_metric(
+    'fashion_overpass_endpoint_error_rate', 'Tỉ lệ lỗi (EWMA) của từng Overpass endpoint',
+    lambda: [((stats['url'],), stats['error_rate']) for stats in get_endpoint_stats()],
+    ['endpoint']
+)
+callback_metric(
+    'fashion_overpass_endpoint_requests_total', 'Số request đến từng Overpass endpoint theo kết quả',
+    lambda: [
+        row
+        for stats in get_endpoint_stats()
+        for row in (
+            ((stats['url'], 'success'), stats['requests'] - stats['errors']),
+            ((stats['url'], 'error'), stats['errors']),
+            ((stats['url'], 'cancelled'), stats['cancelled'])
+        )
+    ],
+    ['endpoint', 'result'], 'counter'
+)
+callback_metric(
+    'fashion_circuit_state', 'Trạng thái circuit breaker (0=closed, 1=half_open, 2=open)',
+    lambda: [((name,), _BREAKER_STATE_VALUES[breaker.state]) for name, breaker in _BREAKERS.items()],
+    ['service']
+)
+callback_metric(
+    'fashion_circuit_rejected_total', 'Số lời gọi bị circuit breaker từ chối',
+    lambda: [((name,), breaker.rejected) for name, breaker in _BREAKERS.items()],
+    ['service'], 'counter'
+)
+
 
 # ===== Helper Functions =====
 def _prepare_shops_for_saving(shops: list[dict]) -> list[dict]:
@@ -128,6 +331,174 @@ def _merge_shops_without_duplicates(shops1: list[dict], shops2: list[dict]) -> l
     return merged
 
 
+async def _find_cached_nearby_shops(request: ChatRequest) -> list[dict]:
+    """
+    Đường chat_only: chỉ lấy cửa hàng có sẵn trong cache làm ngữ cảnh cho Gemini,
+    không gọi Overpass và không ghi Google Sheets
+    """
+    priority_radius = request.priority_radius_km or PRIORITY_RADIUS_KM
+    max_shops = request.max_shops or MAX_SHOPS
+    
+    cached_shops = await search_cached_shops(request.lat, request.lon, int(priority_radius * 1000))
+    nearby_shops = filter_shops_by_radius(
+        user_lat=request.lat,
+        user_lon=request.lon,
+        shops=cached_shops,
+        radius_km=priority_radius,
+        limit=max_shops
+    )
+    logger.info(f"Câu hỏi chat_only, bỏ qua tìm kiếm; dùng {len(nearby_shops)} cửa hàng từ cache")
+    return nearby_shops
+
+
+async def _stream_priority_shops(
+    request: ChatRequest, 
+    catalog_shops: list[dict], 
+    partial_results: asyncio.Queue
+):
+    """
+    Đưa vào partial_results top cửa hàng trong bán kính ưu tiên mỗi khi một nhóm ô lưới tải xong
+    
+    Các ô vừa tải nằm trong tile cache nên vòng đầu của tìm kiếm tăng dần chạy sau đó không tải lại.
+    """
+    priority_radius = request.priority_radius_km or PRIORITY_RADIUS_KM
+    max_shops = request.max_shops or MAX_SHOPS
+    
+    found = catalog_shops
+    async for batch in stream_nearby_shops(request.lat, request.lon, int(priority_radius * 1000)):
+        found = _merge_shops_without_duplicates(found, batch)
+        partial_results.put_nowait(filter_shops_by_radius(
+            user_lat=request.lat,
+            user_lon=request.lon,
+            shops=found,
+            radius_km=priority_radius,
+            limit=max_shops
+        ))
+
+
+async def _find_nearby_shops(
+    request: ChatRequest, 
+    budget: LatencyBudget, 
+    degraded: DegradedFlags,
+    partial_results: Optional[asyncio.Queue] = None
+) -> list[dict]:
+    """
+    Bước 1-3 của pipeline /chat: tìm kiếm, lọc theo bán kính và đưa vào hàng đợi ghi sheet
+    
+    Bước nào quá thời hạn sẽ được giảm chất lượng và đánh dấu vào degraded.
+    Nếu có partial_results (/chat/stream), kết quả tạm trong bán kính ưu tiên được
+    đưa vào đó ngay khi từng nhóm ô lưới tải xong, trước khi có kết quả cuối cùng.
+    """
+    logger.info(f"Nhận request: lat={request.lat}, lon={request.lon}, message='{request.message[:50]}...'")
+    
+    # Lấy các tham số từ request hoặc dùng giá trị mặc định
+    priority_radius = request.priority_radius_km or PRIORITY_RADIUS_KM
+    max_radius = request.max_radius_km or MAX_RADIUS_KM
+    max_shops = request.max_shops or MAX_SHOPS
+    
+    logger.info(f"Tham số tìm kiếm: bán kính ưu tiên={priority_radius}km, bán kính tối đa={max_radius}km, số lượng={max_shops}")
+    
+    # Bước 0: Tìm trong danh mục đã lưu (snapshot Google Sheets), đủ và còn mới thì không gọi Overpass
+    catalog_shops = []
+    if CATALOG_FIRST_ENABLED and GOOGLE_SHEETS_ID:
+        catalog = get_shop_catalog()
+        started = time.perf_counter()
+        catalog_shops = catalog.query_radius(request.lat, request.lon, priority_radius)
+        STAGE_LATENCY.observe(time.perf_counter() - started, stage='catalog')
+        
+        if len(catalog_shops) >= max_shops and not catalog.is_stale():
+            CATALOG_LOOKUPS.inc(result='hit')
+            started = time.perf_counter()
+            nearby_shops = filter_shops_by_radius(
+                user_lat=request.lat,
+                user_lon=request.lon,
+                shops=catalog_shops,
+                radius_km=priority_radius,
+                limit=max_shops
+            )
+            STAGE_LATENCY.observe(time.perf_counter() - started, stage='filter')
+            logger.info(f"Danh mục có {len(catalog_shops)} cửa hàng trong {priority_radius}km, bỏ qua OpenStreetMap")
+            return nearby_shops
+        
+        CATALOG_LOOKUPS.inc(result='stale' if catalog.is_stale() else 'insufficient')
+        logger.info(f"Danh mục có {len(catalog_shops)}/{max_shops} cửa hàng gần đây, tìm thêm từ OpenStreetMap")
+    
+    # Bước 1: Tìm kiếm cửa hàng từ OpenStreetMap
+    # Bắt đầu từ bán kính ưu tiên, chỉ mở rộng (tải thêm phần vành khăn) khi chưa đủ
+    max_radius_meters = int(max(max_radius, priority_radius) * 1000)
+    search_timeout = budget.stage_timeout(SEARCH_STAGE_SECONDS)
+    started = time.perf_counter()
+    try:
+        if partial_results is not None:
+            await asyncio.wait_for(
+                _stream_priority_shops(request, catalog_shops, partial_results),
+                timeout=search_timeout
+            )
+        all_shops = await asyncio.wait_for(
+            search_nearby_shops_progressive(
+                lat=request.lat,
+                lon=request.lon,
+                min_radius_meters=int(priority_radius * 1000),
+                max_radius_meters=max_radius_meters,
+                max_shops=max_shops
+            ),
+            timeout=max(0.0, search_timeout - (time.perf_counter() - started))
+        )
+    except asyncio.TimeoutError:
+        # Quá hạn: chỉ dùng cửa hàng đã có trong cache (request Overpass vẫn chạy nền và làm đầy cache)
+        all_shops = await search_cached_shops(request.lat, request.lon, max_radius_meters)
+        degraded.shops = True
+        UPSTREAM_TIMEOUTS.inc(service='overpass')
+        logger.warning(f"Tìm kiếm cửa hàng quá hạn, dùng {len(all_shops)} cửa hàng từ cache")
+    STAGE_LATENCY.observe(time.perf_counter() - started, stage='search')
+    logger.info(f"Tìm thấy {len(all_shops)} cửa hàng từ OpenStreetMap")
+    
+    # Cửa hàng trong danh mục đứng trước vì có thể đã được bổ sung ghi chú, mức giá
+    all_shops = _merge_shops_without_duplicates(catalog_shops, all_shops)
+    
+    # Bước 2: Lọc và sắp xếp theo khoảng cách
+    started = time.perf_counter()
+    nearby_shops = filter_shops_by_radius(
+        user_lat=request.lat,
+        user_lon=request.lon,
+        shops=all_shops,
+        radius_km=max_radius,
+        limit=max_shops
+    )
+    STAGE_LATENCY.observe(time.perf_counter() - started, stage='filter')
+    logger.info(f"Cửa hàng trong bán kính {max_radius}km: {len(nearby_shops)}")
+    
+    # Bước 3: Đưa các cửa hàng vào hàng đợi ghi Google Sheets (nền, không chặn response)
+    if nearby_shops and GOOGLE_SHEETS_ID and budget.expired():
+        degraded.persistence = True
+        logger.warning("Đã hết thời gian xử lý, bỏ qua lưu Google Sheets")
+    elif nearby_shops and GOOGLE_SHEETS_ID:
+        shops_to_save = _prepare_shops_for_saving(nearby_shops)
+        queued_count = enqueue_shops_for_sheet(GOOGLE_SHEETS_ID, shops_to_save, "Trang tính 1")
+        if queued_count > 0:
+            logger.info(f"Đã đưa {queued_count} cửa hàng vào hàng đợi ghi Google Sheets")
+        if CATALOG_FIRST_ENABLED:
+            # Request sau ở gần đây dùng được ngay, không chờ lần đọc lại sheet tiếp theo
+            get_shop_catalog().insert_many(shops_to_save)
+    
+    return nearby_shops
+
+
+def _record_chat_metrics(endpoint: str, intent: str, degraded: DegradedFlags, shop_count: int, response_bytes: int):
+    """Ghi nhận số liệu của một request /chat đã hoàn thành"""
+    CHAT_REQUESTS.inc(endpoint=endpoint, intent=intent)
+    SHOPS_RETURNED.observe(shop_count, endpoint=endpoint)
+    RESPONSE_BYTES.observe(response_bytes, endpoint=endpoint)
+    for part, flagged in degraded.model_dump().items():
+        if flagged:
+            CHAT_DEGRADED.inc(part=part)
+
+
+def _sse_event(event: str, data) -> str:
+    """Đóng gói một sự kiện Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 # ===== API Endpoints =====
 @app.get("/")
 async def root():
@@ -137,7 +508,9 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "chat": "/chat (POST)",
+            "chat_stream": "/chat/stream (POST, Server-Sent Events)",
             "health": "/health (GET)",
+            "metrics": "/metrics (GET, Prometheus)",
             "docs": "/docs (GET)"
         }
     }
@@ -152,10 +525,25 @@ async def health_check():
         "status": "healthy",
         "gemini_connected": gemini_service.model is not None,
         "google_sheets_configured": bool(GOOGLE_SHEETS_ID),
-        "places_api_enabled": PLACES_API_ENABLED
+        "places_api_enabled": PLACES_API_ENABLED,
+        "gemini_admission": gemini_admission.stats(),
+        "overpass_endpoints": get_endpoint_stats(),
+        "shop_index": get_shop_index().stats(),
+        "shop_catalog": get_shop_catalog().stats(),
+        "circuit_breakers": {
+            "overpass": overpass_breaker.stats(),
+            "gemini": gemini_breaker.stats(),
+            "google_sheets": sheets_write_breaker.stats()
+        }
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Endpoint xuất số liệu vận hành theo định dạng text của Prometheus"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -171,65 +559,38 @@ async def chat(request: ChatRequest):
         HTTPException: Khi có lỗi xử lý
     """
     try:
-        logger.info(f"Nhận request: lat={request.lat}, lon={request.lon}, message='{request.message[:50]}...'")
+        budget = LatencyBudget(CHAT_DEADLINE_SECONDS)
+        degraded = DegradedFlags()
         
-        # Lấy các tham số từ request hoặc dùng giá trị mặc định
-        priority_radius = request.priority_radius_km or PRIORITY_RADIUS_KM
-        max_radius = request.max_radius_km or MAX_RADIUS_KM
-        max_shops = request.max_shops or MAX_SHOPS
+        # Bước 0: Phân loại câu hỏi, câu hỏi thuần thời trang / chào hỏi không cần tìm kiếm
+        intent = classify_intent(request.message)
         
-        logger.info(f"Tham số tìm kiếm: bán kính ưu tiên={priority_radius}km, bán kính tối đa={max_radius}km, số lượng={max_shops}")
-        
-        # Bước 1: Tìm kiếm cửa hàng từ OpenStreetMap
-        all_shops = search_nearby_shops(
-            lat=request.lat,
-            lon=request.lon,
-            radius_meters=int(priority_radius * 1000),
-            keyword="cửa hàng quần áo"
-        )
-        logger.info(f"Tìm thấy {len(all_shops)} cửa hàng từ OpenStreetMap")
-        
-        # Mở rộng bán kính nếu chưa đủ
-        if len(all_shops) < max_shops and max_radius > priority_radius:
-            logger.info(f"Mở rộng bán kính tìm kiếm đến {max_radius}km...")
-            more_shops = search_nearby_shops(
-                lat=request.lat,
-                lon=request.lon,
-                radius_meters=int(max_radius * 1000),
-                keyword="cửa hàng quần áo"
-            )
-            all_shops = _merge_shops_without_duplicates(all_shops, more_shops)
-            logger.info(f"Tổng cộng tìm thấy {len(all_shops)} cửa hàng sau khi mở rộng")
-        
-        # Bước 2: Lọc và sắp xếp theo khoảng cách
-        nearby_shops = filter_shops_by_radius(
-            user_lat=request.lat,
-            user_lon=request.lon,
-            shops=all_shops,
-            radius_km=max_radius,
-            limit=max_shops
-        )
-        logger.info(f"Cửa hàng trong bán kính {max_radius}km: {len(nearby_shops)}")
-        
-        # Bước 3: Lưu các cửa hàng vào Google Sheets (nền, không chặn response)
-        if nearby_shops and GOOGLE_SHEETS_ID:
-            try:
-                shops_to_save = _prepare_shops_for_saving(nearby_shops)
-                added_count = add_shops_to_sheet_batch(GOOGLE_SHEETS_ID, shops_to_save, "Trang tính 1")
-                if added_count > 0:
-                    logger.info(f"Đã lưu {added_count} cửa hàng mới vào Google Sheets")
-            except Exception as e:
-                logger.error(f"Lỗi khi lưu vào Google Sheets: {str(e)}", exc_info=True)
+        # Bước 1-3: Tìm kiếm, lọc và lưu cửa hàng
+        if intent == INTENT_CHAT_ONLY:
+            nearby_shops = await _find_cached_nearby_shops(request)
+        else:
+            nearby_shops = await _find_nearby_shops(request, budget, degraded)
         
         # Bước 4: Gọi Gemini AI để sinh nội dung tư vấn
         gemini_service = get_gemini_service()
         user_location = {"lat": request.lat, "lon": request.lon}
         
-        ai_message = gemini_service.generate_fashion_advice(
-            shops=nearby_shops,
-            user_location=user_location,
-            user_query=request.message
-        )
+        started = time.perf_counter()
+        try:
+            ai_message = await asyncio.wait_for(
+                gemini_service.generate_fashion_advice(
+                    shops=nearby_shops,
+                    user_location=user_location,
+                    user_query=request.message
+                ),
+                timeout=budget.stage_timeout(GEMINI_STAGE_SECONDS)
+            )
+        except asyncio.TimeoutError:
+            ai_message = gemini_service._generate_fallback_response(nearby_shops, request.message)
+            degraded.ai_message = True
+            UPSTREAM_TIMEOUTS.inc(service='gemini')
+            logger.warning("Gemini quá hạn, dùng phản hồi mặc định")
+        STAGE_LATENCY.observe(time.perf_counter() - started, stage='gemini')
         
         # Bước 5: Sinh gợi ý sản phẩm cho từng cửa hàng
         suggestions = gemini_service.generate_item_suggestions(nearby_shops)
@@ -239,10 +600,16 @@ async def chat(request: ChatRequest):
         
         logger.info(f"Trả về {len(shops_response)} cửa hàng và AI message")
         
-        return ChatResponse(
+        # Tự serialize một lần để đo kích thước phản hồi
+        body = ChatResponse(
             shops=shops_response,
-            ai_message=ai_message
-        )
+            ai_message=ai_message,
+            intent=intent,
+            degraded=degraded
+        ).model_dump_json()
+        _record_chat_metrics('chat', intent, degraded, len(shops_response), len(body.encode('utf-8')))
+        
+        return Response(content=body, media_type="application/json")
         
     except ValueError as e:
         logger.error(f"Lỗi validate dữ liệu: {str(e)}")
@@ -255,6 +622,95 @@ async def chat(request: ChatRequest):
         )
 
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Endpoint tìm kiếm và tư vấn dạng streaming (Server-Sent Events)
+    
+    Gửi danh sách cửa hàng dần theo từng nhóm ô lưới tải xong, sau đó gửi dần nội dung AI
+    khi Gemini sinh ra. Các sự kiện: 'shops' (danh sách ShopResponse, có thể gửi nhiều lần,
+    lần sau thay thế lần trước; lần cuối là kết quả đầy đủ), 'degraded' (DegradedFlags, nếu có),
+    'token' ({"text": ...}), 'done', 'error'.
+    
+    Args:
+        request: ChatRequest chứa vị trí và câu hỏi người dùng
+    
+    Returns:
+        StreamingResponse dạng text/event-stream
+    """
+    async def event_stream():
+        sent_bytes = 0
+        try:
+            degraded = DegradedFlags()
+            intent = classify_intent(request.message)
+            
+            gemini_service = get_gemini_service()
+            
+            if intent == INTENT_CHAT_ONLY:
+                nearby_shops = await _find_cached_nearby_shops(request)
+            else:
+                # Gửi kết quả tạm ngay khi có, trong lúc tìm kiếm vẫn tiếp tục
+                partial_results: asyncio.Queue = asyncio.Queue()
+                search = asyncio.create_task(
+                    _find_nearby_shops(request, LatencyBudget(CHAT_DEADLINE_SECONDS), degraded, partial_results)
+                )
+                try:
+                    while not search.done():
+                        next_partial = asyncio.ensure_future(partial_results.get())
+                        await asyncio.wait({search, next_partial}, return_when=asyncio.FIRST_COMPLETED)
+                        if not next_partial.done():
+                            next_partial.cancel()
+                            continue
+                        partial_shops = next_partial.result()
+                        partial_response = _format_shops_response(
+                            partial_shops, gemini_service.generate_item_suggestions(partial_shops)
+                        )
+                        event = _sse_event('shops', [shop.model_dump() for shop in partial_response])
+                        sent_bytes += len(event.encode('utf-8'))
+                        yield event
+                finally:
+                    search.cancel()
+                nearby_shops = search.result()
+            
+            suggestions = gemini_service.generate_item_suggestions(nearby_shops)
+            shops_response = _format_shops_response(nearby_shops, suggestions)
+            
+            # Gửi cửa hàng trước để client hiển thị bản đồ ngay
+            # (câu hỏi chat_only không gửi để giữ nguyên các cửa hàng đang hiển thị)
+            if intent != INTENT_CHAT_ONLY:
+                event = _sse_event('shops', [shop.model_dump() for shop in shops_response])
+                sent_bytes += len(event.encode('utf-8'))
+                yield event
+            if degraded.shops or degraded.persistence:
+                yield _sse_event('degraded', degraded.model_dump())
+            
+            user_location = {"lat": request.lat, "lon": request.lon}
+            started = time.perf_counter()
+            async for text in gemini_service.stream_fashion_advice(
+                shops=nearby_shops,
+                user_location=user_location,
+                user_query=request.message
+            ):
+                event = _sse_event('token', {'text': text})
+                sent_bytes += len(event.encode('utf-8'))
+                yield event
+            STAGE_LATENCY.observe(time.perf_counter() - started, stage='gemini')
+            
+            logger.info(f"Đã stream {len(shops_response)} cửa hàng và AI message")
+            _record_chat_metrics('chat_stream', intent, degraded, len(shops_response), sent_bytes)
+            yield _sse_event('done', {})
+            
+        except Exception as e:
+            logger.error(f"Lỗi xử lý request stream: {str(e)}", exc_info=True)
+            yield _sse_event('error', {'detail': "Lỗi xử lý yêu cầu. Vui lòng thử lại sau."})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # Chạy server nếu file được thực thi trực tiếp
 if __name__ == "__main__":
     import uvicorn
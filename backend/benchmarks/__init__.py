@@ -0,0 +1,2 @@
+# benchmarks - Bộ đo hiệu năng chạy offline (không gọi mạng)
+# Chạy từ thư mục backend, ví dụ: python -m benchmarks.bench_hotpaths --output results.json
@@ -0,0 +1,233 @@
+# bench_hotpaths.py - Microbenchmark cho các hàm xử lý địa lý và chuẩn hóa dữ liệu
+# Chạy offline với dữ liệu giả lập từ 10 đến 100k phần tử, xuất kết quả dạng JSON
+#
+# Ví dụ (từ thư mục backend):
+#   python -m benchmarks.bench_hotpaths --output baseline.json
+#   python -m benchmarks.bench_hotpaths --compare baseline.json --threshold 0.2
+
+import os
+import sys
+import json
+import time
+import timeit
+import logging
+import argparse
+import platform
+import statistics
+from typing import Any, Callable, Dict, List, Optional
+
+# Cho phép chạy trực tiếp bằng đường dẫn file (python benchmarks/bench_hotpaths.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import CENTER_LAT, CENTER_LON, make_shops, make_osm_elements  # noqa: E402
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+DEFAULT_REPEAT = 5
+MIN_RUN_SECONDS = 0.2  # Mỗi lần đo chạy đủ số vòng để kéo dài ít nhất chừng này
+
+
+def _load_targets() -> Dict[str, Callable[[int], Callable[[], Any]]]:
+    """
+    Import các hàm cần đo và trả về {tên benchmark: hàm chuẩn bị}
+
+    Hàm chuẩn bị nhận kích thước dữ liệu, sinh dữ liệu (không tính giờ) và trả về
+    hàm không tham số sẽ được đo.
+    """
+    from geofilter import (
+        calculate_distance,
+        filter_shops_by_radius,
+        static_priority_score,
+        STATIC_SCORE_KEY,
+        _calculate_priority_score
+    )
+    from places_service import _normalize_shop_data, _build_overpass_query, _extract_coordinates
+    from app import _merge_shops_without_duplicates
+
+    def calculate_distance_case(size: int):
+        points = [(shop['lat'], shop['lon']) for shop in make_shops(size)]
+
+        def run():
+            for lat, lon in points:
+                calculate_distance(CENTER_LAT, CENTER_LON, lat, lon)
+        return run
+
+    def filter_shops_case(size: int):
+        shops = make_shops(size)
+
+        def run():
+            filter_shops_by_radius(CENTER_LAT, CENTER_LON, shops, radius_km=20.0, limit=30)
+        return run
+
+    def with_static_scores(shops):
+        # Như cửa hàng đã qua bước nạp (chuẩn hóa OSM, chỉ mục không gian): điểm tĩnh tính sẵn
+        return [{**shop, STATIC_SCORE_KEY: static_priority_score(shop)} for shop in shops]
+
+    def filter_shops_static_case(size: int):
+        shops = with_static_scores(make_shops(size))
+
+        def run():
+            filter_shops_by_radius(CENTER_LAT, CENTER_LON, shops, radius_km=20.0, limit=30)
+        return run
+
+    def priority_score_case(size: int, precomputed: bool = False):
+        shops = make_shops(size)
+        if precomputed:
+            shops = with_static_scores(shops)
+        distances = [index % 50 / 2 for index in range(size)]
+
+        def run():
+            for shop, distance in zip(shops, distances):
+                _calculate_priority_score(shop, distance)
+        return run
+
+    def normalize_shop_case(size: int):
+        elements = [
+            (element, _extract_coordinates(element)) for element in make_osm_elements(size)
+        ]
+
+        def run():
+            for element, (lat, lon) in elements:
+                _normalize_shop_data(element, lat, lon)
+        return run
+
+    def build_query_case(size: int):
+        radii = [1000 + (index % 50) * 1000 for index in range(size)]
+
+        def run():
+            for radius in radii:
+                _build_overpass_query(CENTER_LAT, CENTER_LON, radius)
+        return run
+
+    def merge_shops_case(size: int):
+        # Một nửa danh sách thứ hai trùng với danh sách thứ nhất
+        first = make_shops(size, seed=1)
+        second = first[: size // 2] + make_shops(size - size // 2, seed=2)
+
+        def run():
+            _merge_shops_without_duplicates(first, second)
+        return run
+
+    return {
+        'geofilter.calculate_distance': calculate_distance_case,
+        'geofilter.filter_shops_by_radius': filter_shops_case,
+        'geofilter.filter_shops_by_radius[static_score]': filter_shops_static_case,
+        'geofilter._calculate_priority_score': priority_score_case,
+        'geofilter._calculate_priority_score[static_score]': lambda size: priority_score_case(size, precomputed=True),
+        'places_service._normalize_shop_data': normalize_shop_case,
+        'places_service._build_overpass_query': build_query_case,
+        'app._merge_shops_without_duplicates': merge_shops_case,
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """
+    Đo thời gian chạy fn
+
+    Số vòng mỗi lần đo được chọn tự động (timeit.autorange) để kéo dài ít nhất
+    MIN_RUN_SECONDS; kết quả là thời gian cho một lần gọi fn.
+    """
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= MIN_RUN_SECONDS:
+            break
+        number *= 2 if elapsed * 10 >= MIN_RUN_SECONDS else 10
+
+    samples = [elapsed / number] + [timer.timeit(number) / number for _ in range(repeat - 1)]
+    return {
+        'number': number,
+        'repeat': repeat,
+        'best_s': min(samples),
+        'median_s': statistics.median(samples),
+        'stdev_s': statistics.stdev(samples) if len(samples) > 1 else 0.0
+    }
+
+
+def run_benchmarks(sizes: List[int], repeat: int, name_filter: Optional[str] = None) -> Dict[str, Any]:
+    """Chạy toàn bộ benchmark và trả về kết quả dạng dictionary (dùng để xuất JSON)"""
+    targets = _load_targets()
+    results = []
+
+    for name, prepare in targets.items():
+        if name_filter and name_filter not in name:
+            continue
+        for size in sizes:
+            stats = measure(prepare(size), repeat)
+            stats.update({'name': name, 'size': size, 'per_item_ns': stats['best_s'] / size * 1e9})
+            results.append(stats)
+            print(
+                f"{name:<50} n={size:<7} best={stats['best_s'] * 1000:10.3f} ms "
+                f"({stats['per_item_ns']:9.1f} ns/phần tử)",
+                file=sys.stderr
+            )
+
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    So sánh với kết quả cũ, trả về các trường hợp chậm hơn quá threshold (vd. 0.2 = 20%)
+    """
+    previous = {(row['name'], row['size']): row for row in baseline.get('results', [])}
+    regressions = []
+
+    for row in current['results']:
+        old = previous.get((row['name'], row['size']))
+        if not old or not old['best_s']:
+            continue
+        ratio = row['best_s'] / old['best_s']
+        row['baseline_best_s'] = old['best_s']
+        row['ratio'] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(row)
+
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Microbenchmark các hàm xử lý địa lý / chuẩn hóa dữ liệu")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="Các kích thước dữ liệu, phân tách bằng dấu phẩy")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Số lần đo mỗi trường hợp")
+    parser.add_argument('--filter', dest='name_filter', help="Chỉ chạy benchmark có tên chứa chuỗi này")
+    parser.add_argument('--output', help="Ghi kết quả JSON vào file (mặc định in ra stdout)")
+    parser.add_argument('--compare', help="File JSON kết quả cũ để so sánh")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Ngưỡng chậm đi (tỉ lệ) bị coi là regression khi so sánh")
+    args = parser.parse_args(argv)
+
+    # Tắt log của các module để không ảnh hưởng kết quả đo
+    logging.disable(logging.CRITICAL)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    report = run_benchmarks(sizes, max(args.repeat, 1), args.name_filter)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report['regressions'] = [
+            {'name': row['name'], 'size': row['size'], 'ratio': row['ratio']} for row in regressions
+        ]
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    for row in regressions:
+        print(f"REGRESSION {row['name']} n={row['size']}: chậm hơn {(row['ratio'] - 1) * 100:.0f}%", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# fakes.py - Dịch vụ giả lập chạy cục bộ cho load test: Overpass, Gemini và Google Sheets
+# Không gọi dịch vụ thật nên không bị giới hạn tốc độ hay tính phí
+
+import re
+import json
+import time
+import socket
+import random
+import asyncio
+import threading
+from urllib.parse import parse_qs
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.synthetic import make_osm_elements
+
+BBOX_PATTERN = re.compile(r"\((-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)\)")
+AROUND_PATTERN = re.compile(r"\(around:(\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)\)")
+
+
+# ===== Overpass =====
+
+def _element_coordinates(element: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    if 'lat' in element and 'lon' in element:
+        return element['lat'], element['lon']
+    center = element.get('center')
+    if center:
+        return center['lat'], center['lon']
+    return None
+
+
+class OverpassReplay:
+    """
+    Phát lại phản hồi Overpass đã ghi sẵn, chỉ trả các element nằm trong vùng được hỏi
+
+    Hỗ trợ query theo bounding box (khi bật tile cache) và theo around: (khi tắt),
+    nên dữ liệu được phân bổ vào ô lưới giống như với Overpass thật.
+    """
+
+    def __init__(self, elements: List[Dict[str, Any]], latency: float = 0.0):
+        self.elements = [
+            (coordinates, element) for element in elements
+            if (coordinates := _element_coordinates(element)) is not None
+        ]
+        self.latency = latency
+        self.requests = 0
+
+    @classmethod
+    def from_file(cls, path: str, latency: float = 0.0) -> 'OverpassReplay':
+        """Đọc file JSON phản hồi Overpass ({"elements": [...]})"""
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f).get('elements', []), latency)
+
+    @classmethod
+    def synthetic(cls, count: int, latency: float = 0.0) -> 'OverpassReplay':
+        """Dùng element giả lập quanh Hà Nội"""
+        return cls(make_osm_elements(count), latency)
+
+    def answer(self, query: str) -> Dict[str, Any]:
+        """Trả về phản hồi cho một Overpass QL query"""
+        self.requests += 1
+        bboxes = [tuple(map(float, match)) for match in BBOX_PATTERN.findall(query)]
+        around = AROUND_PATTERN.search(query)
+
+        selected = []
+        for (lat, lon), element in self.elements:
+            if bboxes:
+                if any(s <= lat <= n and w <= lon <= e for s, w, n, e in bboxes):
+                    selected.append(element)
+            elif around:
+                radius_km = float(around.group(1)) / 1000
+                center_lat, center_lon = float(around.group(2)), float(around.group(3))
+                if abs(lat - center_lat) * 111.32 <= radius_km and abs(lon - center_lon) * 111.32 * 0.93 <= radius_km:
+                    selected.append(element)
+
+        return {'version': 0.6, 'generator': 'overpass-replay', 'elements': selected}
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class OverpassStubServer:
+    """Server HTTP cục bộ giả lập endpoint /api/interpreter của Overpass (chạy trong thread riêng)"""
+
+    def __init__(self, replay: OverpassReplay, port: Optional[int] = None):
+        self.replay = replay
+        self.port = port or _free_port()
+        self.url = f"http://127.0.0.1:{self.port}/api/interpreter"
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _build_app(self):
+        from starlette.applications import Starlette
+        from starlette.requests import Request
+        from starlette.responses import JSONResponse
+        from starlette.routing import Route
+
+        replay = self.replay
+
+        async def interpreter(request: Request):
+            # Body dạng application/x-www-form-urlencoded: data=<query>
+            form = parse_qs((await request.body()).decode('utf-8'))
+            if replay.latency:
+                await asyncio.sleep(replay.latency)
+            return JSONResponse(replay.answer(form.get('data', [''])[0]))
+
+        return Starlette(routes=[Route('/api/interpreter', interpreter, methods=['POST'])])
+
+    def start(self):
+        """Khởi động server và chờ đến khi sẵn sàng nhận request"""
+        import uvicorn
+
+        config = uvicorn.Config(self._build_app(), host='127.0.0.1', port=self.port, log_level='warning', lifespan='off')
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Overpass stub server không khởi động được")
+            time.sleep(0.01)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+
+# ===== Gemini =====
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeStream:
+    """Phản hồi dạng stream: trả từng đoạn văn bản sau mỗi khoảng trễ"""
+
+    def __init__(self, chunks: List[str], delay: float):
+        self._chunks = chunks
+        self._delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield _FakeResponse(chunk)
+
+
+class FakeGenerativeModel:
+    """Thay thế genai.GenerativeModel: trả lời sau một độ trễ cấu hình được, không gọi API"""
+
+    def __init__(self, latency: float = 0.8, jitter: float = 0.2, stream_chunks: int = 8, seed: int = 42):
+        """
+        Args:
+            latency: Độ trễ trung bình mỗi lời gọi (giây)
+            jitter: Biên dao động tương đối của độ trễ (0.2 = ±20%)
+            stream_chunks: Số đoạn văn bản khi gọi với stream=True
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_chunks = stream_chunks
+        self.calls = 0
+        self._rng = random.Random(seed)
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def _answer(self, prompt: str) -> str:
+        return (
+            "Chào bạn! Dựa trên các cửa hàng gần đây, bạn có thể ghé thử vài địa chỉ trong danh sách. "
+            f"(phản hồi giả lập cho prompt {len(prompt)} ký tự)"
+        )
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        self.calls += 1
+        text = self._answer(prompt)
+        delay = self._delay()
+
+        if not stream:
+            await asyncio.sleep(delay)
+            return _FakeResponse(text)
+
+        size = max(1, -(-len(text) // self.stream_chunks))
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        return _FakeStream(chunks, delay / len(chunks))
+
+
+# ===== Google Sheets =====
+
+class FakeWorksheet:
+    """Worksheet trong bộ nhớ với các phương thức gspread mà connector dùng"""
+
+    def __init__(self, title: str, write_latency: float = 0.0):
+        self.title = title
+        self.rows: List[List[Any]] = []
+        self.write_latency = write_latency
+        self._lock = threading.Lock()
+
+    def col_values(self, col: int) -> List[Any]:
+        with self._lock:
+            return [row[col - 1] if len(row) >= col else '' for row in self.rows]
+
+    def get_all_records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            if not self.rows:
+                return []
+            header = self.rows[0]
+            return [dict(zip(header, row)) for row in self.rows[1:]]
+
+    def append_row(self, row: List[Any], **kwargs):
+        self.append_rows([row])
+
+    def append_rows(self, rows: List[List[Any]], **kwargs):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        with self._lock:
+            self.rows.extend(list(row) for row in rows)
+
+
+class FakeSpreadsheet:
+    def __init__(self, write_latency: float = 0.0):
+        self.write_latency = write_latency
+        self._worksheets: Dict[str, FakeWorksheet] = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        from gspread.exceptions import WorksheetNotFound
+
+        if title not in self._worksheets:
+            raise WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 10) -> FakeWorksheet:
+        worksheet = self._worksheets[title] = FakeWorksheet(title, self.write_latency)
+        return worksheet
+
+    @property
+    def sheet1(self) -> FakeWorksheet:
+        return self.worksheets()[0]
+
+
+class FakeGspreadClient:
+    """Thay thế gspread.Client: mỗi spreadsheet ID là một spreadsheet trong bộ nhớ"""
+
+    def __init__(self, write_latency: float = 0.0):
+        self.write_latency = write_latency
+        self._spreadsheets: Dict[str, FakeSpreadsheet] = {}
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        if key not in self._spreadsheets:
+            self._spreadsheets[key] = FakeSpreadsheet(self.write_latency)
+        return self._spreadsheets[key]
+
+    def row_count(self) -> int:
+        """Tổng số dòng đã ghi (kể cả dòng tiêu đề)"""
+        return sum(
+            len(worksheet.rows)
+            for spreadsheet in self._spreadsheets.values()
+            for worksheet in spreadsheet.worksheets()
+        )
@@ -0,0 +1,253 @@
+# load_test.py - Load test end-to-end cho /chat với Overpass, Gemini và Google Sheets giả lập
+# Gửi request đến app.app (in-process qua ASGI) với số request đồng thời cố định,
+# báo cáo throughput và độ trễ p50/p95/p99 cho từng bước của pipeline
+#
+# Ví dụ (từ thư mục backend):
+#   python -m benchmarks.load_test --concurrency 20 --requests 500
+#   python -m benchmarks.load_test --endpoint /chat/stream --gemini-latency 1.5 --output load.json
+#   python -m benchmarks.load_test --overpass-fixture recorded_overpass.json --overpass-latency 0.5
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+# Cho phép chạy trực tiếp bằng đường dẫn file (python benchmarks/load_test.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import CENTER_LAT, CENTER_LON, random_point  # noqa: E402
+from benchmarks.fakes import (  # noqa: E402
+    OverpassReplay,
+    OverpassStubServer,
+    FakeGenerativeModel,
+    FakeGspreadClient
+)
+
+LOAD_TEST_SHEET_ID = 'load-test-sheet'
+
+MESSAGES = [
+    "Tìm cửa hàng quần áo gần đây",
+    "Mua áo khoác ở đâu?",
+    "Shop nào gần nhất đang giảm giá?",
+    "Tìm cửa hàng bán đầm dự tiệc",
+    "Xin chào",
+    "Mặc gì đi đám cưới?",
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Percentile theo phương pháp nội suy tuyến tính (p trong khoảng 0-100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) * 1000 if values else 0.0,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': max(values) * 1000 if values else 0.0
+    }
+
+
+class StageRecorder:
+    """Ghi lại từng mẫu độ trễ theo bước (metrics chỉ giữ histogram theo bucket, không đủ để tính percentile)"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def install(self):
+        from metrics import STAGE_LATENCY
+
+        original = STAGE_LATENCY.observe
+
+        def observe(value: float, **labels):
+            self.samples[labels.get('stage', '')].append(value)
+            original(value, **labels)
+
+        STAGE_LATENCY.observe = observe
+
+
+def install_fakes(args, overpass_url: str) -> Dict[str, Any]:
+    """Thay các dịch vụ bên ngoài bằng bản giả lập (gọi trước khi chạy lifespan của app)"""
+    import app as app_module
+    import places_service
+    import gemini_service
+    import gsheet_connector
+    import shop_catalog
+    from rate_limiter import TokenBucket
+    from tile_cache import get_tile_cache
+
+    # Overpass: chỉ dùng stub server, bỏ các mirror thật
+    places_service.OVERPASS_API_URLS[:] = [overpass_url]
+    places_service._endpoint_stats[overpass_url] = places_service.EndpointStats(overpass_url)
+    places_service.PLACES_API_ENABLED = True
+    get_tile_cache().clear()
+
+    # Gemini: model giả lập, hạn mức theo tham số (mặc định không giới hạn vì không có quota thật)
+    fake_model = FakeGenerativeModel(latency=args.gemini_latency, jitter=args.gemini_jitter)
+    gemini_service.get_gemini_service().model = fake_model
+    gemini_service.ADVICE_CACHE_ENABLED = not args.no_advice_cache
+    gemini_service.advice_cache.clear()
+    gemini_service.admission.requests = TokenBucket(args.gemini_rpm)
+    gemini_service.admission.tokens = TokenBucket(args.gemini_tpm)
+
+    # Google Sheets: client gspread trong bộ nhớ, ghi nền theo chu kỳ ngắn
+    fake_sheets = FakeGspreadClient(write_latency=args.sheets_latency)
+    connector = gsheet_connector.get_connector()
+    connector.client = fake_sheets
+    app_module.GOOGLE_SHEETS_ID = LOAD_TEST_SHEET_ID
+    gsheet_connector.get_write_queue().flush_interval = args.flush_interval
+    shop_catalog.get_shop_catalog().refresh_interval = args.catalog_refresh
+
+    return {'gemini': fake_model, 'sheets': fake_sheets}
+
+
+async def run_load(args, recorder: StageRecorder) -> Dict[str, Any]:
+    """Chạy load test và trả về kết quả"""
+    import httpx
+    import app as app_module
+
+    rng = random.Random(args.seed)
+    requests_left = args.requests
+    latencies: List[float] = []
+    status_counts: Dict[str, int] = defaultdict(int)
+
+    def next_payload() -> Optional[Dict[str, Any]]:
+        nonlocal requests_left
+        if requests_left <= 0:
+            return None
+        requests_left -= 1
+        lat, lon = random_point(rng, CENTER_LAT, CENTER_LON, args.spread_km)
+        return {'lat': lat, 'lon': lon, 'message': rng.choice(MESSAGES)}
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with app_module.app.router.lifespan_context(app_module.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://load-test', timeout=60) as client:
+
+            async def worker():
+                while (payload := next_payload()) is not None:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post(args.endpoint, json=payload)
+                        status = str(response.status_code)
+                        if args.endpoint.endswith('/stream') and 'event: error' in response.text:
+                            status = 'stream_error'
+                    except Exception as e:
+                        status = type(e).__name__
+                    latencies.append(time.perf_counter() - started)
+                    status_counts[status] += 1
+
+            # Làm nóng: một request để khởi tạo client, cache kết nối...
+            if args.warmup:
+                await client.post(args.endpoint, json={'lat': CENTER_LAT, 'lon': CENTER_LON, 'message': MESSAGES[0]})
+                recorder.samples.clear()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+
+    return {'elapsed_s': elapsed, 'latencies': latencies, 'status': dict(status_counts)}
+
+
+def print_report(report: Dict[str, Any]):
+    print(
+        f"\n{report['requests']} request, đồng thời {report['concurrency']}, "
+        f"{report['elapsed_s']:.2f}s -> {report['throughput_rps']:.1f} req/s, trạng thái {report['status']}",
+        file=sys.stderr
+    )
+    print(f"{'bước':<16}{'số mẫu':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}", file=sys.stderr)
+    for stage, stats in report['stages'].items():
+        print(
+            f"{stage:<16}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+            f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}",
+            file=sys.stderr
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test /chat với dịch vụ giả lập")
+    parser.add_argument('--endpoint', default='/chat', choices=['/chat', '/chat/stream'])
+    parser.add_argument('--concurrency', type=int, default=10, help="Số request chạy đồng thời")
+    parser.add_argument('--requests', type=int, default=200, help="Tổng số request")
+    parser.add_argument('--spread-km', type=float, default=10.0, help="Bán kính rải vị trí người dùng quanh tâm")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false')
+    parser.add_argument('--overpass-fixture', help="File JSON phản hồi Overpass đã ghi (mặc định sinh giả lập)")
+    parser.add_argument('--overpass-elements', type=int, default=5000, help="Số element giả lập khi không có fixture")
+    parser.add_argument('--overpass-latency', type=float, default=0.3, help="Độ trễ stub Overpass (giây)")
+    parser.add_argument('--gemini-latency', type=float, default=0.8, help="Độ trễ trung bình Gemini giả lập (giây)")
+    parser.add_argument('--gemini-jitter', type=float, default=0.2, help="Dao động độ trễ Gemini (tỉ lệ)")
+    parser.add_argument('--gemini-rpm', type=float, default=1e6, help="Hạn mức RPM cho admission control")
+    parser.add_argument('--gemini-tpm', type=float, default=1e9, help="Hạn mức TPM cho admission control")
+    parser.add_argument('--no-advice-cache', action='store_true', help="Tắt cache phản hồi Gemini")
+    parser.add_argument('--sheets-latency', type=float, default=0.2, help="Độ trễ mỗi lần ghi Sheets giả lập (giây)")
+    parser.add_argument('--flush-interval', type=float, default=1.0, help="Chu kỳ ghi nền Google Sheets (giây)")
+    parser.add_argument('--catalog-refresh', type=float, default=5.0, help="Chu kỳ đọc lại danh mục từ sheet giả lập (giây)")
+    parser.add_argument('--output', help="Ghi kết quả JSON vào file (mặc định in ra stdout)")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.CRITICAL)
+
+    if args.overpass_fixture:
+        replay = OverpassReplay.from_file(args.overpass_fixture, args.overpass_latency)
+    else:
+        replay = OverpassReplay.synthetic(args.overpass_elements, args.overpass_latency)
+    server = OverpassStubServer(replay)
+    server.start()
+
+    try:
+        fakes = install_fakes(args, server.url)
+        recorder = StageRecorder()
+        recorder.install()
+        result = asyncio.run(run_load(args, recorder))
+    finally:
+        server.stop()
+
+    stages = {stage: summarize(values) for stage, values in sorted(recorder.samples.items())}
+    stages['total'] = summarize(result['latencies'])
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'endpoint': args.endpoint,
+        'concurrency': args.concurrency,
+        'requests': len(result['latencies']),
+        'elapsed_s': result['elapsed_s'],
+        'throughput_rps': len(result['latencies']) / result['elapsed_s'] if result['elapsed_s'] else 0.0,
+        'status': result['status'],
+        'stages': stages,
+        'upstream_calls': {
+            'overpass': replay.requests,
+            'gemini': fakes['gemini'].calls,
+            'sheets_rows': fakes['sheets'].row_count()
+        }
+    }
+
+    print_report(report)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# synthetic.py - Sinh dữ liệu giả lập (cửa hàng, OSM element) cho benchmark và load test
+# Dữ liệu sinh theo seed cố định để các lần chạy so sánh được với nhau
+
+import math
+import random
+from typing import List, Dict, Any, Tuple
+
+# Tâm mặc định: Hồ Hoàn Kiếm, Hà Nội
+CENTER_LAT = 21.0285
+CENTER_LON = 105.8542
+
+SHOP_TYPES = ["clothes", "fashion", "boutique", "department_store", "mall"]
+BRANDS = ["CANIFA", "YODY", "Routine", "Owen", "Ivy Moda", "Elise", "JUNO", "NEM", "Uniqlo", "Zara"]
+STREETS = ["Trang Tien", "Ba Trieu", "Hang Bai", "Xuan Thuy", "Cau Giay", "Kim Ma", "Lang Ha", "Tay Son"]
+
+
+def random_point(rng: random.Random, lat: float, lon: float, radius_km: float) -> Tuple[float, float]:
+    """Điểm ngẫu nhiên phân bố đều trong hình tròn bán kính radius_km quanh (lat, lon)"""
+    distance = radius_km * math.sqrt(rng.random())
+    bearing = rng.random() * 2 * math.pi
+    dlat = distance * math.cos(bearing) / 111.32
+    dlon = distance * math.sin(bearing) / (111.32 * math.cos(math.radians(lat)))
+    return lat + dlat, lon + dlon
+
+
+def make_shops(
+    count: int,
+    lat: float = CENTER_LAT,
+    lon: float = CENTER_LON,
+    radius_km: float = 30.0,
+    seed: int = 42
+) -> List[Dict[str, Any]]:
+    """
+    Sinh danh sách cửa hàng đã chuẩn hóa (cùng định dạng với places_service)
+
+    Khoảng một nửa cửa hàng có mức giá / khuyến mãi để điểm ưu tiên đa dạng.
+    """
+    rng = random.Random(seed)
+    shops = []
+    for index in range(count):
+        shop_lat, shop_lon = random_point(rng, lat, lon, radius_km)
+        brand = rng.choice(BRANDS)
+        shop_type = rng.choice(SHOP_TYPES)
+        shops.append({
+            'name': f"{brand} {rng.choice(STREETS)} {index}",
+            'address': f"{rng.randint(1, 300)} {rng.choice(STREETS)}, Ha Noi",
+            'lat': shop_lat,
+            'lon': shop_lon,
+            'category': shop_type,
+            'price_range': rng.choice(['', '200k - 800k', '500k - 2tr']),
+            'notes': rng.choice(['', '', 'Giam 20% cuoi tuan']),
+            'phone': '',
+            'website': '',
+            'osm_id': 1_000_000 + index,
+            'source': 'openstreetmap'
+        })
+    return shops
+
+
+def make_osm_elements(
+    count: int,
+    lat: float = CENTER_LAT,
+    lon: float = CENTER_LON,
+    radius_km: float = 30.0,
+    seed: int = 42
+) -> List[Dict[str, Any]]:
+    """Sinh danh sách element giống phản hồi Overpass (`out center`): node có lat/lon, way có center"""
+    rng = random.Random(seed)
+    elements = []
+    for index in range(count):
+        element_lat, element_lon = random_point(rng, lat, lon, radius_km)
+        tags = {
+            'shop': rng.choice(SHOP_TYPES),
+            'addr:housenumber': str(rng.randint(1, 300)),
+            'addr:street': rng.choice(STREETS),
+            'addr:city': 'Ha Noi'
+        }
+        if rng.random() < 0.8:
+            tags['name'] = f"{rng.choice(BRANDS)} {index}"
+        if rng.random() < 0.3:
+            tags['opening_hours'] = 'Mo-Su 08:00-22:00'
+        if rng.random() < 0.2:
+            tags['phone'] = '+84 24 0000 0000'
+
+        if rng.random() < 0.7:
+            elements.append({'type': 'node', 'id': index, 'lat': element_lat, 'lon': element_lon, 'tags': tags})
+        else:
+            elements.append({'type': 'way', 'id': index, 'center': {'lat': element_lat, 'lon': element_lon}, 'tags': tags})
+    return elements
@@ -0,0 +1,129 @@
+# circuit_breaker.py - Module circuit breaker dùng chung cho các dịch vụ bên ngoài
+# Khi dịch vụ lỗi liên tục, breaker mở và từ chối lời gọi ngay lập tức thay vì chờ hết timeout
+
+import os
+import time
+import threading
+import logging
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RECOVERY_SECONDS = float(os.getenv('CIRCUIT_RECOVERY_SECONDS', '30'))
+CIRCUIT_HALF_OPEN_MAX_CALLS = int(os.getenv('CIRCUIT_HALF_OPEN_MAX_CALLS', '1'))
+
+# Các trạng thái
+STATE_CLOSED = "closed"  # Hoạt động bình thường
+STATE_OPEN = "open"  # Đang từ chối mọi lời gọi
+STATE_HALF_OPEN = "half_open"  # Cho phép một số lời gọi thử để kiểm tra dịch vụ đã hồi phục chưa
+
+
+class CircuitOpenError(Exception):
+    """Breaker đang mở, lời gọi bị từ chối mà không chạm tới dịch vụ"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker ba trạng thái: closed -> open -> half_open -> closed
+
+    Sau failure_threshold lỗi liên tiếp breaker chuyển sang open. Hết recovery_seconds
+    breaker chuyển sang half_open và cho phép tối đa half_open_max_calls lời gọi thử:
+    thành công thì đóng lại, lỗi thì mở lại và chờ thêm một chu kỳ.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        recovery_seconds: float = CIRCUIT_RECOVERY_SECONDS,
+        half_open_max_calls: int = CIRCUIT_HALF_OPEN_MAX_CALLS
+    ):
+        """
+        Args:
+            name: Tên dịch vụ dùng trong log
+            failure_threshold: Số lỗi liên tiếp để mở breaker
+            recovery_seconds: Thời gian mở trước khi cho gọi thử (giây)
+            half_open_max_calls: Số lời gọi thử đồng thời ở trạng thái half_open
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened_count = 0
+
+    @property
+    def state(self) -> str:
+        """Trạng thái hiện tại (open tự chuyển sang half_open khi hết thời gian chờ)"""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+            self._state = STATE_HALF_OPEN
+            self._trial_calls = 0
+            logger.info(f"[{self.name}] Circuit breaker chuyển sang half_open, cho phép gọi thử")
+        return self._state
+
+    def before_call(self):
+        """
+        Kiểm tra trước khi gọi dịch vụ
+
+        Raises:
+            CircuitOpenError: Khi breaker đang mở hoặc đã đủ lời gọi thử ở half_open
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == STATE_CLOSED:
+                return
+            if state == STATE_HALF_OPEN and self._trial_calls < self.half_open_max_calls:
+                self._trial_calls += 1
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"Circuit breaker {self.name} đang mở")
+
+    def record_success(self):
+        """Ghi nhận lời gọi thành công"""
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info(f"[{self.name}] Dịch vụ đã hồi phục, đóng circuit breaker")
+            self._state = STATE_CLOSED
+            self._failures = 0
+            self._trial_calls = 0
+
+    def record_failure(self):
+        """Ghi nhận lời gọi lỗi, mở breaker khi đủ ngưỡng hoặc khi lời gọi thử thất bại"""
+        with self._lock:
+            self._failures += 1
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != STATE_OPEN:
+                    self.opened_count += 1
+                    logger.warning(
+                        f"[{self.name}] Mở circuit breaker sau {self._failures} lỗi liên tiếp, "
+                        f"từ chối lời gọi trong {self.recovery_seconds}s"
+                    )
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """Bỏ qua lời gọi đã được cho phép nhưng không thực sự chạm tới dịch vụ (trả lại lượt gọi thử)"""
+        with self._lock:
+            if self._state == STATE_HALF_OPEN and self._trial_calls > 0:
+                self._trial_calls -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê circuit breaker"""
+        return {
+            'state': self.state,
+            'consecutive_failures': self._failures,
+            'opened_count': self.opened_count,
+            'rejected': self.rejected
+        }
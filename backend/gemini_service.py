@@ -2,8 +2,17 @@
 # Sử dụng thư viện google-generativeai
 
 import google.generativeai as genai
-from typing import List, Dict, Any
+from google.api_core import exceptions as google_exceptions
+from typing import List, Dict, Any, AsyncIterator
+from singleflight import SingleFlight, coalesce
+from response_cache import ResponseCache
+from rate_limiter import AdmissionController, AdmissionRejected
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics import GEMINI_PROMPT_TOKENS, UPSTREAM_ERRORS
+from text_utils import normalize_query
 import os
+import asyncio
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,6 +20,109 @@ logger = logging.getLogger(__name__)
 # Model name
 GEMINI_MODEL = 'gemini-flash-latest'
 
+# Độ chính xác khi làm tròn vị trí người dùng để gộp request (3 ~ 110m)
+COALESCE_PRECISION = int(os.getenv('GEMINI_COALESCE_PRECISION', '3'))
+
+# Cấu hình cache phản hồi tư vấn
+ADVICE_CACHE_ENABLED = os.getenv('GEMINI_CACHE_ENABLED', 'true').lower() == 'true'
+ADVICE_CACHE_MAX_ENTRIES = int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', '1000'))
+ADVICE_CACHE_TTL_SECONDS = float(os.getenv('GEMINI_CACHE_TTL_SECONDS', '3600'))
+ADVICE_CACHE_DISK_PATH = os.getenv('GEMINI_CACHE_DISK_PATH', '')
+ADVICE_CACHE_DISK_MAX_ENTRIES = int(os.getenv('GEMINI_CACHE_DISK_MAX_ENTRIES', '10000'))
+
+# Ngân sách prompt: số token ước lượng tối đa và số cửa hàng tối đa đưa vào prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv('GEMINI_PROMPT_TOKEN_BUDGET', '1500'))
+PROMPT_MAX_SHOPS = int(os.getenv('GEMINI_PROMPT_MAX_SHOPS', '15'))
+CHARS_PER_TOKEN = 3  # Ước lượng thô cho tiếng Việt có dấu
+
+# Kiểm soát đầu vào: hạn mức RPM/TPM của Gemini, hàng đợi chờ và số lần thử lại khi bị 429
+GEMINI_RPM_LIMIT = float(os.getenv('GEMINI_RPM_LIMIT', '15'))
+GEMINI_TPM_LIMIT = float(os.getenv('GEMINI_TPM_LIMIT', '250000'))
+GEMINI_QUEUE_MAX = int(os.getenv('GEMINI_QUEUE_MAX', '20'))
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '2'))
+GEMINI_BACKOFF_BASE_SECONDS = float(os.getenv('GEMINI_BACKOFF_BASE_SECONDS', '1.0'))
+EXPECTED_OUTPUT_TOKENS = 400  # Phản hồi 50-150 từ, tính dư cho tiếng Việt
+
+SHOPS_TABLE_HEADER = "STT|Tên|Địa chỉ|Khoảng cách (km)|Danh mục|Mức giá|Khuyến mãi"
+
+PROMPT_TEMPLATE = """Bạn là Fashion AI - trợ lý thời trang thông minh và thân thiện. 
+
+THÔNG TIN CỬA HÀNG GẦN ĐÂY (để tham khảo khi cần):
+{shops_info}
+
+CÂU HỎI: {user_query}
+
+HƯỚNG DẪN TRẢ LỜI:
+- Trả lời bằng tiếng Việt, thân thiện như đang trò chuyện với bạn bè
+- Tập trung vào câu hỏi của người dùng - có thể là về thời trang, phong cách, xu hướng, cách phối đồ, v.v.
+- Nếu câu hỏi liên quan đến mua sắm hoặc tìm cửa hàng, hãy gợi ý từ danh sách trên
+- Nếu câu hỏi chung về thời trang (xu hướng, phối đồ, chất liệu...), hãy tư vấn chuyên môn
+- Nếu là câu chào hỏi hoặc trò chuyện, hãy đáp lại thân thiện
+- Giữ câu trả lời ngắn gọn (50-150 từ), dễ đọc
+- Có thể dùng emoji phù hợp để tăng tính thân thiện
+
+Trả lời:"""
+
+# Gộp các lời gọi Gemini giống nhau đang chạy đồng thời
+advice_flight = SingleFlight("Gemini")
+
+# Cache phản hồi theo câu hỏi chuẩn hóa + danh sách cửa hàng
+advice_cache = ResponseCache(
+    max_entries=ADVICE_CACHE_MAX_ENTRIES,
+    ttl_seconds=ADVICE_CACHE_TTL_SECONDS,
+    disk_path=ADVICE_CACHE_DISK_PATH or None,
+    max_disk_entries=ADVICE_CACHE_DISK_MAX_ENTRIES
+)
+
+
+# Giới hạn tốc độ gọi Gemini phía client
+admission = AdmissionController(
+    "Gemini",
+    requests_per_minute=GEMINI_RPM_LIMIT,
+    tokens_per_minute=GEMINI_TPM_LIMIT,
+    max_queue=GEMINI_QUEUE_MAX,
+    backoff_base_seconds=GEMINI_BACKOFF_BASE_SECONDS
+)
+
+# Khi Gemini lỗi liên tục thì trả phản hồi mặc định ngay, không chờ hàng đợi / timeout
+gemini_breaker = CircuitBreaker("Gemini")
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của chuỗi (xấp xỉ theo số ký tự)"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _shops_fingerprint(shops: List[Dict[str, Any]]) -> str:
+    """Dấu vân tay danh sách cửa hàng (tên + tọa độ làm tròn), không phụ thuộc vị trí người dùng"""
+    digest = hashlib.sha1()
+    for shop in shops:
+        digest.update(
+            f"{shop.get('name', '')}|{round(float(shop.get('lat') or 0), 4)}|{round(float(shop.get('lon') or 0), 4)}\n".encode('utf-8')
+        )
+    return digest.hexdigest()
+
+
+def _advice_cache_key(shops: List[Dict[str, Any]], user_query: str) -> str:
+    """Khóa cache phản hồi tư vấn"""
+    return f"{normalize_query(user_query)}#{_shops_fingerprint(shops)}"
+
+
+def _is_quota_error(error: Exception) -> bool:
+    """Lỗi hết hạn mức (HTTP 429) từ Gemini"""
+    return isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests))
+
+
+def _advice_key(args: Dict[str, Any]) -> tuple:
+    """Khóa gộp request: câu hỏi chuẩn hóa, vị trí làm tròn và danh sách cửa hàng"""
+    location = args['user_location']
+    return (
+        normalize_query(args['user_query']),
+        round(location.get('lat', 0), COALESCE_PRECISION),
+        round(location.get('lon', 0), COALESCE_PRECISION),
+        tuple(shop.get('name', '') for shop in args['shops'])
+    )
+
 
 class GeminiService:
     """Lớp xử lý gọi Gemini API để sinh nội dung tư vấn thời trang"""
@@ -41,7 +153,8 @@ class GeminiService:
             logger.error(f"Lỗi khởi tạo Gemini: {str(e)}")
             self.model = None
     
-    def generate_fashion_advice(
+    @coalesce(advice_flight, _advice_key)
+    async def generate_fashion_advice(
         self, 
         shops: List[Dict[str, Any]], 
         user_location: Dict[str, float],
@@ -61,60 +174,203 @@ class GeminiService:
         if not self.model:
             return self._generate_fallback_response(shops, user_query)
         
+        cache_key = _advice_cache_key(shops, user_query) if ADVICE_CACHE_ENABLED else None
+        if cache_key:
+            cached = await advice_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Dùng phản hồi Gemini từ cache")
+                return cached
+        
         try:
             prompt = self._build_prompt(shops, user_location, user_query)
-            response = self.model.generate_content(prompt)
+            response = await self._generate_with_admission(prompt)
+            
+            # Chỉ cache phản hồi thật từ model, không cache phản hồi mặc định khi lỗi
+            if cache_key:
+                await advice_cache.set(cache_key, response.text)
             return response.text
+        except (AdmissionRejected, CircuitOpenError) as e:
+            logger.warning(f"Bỏ qua Gemini, trả phản hồi mặc định: {str(e)}")
+            return self._generate_fallback_response(shops, user_query)
         except Exception as e:
             logger.error(f"Lỗi gọi Gemini API: {str(e)}")
             return self._generate_fallback_response(shops, user_query)
     
+    async def stream_fashion_advice(
+        self, 
+        shops: List[Dict[str, Any]], 
+        user_location: Dict[str, float],
+        user_query: str
+    ) -> AsyncIterator[str]:
+        """
+        Sinh nội dung tư vấn dạng streaming, trả ra từng đoạn văn bản khi Gemini sinh xong
+        
+        Args:
+            shops: Danh sách cửa hàng gần đó
+            user_location: Vị trí người dùng {"lat": ..., "lon": ...}
+            user_query: Câu hỏi của người dùng
+        
+        Yields:
+            Các đoạn văn bản của phản hồi
+        """
+        if not self.model:
+            yield self._generate_fallback_response(shops, user_query)
+            return
+        
+        cache_key = _advice_cache_key(shops, user_query) if ADVICE_CACHE_ENABLED else None
+        if cache_key:
+            cached = await advice_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Dùng phản hồi Gemini từ cache")
+                yield cached
+                return
+        
+        parts = []
+        streaming = False
+        try:
+            prompt = self._build_prompt(shops, user_location, user_query)
+            response = await self._generate_with_admission(prompt, stream=True)
+            streaming = True
+            
+            async for chunk in response:
+                text = chunk.text
+                if text:
+                    parts.append(text)
+                    yield text
+        except (AdmissionRejected, CircuitOpenError) as e:
+            logger.warning(f"Bỏ qua Gemini, trả phản hồi mặc định: {str(e)}")
+            if not parts:
+                yield self._generate_fallback_response(shops, user_query)
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client ngắt giữa chừng, không phải lỗi của Gemini: trả lại lượt gọi thử nếu có
+            if streaming:
+                gemini_breaker.release()
+            raise
+        except Exception as e:
+            if streaming:
+                # Lỗi giữa stream (lỗi trước khi stream bắt đầu đã được _generate_with_admission ghi nhận)
+                gemini_breaker.record_failure()
+                UPSTREAM_ERRORS.inc(service='gemini')
+            logger.error(f"Lỗi gọi Gemini API (stream): {str(e)}")
+            # Nếu chưa gửi được gì thì trả phản hồi mặc định, tránh cắt ngang nội dung đã gửi
+            if not parts:
+                yield self._generate_fallback_response(shops, user_query)
+            return
+        
+        gemini_breaker.record_success()
+        if cache_key and parts:
+            await advice_cache.set(cache_key, ''.join(parts))
+    
+    async def _generate_with_admission(self, prompt: str, **kwargs):
+        """
+        Gọi Gemini qua bộ kiểm soát đầu vào, thử lại với backoff khi bị giới hạn hạn mức
+        
+        Với stream=True, breaker chỉ được ghi nhận khi có lỗi trước khi stream bắt đầu;
+        caller ghi nhận thành công / lỗi / hủy sau khi đọc hết stream.
+        
+        Args:
+            prompt: Prompt đã xây dựng
+            **kwargs: Tham số thêm cho generate_content_async (vd. stream=True)
+        
+        Returns:
+            Response của Gemini
+        
+        Raises:
+            AdmissionRejected: Khi hàng đợi chờ đã đầy
+            CircuitOpenError: Khi Gemini đang lỗi liên tục (breaker mở)
+        """
+        token_cost = estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS
+        
+        # Kiểm tra breaker trước khi xếp hàng để không tốn hạn mức khi Gemini đang lỗi
+        gemini_breaker.before_call()
+        
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            try:
+                await admission.acquire(token_cost)
+                response = await self.model.generate_content_async(prompt, **kwargs)
+            except (AdmissionRejected, asyncio.CancelledError):
+                # Bị từ chối phía client hoặc bị hủy, không phải lỗi của Gemini: trả lại lượt gọi thử nếu có
+                gemini_breaker.release()
+                raise
+            except Exception as e:
+                if _is_quota_error(e) and attempt < GEMINI_MAX_RETRIES:
+                    # Các caller khác cũng chờ hết khoảng backoff trước khi được gọi tiếp
+                    admission.backoff(attempt)
+                    continue
+                gemini_breaker.record_failure()
+                UPSTREAM_ERRORS.inc(service='gemini')
+                raise
+            
+            if not kwargs.get('stream'):
+                gemini_breaker.record_success()
+            return response
+    
     def _build_prompt(
         self, 
         shops: List[Dict[str, Any]], 
         user_location: Dict[str, float],
         user_query: str
     ) -> str:
-        """Xây dựng prompt gửi cho Gemini"""
-        shops_info = self._format_shops_info(shops)
+        """
+        Xây dựng prompt gửi cho Gemini trong giới hạn PROMPT_TOKEN_BUDGET
         
-        prompt = f"""Bạn là Fashion AI - trợ lý thời trang thông minh và thân thiện. 
-
-THÔNG TIN CỬA HÀNG GẦN ĐÂY (để tham khảo khi cần):
-{shops_info}
-
-CÂU HỎI: {user_query}
-
-HƯỚNG DẪN TRẢ LỜI:
-- Trả lời bằng tiếng Việt, thân thiện như đang trò chuyện với bạn bè
-- Tập trung vào câu hỏi của người dùng - có thể là về thời trang, phong cách, xu hướng, cách phối đồ, v.v.
-- Nếu câu hỏi liên quan đến mua sắm hoặc tìm cửa hàng, hãy gợi ý từ danh sách trên
-- Nếu câu hỏi chung về thời trang (xu hướng, phối đồ, chất liệu...), hãy tư vấn chuyên môn
-- Nếu là câu chào hỏi hoặc trò chuyện, hãy đáp lại thân thiện
-- Giữ câu trả lời ngắn gọn (50-150 từ), dễ đọc
-- Có thể dùng emoji phù hợp để tăng tính thân thiện
-
-Trả lời:"""
+        Chỉ đưa vào các cửa hàng liên quan nhất (tối đa PROMPT_MAX_SHOPS) dưới dạng bảng gọn,
+        thêm lần lượt cho đến khi chạm ngân sách token.
+        """
+        base_tokens = estimate_tokens(PROMPT_TEMPLATE.format(shops_info="", user_query=user_query))
+        
+        rows = []
+        tokens = base_tokens + estimate_tokens(SHOPS_TABLE_HEADER)
+        for i, shop in enumerate(self._rank_shops_for_query(shops, user_query)[:PROMPT_MAX_SHOPS], 1):
+            row = self._format_shop_row(i, shop)
+            row_tokens = estimate_tokens(row) + 1
+            if tokens + row_tokens > PROMPT_TOKEN_BUDGET:
+                break
+            rows.append(row)
+            tokens += row_tokens
         
+        shops_info = self._format_shops_info(rows)
+        prompt = PROMPT_TEMPLATE.format(shops_info=shops_info, user_query=user_query)
+        
+        prompt_tokens = estimate_tokens(prompt)
+        GEMINI_PROMPT_TOKENS.observe(prompt_tokens)
+        logger.info(f"Prompt Gemini ~{prompt_tokens} token, gồm {len(rows)}/{len(shops)} cửa hàng")
         return prompt
     
-    def _format_shops_info(self, shops: List[Dict[str, Any]]) -> str:
-        """Format thông tin cửa hàng thành chuỗi"""
-        if not shops:
+    def _rank_shops_for_query(self, shops: List[Dict[str, Any]], user_query: str) -> List[Dict[str, Any]]:
+        """
+        Sắp xếp cửa hàng theo mức liên quan: số từ trong câu hỏi xuất hiện ở tên/danh mục,
+        giữ nguyên thứ tự ưu tiên sẵn có (điểm, khoảng cách) khi bằng nhau
+        """
+        terms = {term for term in normalize_query(user_query).split() if len(term) > 2}
+        if not terms:
+            return shops
+        
+        def matches(shop: Dict[str, Any]) -> int:
+            text = normalize_query(f"{shop.get('name', '')} {shop.get('category', '')}")
+            return sum(1 for term in terms if term in text)
+        
+        return sorted(shops, key=lambda shop: -matches(shop))
+    
+    def _format_shop_row(self, index: int, shop: Dict[str, Any]) -> str:
+        """Một dòng trong bảng cửa hàng, các cột phân tách bằng '|', ô trống ghi '-'"""
+        fields = [
+            shop.get('name'),
+            shop.get('address'),
+            shop.get('distance_km'),
+            shop.get('category'),
+            shop.get('price_range'),
+            shop.get('notes')
+        ]
+        return f"{index}|" + "|".join(str(field).replace('|', '/') if field not in (None, '') else '-' for field in fields)
+    
+    def _format_shops_info(self, rows: List[str]) -> str:
+        """Ghép các dòng cửa hàng thành bảng gọn"""
+        if not rows:
             return "Không tìm thấy cửa hàng nào gần đây."
         
-        formatted_parts = []
-        for i, shop in enumerate(shops, 1):
-            part = f"""
-{i}. {shop.get('name', 'N/A')}
-   - Địa chỉ: {shop.get('address', 'N/A')}
-   - Khoảng cách: {shop.get('distance_km', 'N/A')} km
-   - Danh mục: {shop.get('category', 'N/A')}
-   - Mức giá: {shop.get('price_range', 'N/A')}
-   - Khuyến mãi: {shop.get('notes', 'Không có')}"""
-            formatted_parts.append(part)
-        
-        return "\n".join(formatted_parts)
+        return "\n".join([SHOPS_TABLE_HEADER] + rows)
     
     def _generate_fallback_response(self, shops: List[Dict[str, Any]], user_query: str) -> str:
         """Sinh phản hồi mặc định khi không có API key hoặc lỗi"""
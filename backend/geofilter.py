@@ -1,12 +1,25 @@
 # geofilter.py - Module lọc cửa hàng theo vị trí địa lý
 # Sử dụng thư viện geopy để tính khoảng cách giữa 2 điểm GPS
+# và NumPy để tính khoảng cách hàng loạt (vectorized haversine)
 
 from geopy.distance import geodesic
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Sequence
+import numpy as np
+import heapq
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Bán kính trung bình Trái Đất (km) - dùng cho công thức haversine
+EARTH_RADIUS_KM = 6371.0088
+
+# Sai số tương đối tối đa giữa haversine và geodesic (~0.5%)
+# Dùng làm biên an toàn khi lọc theo bán kính trước khi tinh chỉnh bằng geodesic
+HAVERSINE_TOLERANCE = 0.005
+
+# Khóa lưu phần điểm ưu tiên không phụ thuộc vị trí người dùng, tính một lần khi nạp cửa hàng
+STATIC_SCORE_KEY = 'static_score'
+
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
@@ -28,17 +41,93 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
         return 999.0  # Trả về giá trị lớn nếu lỗi
 
 
+def calculate_distances_batch(
+    user_lat: float,
+    user_lon: float,
+    lats: Sequence[float],
+    lons: Sequence[float]
+) -> np.ndarray:
+    """
+    Tính khoảng cách từ người dùng đến nhiều điểm trong một lần (haversine, đơn vị: km)
+    
+    Args:
+        user_lat, user_lon: Tọa độ người dùng
+        lats, lons: Mảng vĩ độ / kinh độ của các điểm cần tính
+    
+    Returns:
+        Mảng NumPy khoảng cách (km), cùng thứ tự với đầu vào
+    """
+    lat1 = np.radians(user_lat)
+    lon1 = np.radians(user_lon)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+    
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def refine_distances_geodesic(
+    user_lat: float,
+    user_lon: float,
+    lats: Sequence[float],
+    lons: Sequence[float]
+) -> List[float]:
+    """
+    Tính lại khoảng cách chính xác (geodesic) cho một tập nhỏ điểm, ví dụ top-k cuối cùng
+    
+    Args:
+        user_lat, user_lon: Tọa độ người dùng
+        lats, lons: Vĩ độ / kinh độ các điểm cần tinh chỉnh
+    
+    Returns:
+        Danh sách khoảng cách geodesic (km)
+    """
+    return [calculate_distance(user_lat, user_lon, lat, lon) for lat, lon in zip(lats, lons)]
+
+
+def _extract_shop_coordinates(shops: List[Dict[str, Any]]) -> Tuple[List[int], np.ndarray, np.ndarray]:
+    """Lấy tọa độ hợp lệ của danh sách cửa hàng, trả về (chỉ số, mảng lat, mảng lon)"""
+    indices = []
+    lats = []
+    lons = []
+    
+    for i, shop in enumerate(shops):
+        try:
+            shop_lat = float(shop.get('lat', 0))
+            shop_lon = float(shop.get('lon', 0))
+        except (ValueError, TypeError) as e:
+            logger.debug(f"Bỏ qua cửa hàng có tọa độ không hợp lệ: {str(e)}")
+            continue
+        
+        # Kiểm tra tọa độ hợp lệ
+        if not _validate_coordinates(shop_lat, shop_lon):
+            continue
+        
+        if shop_lat == 0 and shop_lon == 0:
+            continue
+        
+        indices.append(i)
+        lats.append(shop_lat)
+        lons.append(shop_lon)
+    
+    return indices, np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+
+
 def _validate_coordinates(lat: float, lon: float) -> bool:
     """Kiểm tra tọa độ hợp lệ"""
     return -90 <= lat <= 90 and -180 <= lon <= 180
 
 
-def _calculate_priority_score(shop: Dict[str, Any], distance_km: float) -> float:
-    """Tính điểm ưu tiên cho cửa hàng"""
-    score = 0.0
+def static_priority_score(shop: Dict[str, Any]) -> float:
+    """
+    Phần điểm ưu tiên theo mức đầy đủ thông tin, không phụ thuộc khoảng cách
     
-    # Ưu tiên cửa hàng gần (khoảng cách càng nhỏ, điểm càng cao)
-    score += max(0, 100 - distance_km * 10)
+    Tính một lần khi nạp cửa hàng (chuẩn hóa OSM, chỉ mục không gian) và lưu vào
+    shop[STATIC_SCORE_KEY] để không phải tính lại ở mỗi request.
+    """
+    score = 0.0
     
     # Ưu tiên cửa hàng có đầy đủ thông tin
     if shop.get('name') and shop.get('address'):
@@ -53,12 +142,25 @@ def _calculate_priority_score(shop: Dict[str, Any], distance_km: float) -> float
     return score
 
 
+def _static_score(shop: Dict[str, Any]) -> float:
+    """Điểm tĩnh đã lưu trên cửa hàng, tự tính nếu cửa hàng chưa qua bước nạp"""
+    score = shop.get(STATIC_SCORE_KEY)
+    return static_priority_score(shop) if score is None else score
+
+
+def _calculate_priority_score(shop: Dict[str, Any], distance_km: float) -> float:
+    """Tính điểm ưu tiên cho cửa hàng"""
+    # Ưu tiên cửa hàng gần (khoảng cách càng nhỏ, điểm càng cao)
+    return max(0, 100 - distance_km * 10) + _static_score(shop)
+
+
 def filter_shops_by_radius(
     user_lat: float, 
     user_lon: float, 
     shops: List[Dict[str, Any]], 
     radius_km: float = 5.0,
-    limit: int = 3
+    limit: int = 3,
+    refine: bool = True
 ) -> List[Dict[str, Any]]:
     """
     Lọc các cửa hàng trong bán kính cho trước và trả về danh sách gần nhất
@@ -69,6 +171,8 @@ def filter_shops_by_radius(
         shops: Danh sách tất cả cửa hàng
         radius_km: Bán kính tìm kiếm (mặc định 5km)
         limit: Số lượng cửa hàng tối đa trả về (mặc định 3)
+        refine: Xếp hạng theo khoảng cách chính xác (geodesic); chỉ tinh chỉnh các ứng viên
+                có thể lọt vào top-k, không tính cho toàn bộ danh sách
     
     Returns:
         Danh sách các cửa hàng gần nhất, đã sắp xếp theo khoảng cách
@@ -78,42 +182,74 @@ def filter_shops_by_radius(
         logger.warning(f"Tọa độ người dùng không hợp lệ: lat={user_lat}, lon={user_lon}")
         return []
     
-    shops_with_distance = []
+    # Tính khoảng cách cho toàn bộ cửa hàng trong một lần (vectorized)
+    indices, lats, lons = _extract_shop_coordinates(shops)
+    distances = calculate_distances_batch(user_lat, user_lon, lats, lons)
     
-    for shop in shops:
-        try:
-            shop_lat = float(shop.get('lat', 0))
-            shop_lon = float(shop.get('lon', 0))
-            
-            # Kiểm tra tọa độ hợp lệ
-            if not _validate_coordinates(shop_lat, shop_lon):
-                continue
-            
-            if shop_lat == 0 and shop_lon == 0:
-                continue
-            
-            distance = calculate_distance(user_lat, user_lon, shop_lat, shop_lon)
-            
-            # Chỉ lấy các cửa hàng trong bán kính cho phép
-            if distance <= radius_km:
-                shop_copy = shop.copy()
-                shop_copy['distance_km'] = round(distance, 2)
-                
-                # Tính điểm ưu tiên
-                priority_score = _calculate_priority_score(shop, distance)
-                shop_copy['priority_score'] = priority_score
-                
-                shops_with_distance.append(shop_copy)
-                
-        except (ValueError, TypeError) as e:
-            logger.debug(f"Bỏ qua cửa hàng có tọa độ không hợp lệ: {str(e)}")
-            continue
+    # Lọc sơ bộ bằng haversine, nới biên để không bỏ sót cửa hàng sát bán kính
+    in_radius = np.nonzero(distances <= radius_km * (1 + HAVERSINE_TOLERANCE))[0]
+    
+    # Khoảng cách chính xác (geodesic) lệch tối đa HAVERSINE_TOLERANCE so với haversine,
+    # nên mỗi cửa hàng có khoảng điểm ưu tiên [score_lo, score_hi] trước khi tinh chỉnh
+    tolerance = HAVERSINE_TOLERANCE if refine else 0.0
+    candidate_distances = distances[in_radius]
+    positions = in_radius.tolist()
+    static_scores = np.fromiter(
+        (_static_score(shops[indices[pos]]) for pos in positions), dtype=np.float64, count=len(positions)
+    )
+    min_distances = candidate_distances / (1 + tolerance)
+    score_hi = np.maximum(0, 100 - min_distances * 10) + static_scores
+    score_lo = np.maximum(0, 100 - candidate_distances * (1 + tolerance) * 10) + static_scores
+    
+    exact_distances: Dict[int, float] = {}
+    
+    def exact_key(i: int) -> Tuple[float, float, int]:
+        """Khóa xếp hạng theo khoảng cách đã tinh chỉnh (ưu tiên điểm số, sau đó đến khoảng cách)"""
+        if i not in exact_distances:
+            if refine:
+                pos = positions[i]
+                exact_distances[i] = refine_distances_geodesic(user_lat, user_lon, [lats[pos]], [lons[pos]])[0]
+            else:
+                exact_distances[i] = float(candidate_distances[i])
+        distance = exact_distances[i]
+        return (-(max(0, 100 - distance * 10) + static_scores[i]), distance, i)
+    
+    # Bước 1: heap giới hạn kích thước lấy `limit` ứng viên theo điểm bi quan (score_lo),
+    # lấy thêm đúng số bị thiếu nếu có cửa hàng nằm ngoài bán kính sau khi tinh chỉnh
+    take = limit
+    while True:
+        top = heapq.nsmallest(take, zip((-score_lo).tolist(), candidate_distances.tolist(), range(len(positions))))
+        accepted = [i for _, _, i in top if exact_key(i)[1] <= radius_km]
+        if len(accepted) >= limit or take >= len(positions):
+            break
+        take += limit - len(accepted)
+    ranked = heapq.nsmallest(limit, map(exact_key, accepted))
+    
+    # Bước 2: cửa hàng thứ k đặt ngưỡng; chỉ tinh chỉnh thêm các ứng viên có thể vượt ngưỡng đó
+    if limit > 0 and len(ranked) == limit:
+        threshold_score, threshold_distance = -ranked[-1][0], ranked[-1][1]
+        may_beat = (score_hi > threshold_score) | ((score_hi >= threshold_score) & (min_distances <= threshold_distance))
+        checked = set(accepted)
+        for i in np.nonzero(may_beat)[0].tolist():
+            if i not in checked and exact_key(i)[1] <= radius_km:
+                accepted.append(i)
+        ranked = heapq.nsmallest(limit, map(exact_key, accepted))
+    
+    # Chỉ sao chép các cửa hàng được trả về
+    selected = [(distance, positions[i]) for _, distance, i in ranked]
+    
+    shops_with_distance = []
+    for distance, pos in selected[:limit]:
+        shop = shops[indices[pos]]
+        shop_copy = shop.copy()
+        shop_copy['distance_km'] = round(distance, 2)
+        shop_copy['priority_score'] = _calculate_priority_score(shop, distance)
+        shops_with_distance.append(shop_copy)
     
-    # Sắp xếp: ưu tiên điểm số, sau đó mới đến khoảng cách
     shops_with_distance.sort(key=lambda x: (-x.get('priority_score', 0), x['distance_km']))
     
     # Trả về số lượng giới hạn
-    result = shops_with_distance[:limit]
+    result = shops_with_distance
     logger.info(f"Lọc được {len(result)}/{len(shops)} cửa hàng trong bán kính {radius_km}km")
     
     return result
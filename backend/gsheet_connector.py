@@ -2,9 +2,13 @@
 # Sử dụng thư viện gspread với xác thực Service Account
 
 import gspread
-from gspread.exceptions import WorksheetNotFound
+from gspread.exceptions import WorksheetNotFound, APIError
 from google.oauth2.service_account import Credentials
-from typing import List, Dict, Any
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics import STAGE_LATENCY, UPSTREAM_ERRORS
+from typing import List, Dict, Any, Optional, Tuple, Set
+import asyncio
+import time
 import os
 import json
 import logging
@@ -17,6 +21,43 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive.file'
 ]
 
+# Cấu hình hàng đợi ghi nền (write-behind)
+SHEET_FLUSH_INTERVAL_SECONDS = float(os.getenv('SHEET_FLUSH_INTERVAL_SECONDS', '30'))
+SHEET_FLUSH_MAX_RETRIES = int(os.getenv('SHEET_FLUSH_MAX_RETRIES', '3'))
+SHEET_FLUSH_BACKOFF_SECONDS = float(os.getenv('SHEET_FLUSH_BACKOFF_SECONDS', '1.0'))
+SHEET_QUEUE_MAX_PENDING = int(os.getenv('SHEET_QUEUE_MAX_PENDING', '5000'))
+
+# Thời gian giữ handle spreadsheet/worksheet trước khi mở lại (giây)
+SHEET_HANDLE_TTL_SECONDS = float(os.getenv('SHEET_HANDLE_TTL_SECONDS', '3600'))
+
+# Chu kỳ đối chiếu index tên cửa hàng với sheet (giây)
+SHEET_INDEX_RECONCILE_SECONDS = float(os.getenv('SHEET_INDEX_RECONCILE_SECONDS', '600'))
+
+# Khi ghi Google Sheets lỗi liên tục (vd. credentials hỏng) thì bỏ qua ghi ngay, không thử và log lỗi mỗi request
+sheets_write_breaker = CircuitBreaker("GHI SHEET")
+
+# Các cột dạng chữ của sheet cửa hàng
+SHEET_TEXT_FIELDS = ('name', 'address', 'category', 'price_range', 'notes')
+
+
+def normalize_sheet_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Ép các cột dạng chữ về str
+
+    get_all_records đổi ô trông giống số thành int/float (vd. price_range = 500000),
+    trong khi ShopResponse và phản hồi mặc định của Gemini cần chuỗi.
+    """
+    normalized = dict(record)
+    for field in SHEET_TEXT_FIELDS:
+        value = normalized.get(field)
+        if value is None:
+            if field in normalized:
+                normalized[field] = ''
+        elif not isinstance(value, str):
+            normalized[field] = str(value)
+    return normalized
+
+
 class GoogleSheetsConnector:
     """
     Lớp kết nối và đọc dữ liệu từ Google Sheets
@@ -31,6 +72,11 @@ class GoogleSheetsConnector:
             credentials_json: Chuỗi JSON credentials (ưu tiên dùng biến môi trường)
         """
         self.client = None
+        self._credentials = None
+        # Cache handle worksheet: {(spreadsheet_id, tên sheet): (thời điểm mở, worksheet)}
+        self._worksheet_cache: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        # Index tên cửa hàng theo worksheet: {(spreadsheet_id, tên sheet): (thời điểm đồng bộ, tập tên)}
+        self._name_index: Dict[Tuple[str, str], Tuple[float, Set[str]]] = {}
         self._initialize_client(credentials_path, credentials_json)
     
     def _initialize_client(self, credentials_path: str, credentials_json: str):
@@ -65,37 +111,136 @@ class GoogleSheetsConnector:
                 self.client = None
                 return
             
+            self._credentials = credentials
             self.client = gspread.authorize(credentials)
             logger.info("Kết nối Google Sheets thành công")
         except Exception as e:
             logger.error(f"Lỗi kết nối Google Sheets: {str(e)}")
             self.client = None
     
-    def get_shops_data(self, spreadsheet_id: str, sheet_name: str = "Trang tính 1") -> List[Dict[str, Any]]:
+    def _get_worksheet(self, spreadsheet_id: str, sheet_name: str, create_if_missing: bool = False):
+        """
+        Lấy handle worksheet, dùng lại handle đã mở trong SHEET_HANDLE_TTL_SECONDS
+        
+        Args:
+            spreadsheet_id: ID của Google Spreadsheet
+            sheet_name: Tên sheet
+            create_if_missing: Nếu không có sheet thì dùng sheet đầu tiên hoặc tạo mới
+        
+        Returns:
+            gspread Worksheet
+        """
+        key = (spreadsheet_id, sheet_name)
+        entry = self._worksheet_cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] <= SHEET_HANDLE_TTL_SECONDS:
+            return entry[1]
+        
+        spreadsheet = self.client.open_by_key(spreadsheet_id)
+        
+        try:
+            worksheet = spreadsheet.worksheet(sheet_name)
+        except WorksheetNotFound:
+            if not create_if_missing:
+                raise
+            
+            # Neu khong tim thay sheet, thu lay sheet dau tien
+            worksheet_list = spreadsheet.worksheets()
+            if worksheet_list:
+                worksheet = worksheet_list[0]
+                print(f"Sheet '{sheet_name}' khong ton tai, su dung sheet dau tien: '{worksheet.title}'")
+            else:
+                # Neu khong co sheet nao, tao sheet moi
+                worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=1000, cols=10)
+                # Them header
+                worksheet.append_row(['name', 'address', 'lat', 'lon', 'category', 'price_range', 'notes'])
+                print(f"Da tao sheet moi: '{sheet_name}'")
+        
+        self._worksheet_cache[key] = (time.monotonic(), worksheet)
+        return worksheet
+    
+    def _handle_api_error(self, spreadsheet_id: str, error: Exception):
+        """
+        Xử lý lỗi xác thực / phân quyền: bỏ handle đã cache và làm mới client khi token hết hạn
+        """
+        if not isinstance(error, APIError):
+            return
+        
+        status = getattr(error, 'code', None) or getattr(error.response, 'status_code', None)
+        if status not in (401, 403, 404):
+            return
+        
+        # Handle có thể đã mất hiệu lực (mất quyền, sheet bị xóa...)
+        for key in [key for key in self._worksheet_cache if key[0] == spreadsheet_id]:
+            del self._worksheet_cache[key]
+        logger.warning(f"Lỗi {status} từ Google Sheets, đã xóa cache handle của spreadsheet {spreadsheet_id}")
+        
+        if status == 401 and self._credentials is not None:
+            # Token hết hạn hoặc bị thu hồi: tạo lại client để lấy token mới
+            try:
+                self.client = gspread.authorize(self._credentials)
+                logger.info("Đã làm mới kết nối Google Sheets")
+            except Exception as e:
+                logger.error(f"Lỗi làm mới kết nối Google Sheets: {str(e)}")
+    
+    def _get_name_index(self, spreadsheet_id: str, worksheet) -> Set[str]:
+        """
+        Lấy tập tên cửa hàng (viết thường) đã có trong worksheet
+        
+        Index được nạp một lần và cập nhật khi ghi thêm; định kỳ đối chiếu lại
+        với sheet bằng cách chỉ đọc cột tên (rẻ hơn nhiều so với get_all_records)
+        """
+        key = (spreadsheet_id, worksheet.title)
+        entry = self._name_index.get(key)
+        
+        if entry is None or time.monotonic() - entry[0] > SHEET_INDEX_RECONCILE_SECONDS:
+            # Cột A là cột 'name', bỏ qua dòng header
+            names = {name.strip().lower() for name in worksheet.col_values(1)[1:] if name and name.strip()}
+            self._name_index[key] = (time.monotonic(), names)
+            return names
+        
+        return entry[1]
+    
+    def _refresh_name_index(self, spreadsheet_id: str, sheet_title: str, records: List[Dict[str, Any]]):
+        """Cập nhật index tên từ dữ liệu vừa đọc đầy đủ (không tốn thêm API call)"""
+        names = {str(record.get('name', '')).strip().lower() for record in records if record.get('name')}
+        self._name_index[(spreadsheet_id, sheet_title)] = (time.monotonic(), names)
+    
+    def get_shops_data(
+        self, 
+        spreadsheet_id: str, 
+        sheet_name: str = "Trang tính 1", 
+        fallback_to_sample: bool = True
+    ) -> List[Dict[str, Any]]:
         """
         Đọc dữ liệu cửa hàng từ Google Sheets
         
         Args:
             spreadsheet_id: ID của Google Spreadsheet
             sheet_name: Tên sheet chứa dữ liệu
+            fallback_to_sample: Trả về dữ liệu mẫu khi lỗi; False thì ném lỗi cho caller xử lý
         
         Returns:
             Danh sách các cửa hàng dưới dạng dictionary
         """
         if not self.client:
+            if not fallback_to_sample:
+                raise RuntimeError("Không có kết nối Google Sheets")
             logger.warning("Không có kết nối, trả về dữ liệu mẫu")
             return self._get_sample_data()
         
         try:
-            spreadsheet = self.client.open_by_key(spreadsheet_id)
-            worksheet = spreadsheet.worksheet(sheet_name)
+            worksheet = self._get_worksheet(spreadsheet_id, sheet_name)
             
             # Lấy tất cả dữ liệu dưới dạng list of dictionaries
-            records = worksheet.get_all_records()
+            records = [normalize_sheet_record(record) for record in worksheet.get_all_records()]
+            self._refresh_name_index(spreadsheet_id, worksheet.title, records)
             
             logger.info(f"Đã đọc {len(records)} cửa hàng từ Google Sheets")
             return records
         except Exception as e:
+            self._handle_api_error(spreadsheet_id, e)
+            if not fallback_to_sample:
+                raise
             logger.error(f"Lỗi đọc dữ liệu: {str(e)}")
             return self._get_sample_data()
     
@@ -122,37 +267,24 @@ class GoogleSheetsConnector:
             return False
         
         try:
-            spreadsheet = self.client.open_by_key(spreadsheet_id)
-            
+            sheets_write_breaker.before_call()
+        except CircuitOpenError as e:
+            logger.debug(str(e))
+            return False
+        
+        try:
             # Thu mo worksheet, neu khong co thi tao moi hoac lay sheet dau tien
-            try:
-                worksheet = spreadsheet.worksheet(sheet_name)
-            except WorksheetNotFound:
-                # Neu khong tim thay sheet, thu lay sheet dau tien
-                try:
-                    worksheet_list = spreadsheet.worksheets()
-                    if worksheet_list:
-                        worksheet = worksheet_list[0]
-                        print(f"Sheet '{sheet_name}' khong ton tai, su dung sheet dau tien: '{worksheet.title}'")
-                    else:
-                        # Neu khong co sheet nao, tao sheet moi
-                        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=1000, cols=10)
-                        # Them header
-                        worksheet.append_row(['name', 'address', 'lat', 'lon', 'category', 'price_range', 'notes'])
-                        print(f"Da tao sheet moi: '{sheet_name}'")
-                except Exception as e:
-                    print(f"Loi khi lay hoac tao sheet: {str(e)}")
-                    return False
+            worksheet = self._get_worksheet(spreadsheet_id, sheet_name, create_if_missing=True)
             
-            # Kiem tra cua hang da ton tai chua (theo ten)
-            existing_shops = worksheet.get_all_records()
+            # Kiem tra cua hang da ton tai chua (theo ten, dung index trong bo nho)
+            existing_names = self._get_name_index(spreadsheet_id, worksheet)
             shop_name = shop_data.get('name', '').strip()
             
             # Kiem tra trung ten
-            for shop in existing_shops:
-                if shop.get('name', '').strip().lower() == shop_name.lower():
-                    print(f"Cua hang '{shop_name}' da ton tai, bo qua")
-                    return False
+            if shop_name.lower() in existing_names:
+                sheets_write_breaker.record_success()
+                print(f"Cua hang '{shop_name}' da ton tai, bo qua")
+                return False
             
             # Them cua hang moi vao sheet
             row_data = [
@@ -166,14 +298,24 @@ class GoogleSheetsConnector:
             ]
             
             worksheet.append_row(row_data)
+            existing_names.add(shop_name.lower())
+            sheets_write_breaker.record_success()
             print(f"Da them cua hang '{shop_name}' vao Google Sheets")
             return True
             
         except Exception as e:
+            sheets_write_breaker.record_failure()
+            self._handle_api_error(spreadsheet_id, e)
             print(f"Loi them cua hang vao Google Sheets: {str(e)}")
             return False
     
-    def add_shops_batch(self, spreadsheet_id: str, shops: List[Dict[str, Any]], sheet_name: str = "Trang tính 1") -> int:
+    def add_shops_batch(
+        self, 
+        spreadsheet_id: str, 
+        shops: List[Dict[str, Any]], 
+        sheet_name: str = "Trang tính 1",
+        raise_errors: bool = False
+    ) -> int:
         """
         Thêm nhiều cửa hàng vào Google Sheet (loại bỏ trùng lặp)
         
@@ -181,6 +323,7 @@ class GoogleSheetsConnector:
             spreadsheet_id: ID của Google Spreadsheet
             shops: Danh sách cửa hàng cần thêm
             sheet_name: Tên sheet
+            raise_errors: Ném lại exception thay vì trả về 0 (để caller tự retry)
         
         Returns:
             Số lượng cửa hàng đã thêm thành công
@@ -189,41 +332,31 @@ class GoogleSheetsConnector:
             print("[GHI SHEET] Khong co ket noi Google Sheets, khong the ghi cua hang")
             return 0
         
+        try:
+            sheets_write_breaker.before_call()
+        except CircuitOpenError as e:
+            if raise_errors:
+                raise
+            logger.debug(str(e))
+            return 0
+        
         try:
             print(f"[GHI SHEET] Ket noi den sheet ID: {spreadsheet_id}")
-            spreadsheet = self.client.open_by_key(spreadsheet_id)
             
             # Thu mo worksheet, neu khong co thi tao moi hoac lay sheet dau tien
-            try:
-                worksheet = spreadsheet.worksheet(sheet_name)
-                print(f"[GHI SHEET] Da mo worksheet: {sheet_name}")
-            except WorksheetNotFound:
-                # Neu khong tim thay sheet, thu lay sheet dau tien
-                try:
-                    worksheet_list = spreadsheet.worksheets()
-                    if worksheet_list:
-                        worksheet = worksheet_list[0]
-                        print(f"[GHI SHEET] Sheet '{sheet_name}' khong ton tai, su dung sheet dau tien: '{worksheet.title}'")
-                    else:
-                        # Neu khong co sheet nao, tao sheet moi
-                        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=1000, cols=10)
-                        # Them header
-                        worksheet.append_row(['name', 'address', 'lat', 'lon', 'category', 'price_range', 'notes'])
-                        print(f"[GHI SHEET] Da tao sheet moi: '{sheet_name}'")
-                except Exception as e:
-                    print(f"[GHI SHEET] Loi khi lay hoac tao sheet: {str(e)}")
-                    return 0
+            worksheet = self._get_worksheet(spreadsheet_id, sheet_name, create_if_missing=True)
+            print(f"[GHI SHEET] Da mo worksheet: {worksheet.title}")
             
-            # Lay danh sach cua hang hien co
-            existing_shops = worksheet.get_all_records()
-            existing_names = {shop.get('name', '').strip().lower() for shop in existing_shops if shop.get('name')}
+            # Lay danh sach ten cua hang hien co (index trong bo nho)
+            existing_names = self._get_name_index(spreadsheet_id, worksheet)
             print(f"[GHI SHEET] Hien co {len(existing_names)} cua hang trong sheet")
             
             # Loc cac cua hang moi (chua ton tai)
             new_shops = []
+            new_names = set()
             for shop in shops:
                 shop_name = shop.get('name', '').strip()
-                if shop_name and shop_name.lower() not in existing_names:
+                if shop_name and shop_name.lower() not in existing_names and shop_name.lower() not in new_names:
                     new_shops.append([
                         shop.get('name', ''),
                         shop.get('address', ''),
@@ -233,20 +366,27 @@ class GoogleSheetsConnector:
                         shop.get('price_range', ''),
                         shop.get('notes', '')
                     ])
-                    existing_names.add(shop_name.lower())
+                    new_names.add(shop_name.lower())
             
             # Them hang loat vao sheet
             if new_shops:
                 print(f"[GHI SHEET] Dang ghi {len(new_shops)} cua hang vao sheet...")
                 worksheet.append_rows(new_shops)
+                existing_names.update(new_names)
+                sheets_write_breaker.record_success()
                 print(f"[GHI SHEET] THANH CONG: Da them {len(new_shops)} cua hang moi vao Google Sheets")
                 return len(new_shops)
             else:
+                sheets_write_breaker.record_success()
                 print("[GHI SHEET] Khong co cua hang moi de them (tat ca da ton tai)")
                 return 0
             
         except Exception as e:
+            sheets_write_breaker.record_failure()
+            self._handle_api_error(spreadsheet_id, e)
             print(f"[GHI SHEET] LOI: {str(e)}")
+            if raise_errors:
+                raise
             import traceback
             traceback.print_exc()
             return 0
@@ -468,4 +608,206 @@ def add_shops_to_sheet_batch(spreadsheet_id: str, shops: List[Dict[str, Any]], s
         return connector.add_shops_batch(spreadsheet_id, shops, sheet_name)
     else:
         print("Khong co spreadsheet_id, khong the them cua hang")
-        return 0
\ No newline at end of file
+        return 0
+
+
+class SheetWriteQueue:
+    """
+    Hàng đợi ghi nền (write-behind) cho Google Sheets
+    
+    Gom cửa hàng từ nhiều request, loại trùng trong bộ nhớ và ghi theo lô định kỳ
+    trên một background task. Lỗi ghi được retry với backoff; khi shutdown hàng đợi
+    được ghi hết trước khi dừng.
+    """
+    
+    def __init__(
+        self,
+        flush_interval: float = SHEET_FLUSH_INTERVAL_SECONDS,
+        max_retries: int = SHEET_FLUSH_MAX_RETRIES,
+        backoff_base: float = SHEET_FLUSH_BACKOFF_SECONDS,
+        max_pending: int = SHEET_QUEUE_MAX_PENDING
+    ):
+        """
+        Args:
+            flush_interval: Chu kỳ ghi (giây)
+            max_retries: Số lần thử lại tối đa mỗi lần ghi
+            backoff_base: Thời gian chờ cơ sở giữa các lần thử (giây), tăng gấp đôi mỗi lần
+            max_pending: Số cửa hàng tối đa chờ ghi cho mỗi sheet (bỏ bớt cũ nhất khi vượt)
+        """
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_pending = max_pending
+        # {(spreadsheet_id, sheet_name): {tên viết thường: shop}}
+        self._pending: Dict[Tuple[str, str], Dict[str, Dict[str, Any]]] = {}
+        # Các lô đang được ghi (đã lấy khỏi _pending nhưng chưa ghi xong), cùng cấu trúc với _pending
+        self._in_flight: Dict[Tuple[str, str], Dict[str, Dict[str, Any]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.flushed_count = 0
+        self.failed_flushes = 0
+    
+    def enqueue(self, spreadsheet_id: str, shops: List[Dict[str, Any]], sheet_name: str = "Trang tính 1") -> int:
+        """
+        Thêm cửa hàng vào hàng đợi (không chặn, không gọi API)
+        
+        Returns:
+            Số cửa hàng mới được đưa vào hàng đợi (đã loại trùng)
+        """
+        pending = self._pending.setdefault((spreadsheet_id, sheet_name), {})
+        in_flight = self._in_flight.get((spreadsheet_id, sheet_name), {})
+        added = 0
+        
+        for shop in shops:
+            name_key = str(shop.get('name', '')).strip().lower()
+            if name_key and name_key not in pending and name_key not in in_flight:
+                pending[name_key] = shop
+                added += 1
+        
+        # Giới hạn bộ nhớ: bỏ các cửa hàng cũ nhất nếu quá nhiều
+        while len(pending) > self.max_pending:
+            pending.pop(next(iter(pending)))
+        
+        return added
+    
+    def pending_shops(self, spreadsheet_id: str, sheet_name: str = "Trang tính 1") -> List[Dict[str, Any]]:
+        """Cửa hàng chưa ghi xong vào sheet (đang chờ hoặc đang được ghi)"""
+        key = (spreadsheet_id, sheet_name)
+        return list(self._in_flight.get(key, {}).values()) + list(self._pending.get(key, {}).values())
+    
+    def depth(self) -> int:
+        """Số cửa hàng đang chờ ghi (kể cả lô đang được ghi)"""
+        return sum(len(batch) for batch in self._pending.values()) + sum(len(batch) for batch in self._in_flight.values())
+    
+    def _get_flush_lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+    
+    async def flush(self) -> int:
+        """
+        Ghi toàn bộ hàng đợi vào Google Sheets
+        
+        Cửa hàng chỉ rời hàng đợi khi đã ghi thành công; lô ghi lỗi hoặc bị hủy giữa chừng
+        (ví dụ task bị cancel) được đưa lại vào hàng đợi.
+        
+        Returns:
+            Số cửa hàng đã ghi thành công
+        """
+        async with self._get_flush_lock():
+            self._in_flight, self._pending = self._pending, {}
+            total = 0
+            
+            try:
+                for key in list(self._in_flight):
+                    spreadsheet_id, sheet_name = key
+                    shops = list(self._in_flight[key].values())
+                    if not shops:
+                        del self._in_flight[key]
+                        continue
+                    
+                    added = await self._write_with_retry(spreadsheet_id, shops, sheet_name)
+                    if added is None:
+                        # Ghi thất bại sau khi retry: để lại cho khối finally đưa vào hàng đợi
+                        self.failed_flushes += 1
+                        continue
+                    
+                    del self._in_flight[key]
+                    total += added
+            finally:
+                # Lô chưa ghi được (lỗi hoặc bị hủy): đưa lại vào hàng đợi cho lần sau
+                in_flight, self._in_flight = self._in_flight, {}
+                for (spreadsheet_id, sheet_name), batch in in_flight.items():
+                    self.enqueue(spreadsheet_id, list(batch.values()), sheet_name)
+                self.flushed_count += total
+            
+            return total
+    
+    async def _write_with_retry(self, spreadsheet_id: str, shops: List[Dict[str, Any]], sheet_name: str) -> Optional[int]:
+        """Ghi một lô với exponential backoff, trả về None nếu vẫn lỗi sau max_retries lần"""
+        credentials_json = os.getenv('GOOGLE_SHEETS_CREDENTIALS')
+        connector = get_connector(credentials_json=credentials_json)
+        
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                # gspread là thư viện đồng bộ, chạy trong thread pool
+                added = await asyncio.to_thread(
+                    connector.add_shops_batch, spreadsheet_id, shops, sheet_name, True
+                )
+                STAGE_LATENCY.observe(time.perf_counter() - started, stage='sheets_write')
+                return added
+            except CircuitOpenError:
+                # Breaker đang mở: giữ lại trong hàng đợi, không retry vô ích
+                logger.warning(f"[GHI SHEET] Circuit breaker đang mở, hoãn ghi {len(shops)} cửa hàng")
+                return None
+            except Exception as e:
+                STAGE_LATENCY.observe(time.perf_counter() - started, stage='sheets_write')
+                UPSTREAM_ERRORS.inc(service='google_sheets')
+                if attempt >= self.max_retries:
+                    logger.error(f"[GHI SHEET] Ghi {len(shops)} cửa hàng thất bại sau {attempt + 1} lần: {str(e)}")
+                    return None
+                
+                delay = self.backoff_base * (2 ** attempt)
+                logger.warning(f"[GHI SHEET] Lỗi ghi (lần {attempt + 1}), thử lại sau {delay}s: {str(e)}")
+                await asyncio.sleep(delay)
+        
+        return None
+    
+    async def _run(self):
+        """Vòng lặp ghi định kỳ"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"[GHI SHEET] Lỗi trong vòng lặp ghi nền: {str(e)}", exc_info=True)
+    
+    def start(self):
+        """Khởi động background task (gọi khi FastAPI startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"[GHI SHEET] Hàng đợi ghi nền đã khởi động (chu kỳ {self.flush_interval}s)")
+    
+    async def stop(self):
+        """Dừng background task và ghi hết hàng đợi (gọi khi FastAPI shutdown)"""
+        if self._task is not None:
+            # Chờ lần ghi đang chạy (nếu có) hoàn tất rồi mới hủy, để không cắt ngang một lô
+            async with self._get_flush_lock():
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        if self.depth():
+            logger.info(f"[GHI SHEET] Đang ghi {self.depth()} cửa hàng còn lại trước khi dừng...")
+            await self.flush()
+
+
+# Singleton instance hàng đợi ghi nền
+_write_queue_instance = None
+
+def get_write_queue() -> SheetWriteQueue:
+    """Lấy instance SheetWriteQueue (Singleton pattern)"""
+    global _write_queue_instance
+    if _write_queue_instance is None:
+        _write_queue_instance = SheetWriteQueue()
+    return _write_queue_instance
+
+def enqueue_shops_for_sheet(spreadsheet_id: str, shops: List[Dict[str, Any]], sheet_name: str = "Trang tính 1") -> int:
+    """
+    Hàm tiện ích để đưa cửa hàng vào hàng đợi ghi nền (không chặn request)
+    
+    Args:
+        spreadsheet_id: ID của Google Spreadsheet
+        shops: Danh sách cửa hàng
+        sheet_name: Tên sheet
+    
+    Returns:
+        Số cửa hàng mới được đưa vào hàng đợi
+    """
+    if not spreadsheet_id:
+        return 0
+    return get_write_queue().enqueue(spreadsheet_id, shops, sheet_name)
@@ -0,0 +1,194 @@
+# import_osm.py - Lệnh nhập cửa hàng từ bản trích xuất OSM (.osm.pbf hoặc GeoJSON) vào kho offline
+# Chỉ giữ các loại cửa hàng trong SHOP_TAGS và chuẩn hóa giống hệt dữ liệu từ Overpass
+#
+# Ví dụ (từ thư mục backend):
+#   python import_osm.py vietnam-latest.osm.pbf --db data/shops.sqlite
+#   python import_osm.py hanoi-shops.geojson --db data/shops.sqlite --append
+# Sau đó đặt OSM_SHOP_STORE_PATH=data/shops.sqlite để search_nearby_shops dùng kho này.
+# Đọc .osm.pbf cần thư viện pyosmium (pip install osmium); GeoJSON không cần thư viện thêm.
+
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from places_service import SHOP_TAGS, _normalize_shop_data
+from shop_store import ShopStore, SHOP_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+
+def _to_shop(element: Dict[str, Any], lat: float, lon: float) -> Optional[Dict[str, Any]]:
+    """Chuẩn hóa một element nếu là cửa hàng thuộc SHOP_TAGS"""
+    if element.get('tags', {}).get('shop') not in SHOP_TAGS:
+        return None
+    shop = _normalize_shop_data(element, lat, lon)
+    shop['osm_type'] = element.get('type', 'node')
+    return shop
+
+
+# ===== GeoJSON =====
+
+def _geometry_center(geometry: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """Tâm (lat, lon) của geometry GeoJSON: điểm giữa các tọa độ (đủ dùng cho cửa hàng)"""
+    if not geometry:
+        return None
+
+    coordinates = geometry.get('coordinates')
+    if geometry.get('type') == 'Point':
+        return coordinates[1], coordinates[0]
+
+    points: List[Tuple[float, float]] = []
+
+    def collect(value):
+        if value and isinstance(value[0], (int, float)):
+            points.append((value[1], value[0]))
+        else:
+            for item in value or []:
+                collect(item)
+
+    collect(coordinates)
+    if not points:
+        return None
+    return sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)
+
+
+def read_geojson(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Đọc cửa hàng từ GeoJSON FeatureCollection
+
+    Tag OSM có thể nằm trực tiếp trong properties (osmium export, ogr2ogr)
+    hoặc trong properties.tags (overpass turbo).
+    """
+    with open(path, encoding='utf-8') as f:
+        collection = json.load(f)
+
+    for index, feature in enumerate(collection.get('features', [])):
+        properties = feature.get('properties') or {}
+        tags = properties.get('tags') if isinstance(properties.get('tags'), dict) else properties
+        center = _geometry_center(feature.get('geometry'))
+        if center is None:
+            continue
+
+        osm_type, _, osm_id = str(feature.get('id') or properties.get('@id') or f"node/{index}").rpartition('/')
+        element = {'type': osm_type or 'node', 'id': int(osm_id) if osm_id.isdigit() else osm_id, 'tags': tags}
+        shop = _to_shop(element, center[0], center[1])
+        if shop:
+            yield shop
+
+
+# ===== OSM PBF =====
+
+def read_pbf(
+    path: str,
+    on_batch: Callable[[List[Dict[str, Any]]], None],
+    batch_size: int = BATCH_SIZE
+):
+    """
+    Đọc cửa hàng (node và way) từ file .osm.pbf bằng pyosmium
+
+    pyosmium gọi handler theo kiểu callback nên không yield được từ bên trong;
+    thay vào đó mỗi batch_size cửa hàng được giao ngay cho on_batch, bộ nhớ
+    chỉ giữ một batch dù file trích xuất lớn cỡ nào.
+    """
+    try:
+        import osmium
+    except ImportError:
+        raise SystemExit("Đọc file .osm.pbf cần thư viện pyosmium: pip install osmium")
+
+    class ShopHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.batch: List[Dict[str, Any]] = []
+
+        def add(self, shop: Dict[str, Any]):
+            self.batch.append(shop)
+            if len(self.batch) >= batch_size:
+                self.flush()
+
+        def flush(self):
+            if self.batch:
+                on_batch(self.batch)
+                self.batch = []
+
+        def node(self, node):
+            if node.tags.get('shop') in SHOP_TAGS and node.location.valid():
+                element = {'type': 'node', 'id': node.id, 'tags': dict(node.tags)}
+                self.add(_to_shop(element, node.location.lat, node.location.lon))
+
+        def way(self, way):
+            if way.tags.get('shop') not in SHOP_TAGS:
+                return
+            locations = [n.location for n in way.nodes if n.location.valid()]
+            if not locations:
+                return
+            element = {'type': 'way', 'id': way.id, 'tags': dict(way.tags)}
+            self.add(_to_shop(
+                element,
+                sum(location.lat for location in locations) / len(locations),
+                sum(location.lon for location in locations) / len(locations)
+            ))
+
+    handler = ShopHandler()
+    # locations=True để có tọa độ node của way (tính tâm giống `out center` của Overpass)
+    handler.apply_file(path, locations=True)
+    handler.flush()
+
+
+def import_extract(path: str, db_path: str, append: bool = False) -> int:
+    """
+    Nhập bản trích xuất OSM vào kho cửa hàng
+
+    Args:
+        path: File .osm.pbf hoặc .geojson / .json
+        db_path: File SQLite của kho
+        append: Giữ dữ liệu cũ (mặc định xóa trước khi nhập)
+
+    Returns:
+        Số cửa hàng đã nhập
+    """
+    store = ShopStore(db_path)
+    if not append:
+        store.clear()
+
+    started = time.monotonic()
+    total = 0
+
+    def write(batch: List[Dict[str, Any]]):
+        nonlocal total
+        total += store.insert_many(batch)
+
+    if path.endswith('.pbf'):
+        read_pbf(path, write)
+    else:
+        batch: List[Dict[str, Any]] = []
+        for shop in read_geojson(path):
+            batch.append(shop)
+            if len(batch) >= BATCH_SIZE:
+                write(batch)
+                batch = []
+        write(batch)
+    store.mark_imported(path)
+
+    logger.info(f"Đã nhập {total} cửa hàng từ {path} vào {db_path} trong {time.monotonic() - started:.1f}s")
+    return total
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Nhập cửa hàng từ bản trích xuất OSM vào kho offline (SQLite R-tree)")
+    parser.add_argument('extract', help="File .osm.pbf hoặc GeoJSON")
+    parser.add_argument('--db', default=SHOP_STORE_PATH or 'data/shops.sqlite', help="File SQLite của kho")
+    parser.add_argument('--append', action='store_true', help="Giữ dữ liệu cũ thay vì nhập lại từ đầu")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    import_extract(args.extract, args.db, args.append)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
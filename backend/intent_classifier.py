@@ -0,0 +1,62 @@
+# intent_classifier.py - Module phân loại ý định câu hỏi bằng từ khóa (chạy cục bộ, không gọi API)
+# Dùng để bỏ qua tìm kiếm cửa hàng với các câu hỏi thuần thời trang hoặc chào hỏi
+
+import os
+import re
+import logging
+from text_utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Các loại ý định
+INTENT_SHOP_SEARCH = "shop_search"  # Cần tìm cửa hàng gần đây
+INTENT_CHAT_ONLY = "chat_only"  # Chỉ cần trò chuyện / tư vấn, không cần tìm kiếm
+
+# Bật/tắt phân loại (tắt thì mọi câu hỏi đều tìm kiếm như trước)
+INTENT_CLASSIFIER_ENABLED = os.getenv('INTENT_CLASSIFIER_ENABLED', 'true').lower() == 'true'
+
+# Từ khóa (đã bỏ dấu, viết thường) cho thấy người dùng cần cửa hàng
+SHOP_SEARCH_PATTERNS = [
+    r"cua hang", r"\bshop\b", r"\bstore\b", r"\bmua\b", r"o dau", r"gan (day|nhat|toi|minh|nha)",
+    r"dia chi", r"\btim\b", r"ban do", r"chi nhanh", r"\bmall\b", r"trung tam thuong mai",
+    r"khuyen mai", r"giam gia", r"\bsale\b", r"\bgia\b", r"bao nhieu tien", r"mo cua",
+    r"uniqlo", r"zara", r"h&m", r"canifa", r"ivy moda", r"elise", r"routine", r"owen",
+    r"yody", r"juno", r"vascara", r"\bnem\b", r"yame", r"cotton on"
+]
+
+# Từ khóa cho thấy câu hỏi thuần trò chuyện / tư vấn phong cách
+CHAT_ONLY_PATTERNS = [
+    r"^(xin )?chao\b", r"^(hello|hi|hey)\b", r"cam on", r"\bthanks?\b", r"ban la ai",
+    r"phoi (do|mau|ao|quan|vay)", r"mac (gi|sao|the nao)", r"xu huong", r"\btrend", r"chat lieu",
+    r"phong cach", r"mau (sac|nao|gi)", r"\boutfit\b", r"hop voi", r"dang nguoi", r"\bstyle\b",
+    r"giat", r"bao quan", r"size nao"
+]
+
+_SHOP_SEARCH_RE = re.compile("|".join(SHOP_SEARCH_PATTERNS))
+_CHAT_ONLY_RE = re.compile("|".join(CHAT_ONLY_PATTERNS))
+
+
+def classify_intent(message: str) -> str:
+    """
+    Phân loại ý định câu hỏi của người dùng
+
+    Câu hỏi có từ khóa tìm cửa hàng luôn được tìm kiếm; chỉ các câu hỏi có từ khóa
+    trò chuyện / phong cách và không nhắc đến cửa hàng mới đi đường chat_only.
+    Trường hợp không chắc chắn mặc định là tìm kiếm (giữ hành vi cũ).
+
+    Args:
+        message: Câu hỏi của người dùng
+
+    Returns:
+        INTENT_SHOP_SEARCH hoặc INTENT_CHAT_ONLY
+    """
+    if not INTENT_CLASSIFIER_ENABLED:
+        return INTENT_SHOP_SEARCH
+
+    text = normalize_query(message)
+
+    if _SHOP_SEARCH_RE.search(text):
+        return INTENT_SHOP_SEARCH
+    if _CHAT_ONLY_RE.search(text):
+        return INTENT_CHAT_ONLY
+    return INTENT_SHOP_SEARCH
@@ -0,0 +1,227 @@
+# metrics.py - Module thu thập số liệu vận hành và xuất ra định dạng text của Prometheus
+# Không phụ thuộc thư viện ngoài; mỗi lần ghi nhận chỉ là một phép cộng trong dictionary
+
+import bisect
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Bucket mặc định cho độ trễ (giây)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Bucket cho số token ước lượng của prompt Gemini
+PROMPT_TOKEN_BUCKETS = (250, 500, 750, 1000, 1250, 1500, 2000, 3000, 5000)
+
+
+def _escape_label(value: Any) -> str:
+    """Escape giá trị nhãn theo định dạng text của Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    """Định dạng nhãn {a="x",b="y"} (rỗng nếu không có nhãn)"""
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Lớp cơ sở: tên, mô tả, kiểu và tên nhãn"""
+
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Bộ đếm chỉ tăng"""
+
+    metric_type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Histogram với bucket cố định (lưu số lần theo từng bucket, tổng và số mẫu)"""
+
+    metric_type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {nhãn: [số mẫu theo bucket (không cộng dồn) ..., số mẫu > bucket cuối, tổng]}
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, counts in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Số liệu đọc tại thời điểm xuất /metrics (gauge hoặc counter có sẵn ở module khác)
+
+    callback trả về danh sách (giá trị nhãn, giá trị) nên không tốn chi phí trên đường request.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Iterable[Tuple[LabelValues, float]]],
+        labelnames: Iterable[str] = (),
+        metric_type: str = 'gauge'
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.metric_type = metric_type
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, tuple(key))} {_format_value(value)}"
+            for key, value in self.callback()
+        ]
+
+
+class Registry:
+    """Tập hợp các số liệu được xuất ra /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Xuất toàn bộ số liệu theo định dạng text của Prometheus (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # Một callback lỗi không được làm hỏng cả trang metrics
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Content-Type chuẩn của định dạng text Prometheus
+CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    """Tạo và đăng ký Counter"""
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Iterable[str] = (),
+    buckets: Iterable[float] = LATENCY_BUCKETS
+) -> Histogram:
+    """Tạo và đăng ký Histogram"""
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def callback_metric(
+    name: str,
+    documentation: str,
+    callback: Callable[[], Iterable[Tuple[LabelValues, float]]],
+    labelnames: Iterable[str] = (),
+    metric_type: str = 'gauge'
+) -> CallbackMetric:
+    """Tạo và đăng ký số liệu đọc qua callback"""
+    return REGISTRY.register(CallbackMetric(name, documentation, callback, labelnames, metric_type))
+
+
+# ===== Số liệu dùng chung giữa các module =====
+
+STAGE_LATENCY = histogram(
+    'fashion_stage_duration_seconds',
+    'Thời gian xử lý từng bước của pipeline /chat',
+    ['stage']
+)
+
+UPSTREAM_ERRORS = counter(
+    'fashion_upstream_errors_total',
+    'Số lỗi khi gọi dịch vụ bên ngoài',
+    ['service']
+)
+
+UPSTREAM_TIMEOUTS = counter(
+    'fashion_upstream_timeouts_total',
+    'Số lần quá thời hạn khi chờ dịch vụ bên ngoài',
+    ['service']
+)
+
+GEMINI_PROMPT_TOKENS = histogram(
+    'fashion_gemini_prompt_tokens',
+    'Số token ước lượng của prompt gửi Gemini',
+    buckets=PROMPT_TOKEN_BUCKETS
+)
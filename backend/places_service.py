@@ -2,10 +2,18 @@
 # Sử dụng Overpass API (miễn phí, không cần API key)
 
 import os
+import time
+import asyncio
 import httpx
 import logging
-from typing import List, Dict, Any, Optional
-from geofilter import calculate_distance
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from geofilter import calculate_distances_batch, static_priority_score, STATIC_SCORE_KEY
+from tile_cache import TileCache, TileKey, get_tile_cache
+from shop_store import ShopStore, get_shop_store
+from spatial_index import get_shop_index
+from singleflight import SingleFlight, coalesce
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics import STAGE_LATENCY, UPSTREAM_ERRORS, UPSTREAM_TIMEOUTS, histogram
 from dotenv import load_dotenv
 
 # Load biến môi trường
@@ -17,11 +25,20 @@ logger = logging.getLogger(__name__)
 # Overpass API endpoint (miễn phí)
 OVERPASS_API_URL = "https://overpass-api.de/api/interpreter"
 
+# Danh sách mirror Overpass, phân tách bằng dấu phẩy (endpoint đầu tiên được ưu tiên ban đầu)
+OVERPASS_API_URLS = [
+    url.strip() for url in os.getenv(
+        'OVERPASS_API_URLS',
+        f"{OVERPASS_API_URL},https://overpass.kumi.systems/api/interpreter,https://overpass.private.coffee/api/interpreter"
+    ).split(',') if url.strip()
+]
+
 # Constants
 MAX_RADIUS_METERS = 50000  # 50km
 TIMEOUT_SECONDS = 30
 SHOP_TAGS = ["clothes", "fashion", "boutique", "department_store", "mall"]
 SHOP_TYPES = ["node", "way"]
+RING_GROWTH_FACTOR = 2.0  # Hệ số mở rộng bán kính khi tìm kiếm tăng dần
 
 # Category mapping
 CATEGORY_MAP = {
@@ -35,6 +52,108 @@ CATEGORY_MAP = {
 # Bật/tắt tính năng tìm kiếm
 PLACES_API_ENABLED = os.getenv('PLACES_API_ENABLED', 'true').lower() == 'true'
 
+# Bật/tắt cache kết quả theo ô lưới
+TILE_CACHE_ENABLED = os.getenv('OSM_TILE_CACHE_ENABLED', 'true').lower() == 'true'
+
+# Cấu hình HTTP client dùng chung (connection pool, keep-alive)
+HTTP2_ENABLED = os.getenv('OVERPASS_HTTP2', 'true').lower() == 'true'
+POOL_MAX_CONNECTIONS = int(os.getenv('OVERPASS_POOL_MAX_CONNECTIONS', '20'))
+POOL_MAX_KEEPALIVE = int(os.getenv('OVERPASS_POOL_MAX_KEEPALIVE', '10'))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv('OVERPASS_KEEPALIVE_EXPIRY_SECONDS', '60'))
+CONNECT_TIMEOUT_SECONDS = float(os.getenv('OVERPASS_CONNECT_TIMEOUT_SECONDS', '5'))
+
+# Cấu hình hedged request giữa các mirror
+HEDGE_DELAY_SECONDS = float(os.getenv('OVERPASS_HEDGE_DELAY_SECONDS', '3.0'))
+MAX_HEDGED_REQUESTS = int(os.getenv('OVERPASS_MAX_HEDGED_REQUESTS', '2'))
+STATS_SMOOTHING = 0.2  # Hệ số EWMA cho độ trễ và tỉ lệ lỗi
+
+# Độ chính xác (số chữ số thập phân) khi làm tròn tọa độ để gộp request (3 ~ 110m)
+COALESCE_PRECISION = int(os.getenv('SEARCH_COALESCE_PRECISION', '3'))
+
+# Cấu hình tải song song theo nhóm ô lưới
+# Overpass công khai chỉ cho khoảng 2 request đồng thời mỗi IP; vượt quá sẽ bị 429, làm mở
+# overpass_breaker và đẩy mọi người dùng sang đường giảm chất lượng. Hedged request cộng thêm
+# vào số request này nên chỉ được gửi khi số request Overpass đang chạy còn dưới giới hạn.
+TILES_PER_FETCH = int(os.getenv('OVERPASS_TILES_PER_FETCH', '16'))
+MAX_CONCURRENT_FETCHES = int(os.getenv('OVERPASS_MAX_CONCURRENT_FETCHES', '2'))
+
+
+# Số request HTTP đến Overpass đang chạy trong process (kể cả hedged request)
+_requests_in_flight = 0
+
+# Gộp các tìm kiếm giống nhau đang chạy đồng thời
+search_flight = SingleFlight("OSM")
+
+# Số vòng mở rộng bán kính của mỗi lần tìm kiếm tăng dần
+# (thời gian từng vòng nằm trong fashion_stage_duration_seconds{stage="expansion"})
+SEARCH_RINGS = histogram(
+    'fashion_search_rings',
+    'Số vòng mở rộng bán kính mỗi lần tìm kiếm tăng dần',
+    buckets=(1, 2, 3, 4, 5, 6, 8)
+)
+
+# Khi Overpass (mọi mirror) lỗi liên tục thì trả dữ liệu mẫu ngay thay vì chờ hết timeout
+overpass_breaker = CircuitBreaker("OSM")
+
+
+def _search_key(args: Dict[str, Any]) -> tuple:
+    """Khóa gộp request: tọa độ làm tròn cùng các tham số bán kính / số lượng"""
+    return tuple(
+        round(value, COALESCE_PRECISION) if name in ('lat', 'lon') else value
+        for name, value in args.items()
+        if name != 'keyword'
+    )
+
+
+# HTTP client dùng chung cho toàn bộ process
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _create_http_client() -> httpx.AsyncClient:
+    """Tạo AsyncClient với connection pool và keep-alive"""
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("[OSM] Chưa cài gói h2 (httpx[http2]), dùng HTTP/1.1")
+            http2 = False
+    
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+        ),
+        timeout=httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS)
+    )
+
+
+async def start_http_client():
+    """Khởi tạo HTTP client dùng chung (gọi khi FastAPI startup)"""
+    global _http_client
+    if _http_client is None:
+        _http_client = _create_http_client()
+        logger.info("[OSM] Đã khởi tạo HTTP client dùng chung")
+
+
+async def close_http_client():
+    """Đóng HTTP client dùng chung (gọi khi FastAPI shutdown)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("[OSM] Đã đóng HTTP client dùng chung")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Lấy HTTP client dùng chung, tự khởi tạo nếu chưa có (ví dụ khi chạy ngoài FastAPI)"""
+    global _http_client
+    if _http_client is None:
+        _http_client = _create_http_client()
+    return _http_client
+
 
 def _build_overpass_query(lat: float, lon: float, radius_meters: int) -> str:
     """Xây dựng Overpass QL query để tìm cửa hàng"""
@@ -53,6 +172,24 @@ def _build_overpass_query(lat: float, lon: float, radius_meters: int) -> str:
     return query
 
 
+def _build_overpass_bbox_query(bboxes: List[Tuple[float, float, float, float]]) -> str:
+    """Xây dựng Overpass QL query tìm cửa hàng trong một hoặc nhiều bounding box (south, west, north, east)"""
+    tag_pattern = "|".join(SHOP_TAGS)
+    shop_queries = []
+    for south, west, north, east in bboxes:
+        for shop_type in SHOP_TYPES:
+            shop_queries.append(f'{shop_type}["shop"~"^({tag_pattern})$"]({south:.6f},{west:.6f},{north:.6f},{east:.6f});')
+    
+    query = f"""
+    [out:json][timeout:25];
+    (
+      {"".join(shop_queries)}
+    );
+    out center;
+    """
+    return query
+
+
 def _extract_coordinates(element: dict) -> Optional[tuple]:
     """Trích xuất tọa độ từ element OpenStreetMap"""
     if element.get('type') == 'node':
@@ -82,21 +219,19 @@ def _extract_address(tags: dict) -> str:
     return ', '.join(address_parts) if address_parts else tags.get('addr:full', 'Không có địa chỉ')
 
 
-def _normalize_shop_data(element: dict, lat: float, lon: float, user_lat: float, user_lon: float) -> dict:
-    """Chuẩn hóa dữ liệu cửa hàng từ OSM element"""
+def _normalize_shop_data(element: dict, lat: float, lon: float) -> dict:
+    """Chuẩn hóa dữ liệu cửa hàng từ OSM element (chưa gồm khoảng cách, đã tính sẵn điểm tĩnh)"""
     tags = element.get('tags', {})
     shop_type = tags.get('shop', 'clothes')
     
-    distance_km = calculate_distance(user_lat, user_lon, lat, lon)
     category = CATEGORY_MAP.get(shop_type, 'Quần áo')
     name = tags.get('name') or tags.get('brand') or f'Cửa hàng {category}'
     
-    return {
+    shop = {
         'name': name,
         'address': _extract_address(tags),
         'lat': lat,
         'lon': lon,
-        'distance_km': round(distance_km, 2),
         'category': category,
         'price_range': '',
         'notes': tags.get('opening_hours', ''),
@@ -105,9 +240,433 @@ def _normalize_shop_data(element: dict, lat: float, lon: float, user_lat: float,
         'osm_id': element.get('id'),
         'source': 'openstreetmap'
     }
+    shop[STATIC_SCORE_KEY] = static_priority_score(shop)
+    return shop
 
 
-def search_nearby_shops(
+def _normalize_elements(elements: List[dict]) -> List[Dict[str, Any]]:
+    """Chuẩn hóa danh sách OSM element, bỏ qua element không có tọa độ"""
+    shops = []
+    for element in elements:
+        coords = _extract_coordinates(element)
+        if coords:
+            shops.append(_normalize_shop_data(element, coords[0], coords[1]))
+    return shops
+
+
+def _attach_distances(
+    shops: List[Dict[str, Any]], 
+    lat: float, 
+    lon: float, 
+    radius_km: float
+) -> List[Dict[str, Any]]:
+    """
+    Tính khoảng cách theo lô, giữ các cửa hàng trong bán kính và sắp xếp theo khoảng cách
+    
+    Trả về bản sao của cửa hàng (có thêm distance_km) để không sửa dữ liệu trong cache
+    """
+    distances = calculate_distances_batch(
+        lat, lon,
+        [shop['lat'] for shop in shops],
+        [shop['lon'] for shop in shops]
+    )
+    
+    result = []
+    for shop, distance_km in zip(shops, distances):
+        if distance_km <= radius_km:
+            shop_copy = shop.copy()
+            shop_copy['distance_km'] = round(float(distance_km), 2)
+            result.append(shop_copy)
+    
+    result.sort(key=lambda x: x['distance_km'])
+    return result
+
+
+class EndpointStats:
+    """Theo dõi độ trễ và tỉ lệ lỗi (EWMA) của một Overpass endpoint"""
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+    
+    def record_cancelled(self, elapsed: float):
+        """
+        Ghi nhận request bị hủy (thua hedged request): độ trễ thật ít nhất là elapsed
+        
+        Chỉ kéo độ trễ ước lượng lên, không kéo xuống, và không tính là lỗi.
+        """
+        self.cancelled += 1
+        if self.latency is None:
+            self.latency = elapsed
+        elif elapsed > self.latency:
+            self.latency += STATS_SMOOTHING * (elapsed - self.latency)
+    
+    def record(self, latency: float, success: bool):
+        """Cập nhật thống kê sau một request (thành công hoặc lỗi)"""
+        self.requests += 1
+        if not success:
+            self.errors += 1
+        
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += STATS_SMOOTHING * (latency - self.latency)
+        self.error_rate += STATS_SMOOTHING * ((0.0 if success else 1.0) - self.error_rate)
+    
+    def score(self) -> float:
+        """Điểm xếp hạng (càng nhỏ càng tốt): độ trễ dự kiến cộng phạt theo tỉ lệ lỗi"""
+        latency = self.latency if self.latency is not None else HEDGE_DELAY_SECONDS
+        return latency + self.error_rate * TIMEOUT_SECONDS
+
+
+# Thống kê theo từng endpoint
+_endpoint_stats: Dict[str, EndpointStats] = {url: EndpointStats(url) for url in OVERPASS_API_URLS}
+
+
+def _rank_endpoints() -> List[str]:
+    """Sắp xếp endpoint theo điểm, endpoint tốt nhất đứng đầu (giữ thứ tự cấu hình khi bằng điểm)"""
+    return sorted(OVERPASS_API_URLS, key=lambda url: _endpoint_stats[url].score())
+
+
+def get_endpoint_stats() -> List[Dict[str, Any]]:
+    """Trả về thống kê các Overpass endpoint (dùng cho giám sát)"""
+    return [
+        {
+            'url': stats.url,
+            'latency_seconds': stats.latency,
+            'error_rate': round(stats.error_rate, 4),
+            'requests': stats.requests,
+            'errors': stats.errors,
+            'cancelled': stats.cancelled
+        }
+        for stats in (_endpoint_stats[url] for url in _rank_endpoints())
+    ]
+
+
+async def _post_to_endpoint(url: str, query: str, timeout: Optional[float]) -> List[dict]:
+    """Gửi query đến một endpoint cụ thể và ghi nhận độ trễ / lỗi"""
+    global _requests_in_flight
+    # Gọi Overpass API qua client dùng chung (giữ kết nối keep-alive)
+    client = get_http_client()
+    request_timeout = httpx.Timeout(timeout or TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS)
+    started = time.monotonic()
+    
+    _requests_in_flight += 1
+    try:
+        response = await client.post(url, data={'data': query}, timeout=request_timeout)
+        response.raise_for_status()
+        data = response.json()
+    except asyncio.CancelledError:
+        # Thua hedged request hoặc cả lượt tìm kiếm bị hủy: vẫn là một mẫu độ trễ (cận dưới)
+        _endpoint_stats[url].record_cancelled(time.monotonic() - started)
+        raise
+    except Exception:
+        _endpoint_stats[url].record(time.monotonic() - started, success=False)
+        raise
+    finally:
+        _requests_in_flight -= 1
+    
+    _endpoint_stats[url].record(time.monotonic() - started, success=True)
+    return data.get('elements', [])
+
+
+async def _post_overpass_query(query: str, timeout: Optional[float] = None) -> List[dict]:
+    """
+    Gửi query đến Overpass API qua circuit breaker và trả về danh sách element
+    
+    Args:
+        query: Overpass QL query
+        timeout: Timeout riêng cho request này (giây), mặc định TIMEOUT_SECONDS
+    
+    Raises:
+        CircuitOpenError: Khi Overpass đang lỗi liên tục (breaker mở)
+    """
+    overpass_breaker.before_call()
+    started = time.perf_counter()
+    try:
+        elements = await _post_hedged_query(query, timeout)
+    except asyncio.CancelledError:
+        # Bị hủy (vd. một nhóm ô lưới khác lỗi trước) không phải là lỗi của Overpass
+        overpass_breaker.release()
+        raise
+    except Exception as e:
+        overpass_breaker.record_failure()
+        if isinstance(e, httpx.TimeoutException):
+            UPSTREAM_TIMEOUTS.inc(service='overpass')
+        else:
+            UPSTREAM_ERRORS.inc(service='overpass')
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - started, stage='overpass_fetch')
+    
+    overpass_breaker.record_success()
+    return elements
+
+
+async def _post_hedged_query(query: str, timeout: Optional[float] = None) -> List[dict]:
+    """
+    Gửi query đến các mirror Overpass và trả về danh sách element
+    
+    Gửi đến endpoint tốt nhất trước; nếu sau HEDGE_DELAY_SECONDS chưa có phản hồi
+    thì gửi thêm một request song song (hedged) đến endpoint tốt tiếp theo và dùng
+    phản hồi đến trước. Không hedge khi số request Overpass đang chạy đã chạm
+    MAX_CONCURRENT_FETCHES. Endpoint lỗi sẽ được chuyển tiếp (failover) sang mirror khác.
+    
+    Args:
+        query: Overpass QL query
+        timeout: Timeout riêng cho request này (giây), mặc định TIMEOUT_SECONDS
+    """
+    endpoints = _rank_endpoints()
+    pending: Dict[asyncio.Task, str] = {}
+    next_index = 0
+    last_error: Optional[Exception] = None
+    
+    def launch():
+        nonlocal next_index
+        url = endpoints[next_index]
+        next_index += 1
+        pending[asyncio.create_task(_post_to_endpoint(url, query, timeout))] = url
+    
+    launch()
+    try:
+        while pending:
+            can_hedge = (
+                next_index < len(endpoints)
+                and len(pending) < MAX_HEDGED_REQUESTS
+                and _requests_in_flight < MAX_CONCURRENT_FETCHES
+            )
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=HEDGE_DELAY_SECONDS if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            
+            if not done:
+                if _requests_in_flight >= MAX_CONCURRENT_FETCHES:
+                    # Đã chạm giới hạn trong lúc chờ: tiếp tục chờ request đang chạy
+                    continue
+                logger.info(f"[OSM] Quá {HEDGE_DELAY_SECONDS}s chưa có phản hồi, gửi hedged request đến {endpoints[next_index]}")
+                launch()
+                continue
+            
+            for task in done:
+                url = pending.pop(task)
+                try:
+                    return task.result()
+                except Exception as e:
+                    logger.warning(f"[OSM] Endpoint {url} lỗi: {str(e)}")
+                    last_error = e
+            
+            # Failover sang mirror tiếp theo nếu còn
+            if next_index < len(endpoints) and len(pending) < max(MAX_HEDGED_REQUESTS, 1):
+                launch()
+        
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _merge_tile_rows(cache: TileCache, keys: List[TileKey]) -> List[Tuple[float, float, float, float]]:
+    """Gộp các ô lưới liền kề trên cùng một hàng thành bounding box để query gọn hơn"""
+    bboxes = []
+    run_start = None
+    previous = None
+    
+    for key in sorted(keys):
+        if previous is not None and key == (previous[0], previous[1] + 1):
+            previous = key
+            continue
+        if run_start is not None:
+            bboxes.append(_run_bounds(cache, run_start, previous))
+        run_start = previous = key
+    
+    if run_start is not None:
+        bboxes.append(_run_bounds(cache, run_start, previous))
+    
+    return bboxes
+
+
+def _run_bounds(cache: TileCache, first: TileKey, last: TileKey) -> Tuple[float, float, float, float]:
+    """Bounding box của một dãy ô lưới liên tiếp trên cùng hàng"""
+    south, west, _, _ = cache.tile_bounds(first)
+    _, _, north, east = cache.tile_bounds(last)
+    return (south, west, north, east)
+
+
+async def _fetch_tiles(cache: TileCache, keys: List[TileKey]) -> Dict[TileKey, List[Dict[str, Any]]]:
+    """
+    Tải một nhóm ô lưới bằng một Overpass query và lưu vào cache
+    
+    Args:
+        cache: Tile cache
+        keys: Danh sách ô lưới cần tải
+    
+    Returns:
+        Dictionary {ô lưới: danh sách cửa hàng đã chuẩn hóa}
+    """
+    elements = await _post_overpass_query(_build_overpass_bbox_query(_merge_tile_rows(cache, keys)))
+    logger.info(f"[OSM] Tìm thấy {len(elements)} địa điểm cho {len(keys)} ô lưới")
+    
+    # Phân bổ cửa hàng vào đúng ô lưới, chỉ giữ các ô đang thiếu
+    tile_shops = {key: [] for key in keys}
+    for shop in _normalize_elements(elements):
+        key = cache.tile_key(shop['lat'], shop['lon'])
+        if key in tile_shops:
+            tile_shops[key].append(shop)
+    
+    for key, shops in tile_shops.items():
+        cache.put(key, shops)
+        get_shop_index().insert_many(shops)
+    
+    return tile_shops
+
+
+async def _iter_fetched_tiles(
+    cache: TileCache, 
+    keys: List[TileKey]
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Tải các ô lưới còn thiếu theo từng nhóm nhỏ, song song với số kết nối giới hạn
+    
+    Mỗi nhóm tối đa TILES_PER_FETCH ô (liền kề theo hàng) là một query Overpass riêng,
+    nhỏ hơn và dễ cache hơn một query lớn. Kết quả của từng nhóm được trả ra ngay
+    khi nhóm đó hoàn tất. Các nhóm không giao nhau nên kết quả không bị trùng lặp.
+    
+    Args:
+        cache: Tile cache
+        keys: Danh sách ô lưới cần tải
+    
+    Yields:
+        Danh sách cửa hàng đã chuẩn hóa của từng nhóm ô
+    """
+    keys = sorted(keys)
+    chunks = [keys[i:i + TILES_PER_FETCH] for i in range(0, len(keys), TILES_PER_FETCH)]
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    
+    async def fetch_chunk(chunk: List[TileKey]) -> Dict[TileKey, List[Dict[str, Any]]]:
+        async with semaphore:
+            return await _fetch_tiles(cache, chunk)
+    
+    if len(chunks) > 1:
+        logger.info(f"[OSM] Chia {len(keys)} ô lưới thành {len(chunks)} query song song")
+    
+    tasks = [asyncio.create_task(fetch_chunk(chunk)) for chunk in chunks]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            fetched = await next_done
+            yield [shop for tile in fetched.values() for shop in tile]
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _split_cached_tiles(cache: TileCache, keys: List[TileKey]) -> Tuple[List[Dict[str, Any]], List[TileKey]]:
+    """Tách các ô lưới thành (cửa hàng đã có trong cache, danh sách ô còn thiếu)"""
+    shops = []
+    missing = []
+    for key in keys:
+        tile = cache.get(key)
+        if tile is None:
+            missing.append(key)
+        else:
+            shops.extend(tile)
+    
+    logger.info(f"[OSM] Cache ô lưới: {len(keys) - len(missing)}/{len(keys)} ô có sẵn")
+    return shops, missing
+
+
+async def _collect_tiles(cache: TileCache, keys: List[TileKey]) -> List[Dict[str, Any]]:
+    """Hợp các ô lưới có sẵn trong cache, chỉ tải các ô còn thiếu"""
+    shops, missing = _split_cached_tiles(cache, keys)
+    
+    if missing:
+        async for batch in _iter_fetched_tiles(cache, missing):
+            shops.extend(batch)
+    
+    return shops
+
+
+# Giữ tham chiếu các task bổ sung dữ liệu chạy nền (tránh bị garbage collect giữa chừng)
+_background_tasks = set()
+
+
+def _schedule_top_up(lat: float, lon: float, radius_km: float):
+    """Tải nền các ô lưới còn thiếu từ Overpass để bổ sung dữ liệu mới cho kho offline đã cũ"""
+    if not TILE_CACHE_ENABLED:
+        return
+    
+    cache = get_tile_cache()
+    _, missing = _split_cached_tiles(cache, cache.tiles_for_circle(lat, lon, radius_km))
+    if not missing:
+        return
+    
+    key = ('top_up',) + tuple(sorted(missing))
+    task = asyncio.ensure_future(search_flight.do(key, lambda: _collect_tiles(cache, missing)))
+    _background_tasks.add(task)
+    
+    def done(finished: asyncio.Task):
+        _background_tasks.discard(finished)
+        if not finished.cancelled() and finished.exception():
+            logger.warning(f"[OSM] Bổ sung dữ liệu từ Overpass thất bại: {str(finished.exception())}")
+    
+    task.add_done_callback(done)
+
+
+def _query_shop_store(store: ShopStore, lat: float, lon: float, radius_km: float) -> Optional[List[Dict[str, Any]]]:
+    """Truy vấn R-tree và giải mã JSON (chạy trong thread pool), None nếu kho không phủ vùng tìm kiếm"""
+    if not store.covers(lat, lon, radius_km):
+        return None
+    return store.query_radius_candidates(lat, lon, radius_km)
+
+
+async def _search_shop_store(lat: float, lon: float, radius_km: float, top_up: bool = True) -> Optional[List[Dict[str, Any]]]:
+    """
+    Tìm cửa hàng từ kho offline (SQLite R-tree), không chờ mạng
+    
+    Truy vấn SQLite chạy trong thread pool để không chặn event loop.
+    Nếu kho đã cũ, hợp thêm các cửa hàng mới có trong tile cache và (khi top_up)
+    tải nền các ô lưới còn thiếu từ Overpass cho các lần tìm sau.
+    
+    Returns:
+        Danh sách cửa hàng sắp xếp theo khoảng cách, None nếu không có kho offline
+        hoặc bản trích xuất không phủ vùng tìm kiếm (vd. kho chỉ có một thành phố)
+    """
+    store = get_shop_store()
+    if store is None:
+        return None
+    
+    shops = await asyncio.to_thread(_query_shop_store, store, lat, lon, radius_km)
+    if shops is None:
+        logger.info("[OSM] Kho offline không phủ vùng tìm kiếm, tìm trực tiếp từ Overpass")
+        return None
+    
+    if TILE_CACHE_ENABLED and store.is_stale():
+        cache = get_tile_cache()
+        fresh, _ = _split_cached_tiles(cache, cache.tiles_for_circle(lat, lon, radius_km))
+        if fresh:
+            # Dữ liệu từ Overpass mới hơn nên thay thế bản trong kho nếu trùng osm_id
+            fresh_ids = {shop.get('osm_id') for shop in fresh}
+            shops = [shop for shop in shops if shop.get('osm_id') not in fresh_ids] + fresh
+        if top_up:
+            _schedule_top_up(lat, lon, radius_km)
+    
+    return _attach_distances(shops, lat, lon, radius_km)
+
+
+async def _search_with_tile_cache(lat: float, lon: float, radius_km: float) -> List[Dict[str, Any]]:
+    """Trả lời truy vấn hình tròn bằng cách hợp các ô lưới trong cache"""
+    cache = get_tile_cache()
+    shops = await _collect_tiles(cache, cache.tiles_for_circle(lat, lon, radius_km))
+    return _attach_distances(shops, lat, lon, radius_km)
+
+
+@coalesce(search_flight, _search_key)
+async def search_nearby_shops(
     lat: float, 
     lon: float, 
     radius_meters: int = 5000, 
@@ -132,39 +691,30 @@ def search_nearby_shops(
     
     # Validate và giới hạn bán kính
     radius_meters = min(max(radius_meters, 100), MAX_RADIUS_METERS)
+    radius_km = radius_meters / 1000
+    
+    # Ưu tiên kho offline nếu có (trả lời trong vài mili giây); không có cửa hàng nào thì tìm trực tiếp
+    local_shops = await _search_shop_store(lat, lon, radius_km)
+    if local_shops:
+        logger.info(f"[OSM] Trả về {len(local_shops)} cửa hàng từ kho offline")
+        return local_shops
     
     try:
         logger.info(f"[OSM] Đang tìm kiếm cửa hàng trong bán kính {radius_meters}m...")
         
-        # Xây dựng query
-        query = _build_overpass_query(lat, lon, radius_meters)
-        
-        # Gọi Overpass API
-        with httpx.Client(timeout=TIMEOUT_SECONDS) as client:
-            response = client.post(OVERPASS_API_URL, data={'data': query})
-            response.raise_for_status()
-            data = response.json()
-        
-        elements = data.get('elements', [])
-        logger.info(f"[OSM] Tìm thấy {len(elements)} địa điểm từ OpenStreetMap")
-        
-        # Xử lý và chuẩn hóa dữ liệu
-        shops = []
-        for element in elements:
-            coords = _extract_coordinates(element)
-            if not coords:
-                continue
-            
-            shop_lat, shop_lon = coords
-            shop = _normalize_shop_data(element, shop_lat, shop_lon, lat, lon)
-            shops.append(shop)
-        
-        # Sắp xếp theo khoảng cách
-        shops.sort(key=lambda x: x['distance_km'])
+        if TILE_CACHE_ENABLED:
+            shops = await _search_with_tile_cache(lat, lon, radius_km)
+        else:
+            elements = await _post_overpass_query(_build_overpass_query(lat, lon, radius_meters))
+            logger.info(f"[OSM] Tìm thấy {len(elements)} địa điểm từ OpenStreetMap")
+            shops = _attach_distances(_normalize_elements(elements), lat, lon, radius_km)
         
         logger.info(f"[OSM] Trả về {len(shops)} cửa hàng")
         return shops
         
+    except CircuitOpenError as e:
+        logger.warning(f"[OSM] {str(e)}, dùng dữ liệu mẫu")
+        return _get_sample_places(lat, lon)
     except httpx.HTTPError as e:
         logger.error(f"[OSM] Lỗi HTTP khi gọi Overpass API: {str(e)}")
         return _get_sample_places(lat, lon)
@@ -173,6 +723,191 @@ def search_nearby_shops(
         return _get_sample_places(lat, lon)
 
 
+async def stream_nearby_shops(
+    lat: float, 
+    lon: float, 
+    radius_meters: int = 5000
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Tìm kiếm cửa hàng và trả kết quả dần theo từng phần khi có dữ liệu
+    
+    Phần đầu tiên là các cửa hàng đã có trong cache, sau đó là từng nhóm ô lưới
+    vừa tải xong từ Overpass. Các phần không trùng lặp nhau.
+    
+    Args:
+        lat: Vĩ độ vị trí người dùng
+        lon: Kinh độ vị trí người dùng
+        radius_meters: Bán kính tìm kiếm (mét), tối đa 50km
+    
+    Yields:
+        Danh sách cửa hàng (có distance_km) của từng phần, sắp xếp theo khoảng cách
+    """
+    if not PLACES_API_ENABLED:
+        logger.info("[OSM] Tìm kiếm chưa được kích hoạt")
+        return
+    
+    radius_km = min(max(radius_meters, 100), MAX_RADIUS_METERS) / 1000
+    
+    # Kho offline trả lời ngay, không cần chia phần
+    local_shops = await _search_shop_store(lat, lon, radius_km)
+    if local_shops:
+        yield local_shops
+        return
+    
+    if not TILE_CACHE_ENABLED:
+        yield await search_nearby_shops(lat, lon, radius_meters)
+        return
+    
+    cache = get_tile_cache()
+    yielded = False
+    
+    try:
+        shops, missing = _split_cached_tiles(cache, cache.tiles_for_circle(lat, lon, radius_km))
+        if shops:
+            yielded = True
+            yield _attach_distances(shops, lat, lon, radius_km)
+        
+        if missing:
+            async for batch in _iter_fetched_tiles(cache, missing):
+                yielded = True
+                yield _attach_distances(batch, lat, lon, radius_km)
+    
+    except Exception as e:
+        logger.error(f"[OSM] Lỗi khi tìm kiếm: {str(e)}")
+        if not yielded:
+            yield _get_sample_places(lat, lon)
+
+
+async def search_cached_shops(lat: float, lon: float, radius_meters: int) -> List[Dict[str, Any]]:
+    """
+    Tìm cửa hàng chỉ từ kho offline hoặc chỉ mục không gian trong bộ nhớ, không gọi mạng
+    (dùng khi hết thời gian chờ Overpass)
+    
+    Chỉ mục gồm danh mục Google Sheets và kết quả Overpass còn trong TTL của tile cache.
+    
+    Args:
+        lat: Vĩ độ vị trí người dùng
+        lon: Kinh độ vị trí người dùng
+        radius_meters: Bán kính tìm kiếm (mét), tối đa 50km
+    
+    Returns:
+        Danh sách cửa hàng có sẵn trong cache, sắp xếp theo khoảng cách
+    """
+    if not PLACES_API_ENABLED:
+        return []
+    
+    radius_km = min(max(radius_meters, 100), MAX_RADIUS_METERS) / 1000
+    
+    local_shops = await _search_shop_store(lat, lon, radius_km, top_up=False)
+    if local_shops:
+        return local_shops
+    
+    return get_shop_index().query_radius(lat, lon, radius_km)
+
+
+@coalesce(search_flight, lambda args: ('progressive',) + _search_key(args))
+async def search_nearby_shops_progressive(
+    lat: float,
+    lon: float,
+    min_radius_meters: int,
+    max_radius_meters: int,
+    max_shops: int,
+    growth_factor: float = RING_GROWTH_FACTOR
+) -> List[Dict[str, Any]]:
+    """
+    Tìm kiếm cửa hàng với bán kính tăng dần, chỉ mở rộng đến khi đủ max_shops
+    
+    Mỗi vòng chỉ tải phần vành khăn (các ô lưới) chưa được tải ở vòng trước,
+    nên không tải lại dữ liệu đã có như khi gọi search_nearby_shops hai lần.
+    
+    Args:
+        lat: Vĩ độ vị trí người dùng
+        lon: Kinh độ vị trí người dùng
+        min_radius_meters: Bán kính bắt đầu (mét), thường là bán kính ưu tiên
+        max_radius_meters: Bán kính tối đa (mét), tối đa 50km
+        max_shops: Số lượng cửa hàng cần đạt để dừng mở rộng
+        growth_factor: Hệ số nhân bán kính sau mỗi vòng
+    
+    Returns:
+        Danh sách cửa hàng trong bán kính cuối cùng, sắp xếp theo khoảng cách
+    """
+    if not PLACES_API_ENABLED:
+        logger.info("[OSM] Tìm kiếm chưa được kích hoạt")
+        return []
+    
+    # Validate và giới hạn bán kính
+    min_radius_meters = min(max(min_radius_meters, 100), MAX_RADIUS_METERS)
+    max_radius_meters = min(max(max_radius_meters, min_radius_meters), MAX_RADIUS_METERS)
+    
+    # Cửa hàng từ kho offline, dùng thay dữ liệu mẫu nếu Overpass lỗi
+    store_shops: List[Dict[str, Any]] = []
+    store = get_shop_store()
+    if store is not None:
+        # Kho offline trả lời mỗi vòng trong vài mili giây nên mở rộng trực tiếp trên kho
+        radius_meters = min_radius_meters
+        while True:
+            started = time.perf_counter()
+            shops = await _search_shop_store(lat, lon, radius_meters / 1000, top_up=False)
+            STAGE_LATENCY.observe(time.perf_counter() - started, stage='expansion')
+            if shops is None:
+                # Vòng này vượt ra ngoài bản trích xuất
+                break
+            store_shops = shops
+            if len(shops) >= max_shops:
+                logger.info(f"[OSM] Bán kính {radius_meters}m: {len(shops)} cửa hàng từ kho offline")
+                # Chỉ bổ sung từ Overpass cho bán kính cuối cùng để không tải trùng các vòng trong
+                if TILE_CACHE_ENABLED and store.is_stale():
+                    _schedule_top_up(lat, lon, radius_meters / 1000)
+                return shops
+            if radius_meters >= max_radius_meters:
+                break
+            radius_meters = min(int(radius_meters * growth_factor), max_radius_meters)
+        logger.info(f"[OSM] Kho offline có {len(store_shops)}/{max_shops} cửa hàng, tìm thêm từ Overpass")
+    
+    if not TILE_CACHE_ENABLED:
+        # Không có cache ô lưới thì không tải riêng được vành khăn:
+        # truy vấn bán kính lớn đã bao gồm kết quả bán kính nhỏ nên không cần gộp
+        shops = await search_nearby_shops(lat, lon, min_radius_meters)
+        if len(shops) < max_shops and max_radius_meters > min_radius_meters:
+            shops = await search_nearby_shops(lat, lon, max_radius_meters)
+        return shops
+    
+    try:
+        cache = get_tile_cache()
+        seen = set()
+        collected = []
+        radius_meters = min_radius_meters
+        rings = 0
+        
+        while True:
+            rings += 1
+            started = time.perf_counter()
+            radius_km = radius_meters / 1000
+            keys = [key for key in cache.tiles_for_circle(lat, lon, radius_km) if key not in seen]
+            seen.update(keys)
+            collected.extend(await _collect_tiles(cache, keys))
+            
+            shops = _attach_distances(collected, lat, lon, radius_km)
+            STAGE_LATENCY.observe(time.perf_counter() - started, stage='expansion')
+            logger.info(f"[OSM] Bán kính {radius_meters}m: {len(shops)} cửa hàng")
+            
+            if len(shops) >= max_shops or radius_meters >= max_radius_meters:
+                SEARCH_RINGS.observe(rings)
+                return shops
+            
+            radius_meters = min(int(radius_meters * growth_factor), max_radius_meters)
+        
+    except CircuitOpenError as e:
+        logger.warning(f"[OSM] {str(e)}, dùng dữ liệu mẫu")
+        return store_shops or _get_sample_places(lat, lon)
+    except httpx.HTTPError as e:
+        logger.error(f"[OSM] Lỗi HTTP khi gọi Overpass API: {str(e)}")
+        return store_shops or _get_sample_places(lat, lon)
+    except Exception as e:
+        logger.error(f"[OSM] Lỗi khi tìm kiếm: {str(e)}", exc_info=True)
+        return store_shops or _get_sample_places(lat, lon)
+
+
 def _get_sample_places(lat: float, lon: float) -> List[Dict[str, Any]]:
     """Trả về dữ liệu mẫu khi có lỗi hoặc không tìm được"""
     import random
@@ -186,15 +921,17 @@ def _get_sample_places(lat: float, lon: float) -> List[Dict[str, Any]]:
     sample_categories = ["Thời trang nam", "Thời trang nữ", "Quần áo", "Phụ kiện"]
     sample_price_ranges = ["Bình dân", "Trung cấp", "Cao cấp"]
     
+    # Tạo tọa độ ngẫu nhiên trong bán kính 5km
+    coords = [
+        (lat + random.uniform(-0.045, 0.045), lon + random.uniform(-0.045, 0.045))
+        for _ in sample_names
+    ]
+    distances = calculate_distances_batch(lat, lon, [c[0] for c in coords], [c[1] for c in coords])
+    
     shops = []
     for i, name in enumerate(sample_names):
-        # Tạo tọa độ ngẫu nhiên trong bán kính 5km
-        offset_lat = random.uniform(-0.045, 0.045)
-        offset_lon = random.uniform(-0.045, 0.045)
-        
-        shop_lat = lat + offset_lat
-        shop_lon = lon + offset_lon
-        distance_km = calculate_distance(lat, lon, shop_lat, shop_lon)
+        shop_lat, shop_lon = coords[i]
+        distance_km = float(distances[i])
         
         shops.append({
             'name': f"{name} - Chi nhánh {i+1}",
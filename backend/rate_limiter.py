@@ -0,0 +1,154 @@
+# rate_limiter.py - Module giới hạn tốc độ gọi API phía client (token bucket + hàng đợi có giới hạn)
+# Dùng để giữ lượng request/token gửi tới Gemini trong hạn mức RPM/TPM, tránh lỗi 429 khi tải tăng đột biến
+
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Hàng đợi chờ đã đầy, request bị từ chối ngay thay vì chờ"""
+    pass
+
+
+class TokenBucket:
+    """Bucket nạp lại liên tục theo thời gian, dung lượng tối đa bằng hạn mức mỗi phút"""
+
+    def __init__(self, per_minute: float):
+        """
+        Args:
+            per_minute: Hạn mức mỗi phút (cũng là dung lượng tối đa của bucket)
+        """
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        """Nạp lại token theo thời gian đã trôi qua"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Số giây cần chờ để có đủ amount token (0 nếu đủ ngay)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """Trừ token (có thể âm nếu amount lớn hơn dung lượng)"""
+        self._refill()
+        self.tokens -= amount
+
+
+class AdmissionController:
+    """
+    Kiểm soát đầu vào cho một API có hạn mức RPM và TPM
+
+    Mỗi lời gọi lấy 1 request và số token ước lượng từ hai bucket. Khi chưa đủ,
+    caller xếp hàng theo thứ tự đến (FIFO); khi hàng đợi đầy thì bị từ chối ngay
+    (AdmissionRejected). Lỗi hết hạn mức từ server tạm dừng toàn bộ bucket
+    trong một khoảng backoff có jitter.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_queue: int = 20,
+        backoff_base_seconds: float = 1.0,
+        backoff_max_seconds: float = 30.0
+    ):
+        """
+        Args:
+            name: Tên dùng trong log
+            requests_per_minute: Hạn mức request mỗi phút (RPM)
+            tokens_per_minute: Hạn mức token mỗi phút (TPM)
+            max_queue: Số caller tối đa được chờ trong hàng đợi
+            backoff_base_seconds: Thời gian backoff cơ sở khi bị server giới hạn
+            backoff_max_seconds: Thời gian backoff tối đa
+        """
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_queue = max_queue
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+        self._paused_until = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def queue_depth(self) -> int:
+        """Số caller đang chờ trong hàng đợi"""
+        return self._waiting
+
+    async def acquire(self, token_cost: int = 0):
+        """
+        Chờ đến lượt gọi API
+
+        Args:
+            token_cost: Số token ước lượng của lời gọi
+
+        Raises:
+            AdmissionRejected: Khi hàng đợi đã đầy
+        """
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(f"Hàng đợi {self.name} đã đầy ({self._waiting}/{self.max_queue})")
+
+        self._waiting += 1
+        try:
+            # Lock của asyncio đánh thức caller theo thứ tự đến nên hàng đợi là FIFO
+            async with self._lock:
+                while True:
+                    wait = max(
+                        self._paused_until - time.monotonic(),
+                        self.requests.wait_time(1),
+                        self.tokens.wait_time(token_cost)
+                    )
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+
+                self.requests.consume(1)
+                self.tokens.consume(token_cost)
+                self.admitted += 1
+        finally:
+            self._waiting -= 1
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Tạm dừng bucket sau khi server báo hết hạn mức (exponential backoff + full jitter)
+
+        Args:
+            attempt: Số lần thử lại (bắt đầu từ 0)
+
+        Returns:
+            Số giây tạm dừng
+        """
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** attempt)))
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self.throttled += 1
+        logger.warning(f"[{self.name}] Bị giới hạn hạn mức, tạm dừng {delay:.2f}s (lần {attempt + 1})")
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê kiểm soát đầu vào"""
+        return {
+            'queue_depth': self.queue_depth(),
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'throttled': self.throttled
+        }
@@ -0,0 +1,182 @@
+# response_cache.py - Module cache phản hồi dạng chuỗi (LRU + TTL) với tầng lưu đĩa tùy chọn
+# Tầng bộ nhớ trả lời trong micro giây, tầng đĩa (SQLite) giữ kết quả qua các lần khởi động lại
+
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Số lần ghi xuống đĩa giữa hai lần dọn phản hồi hết hạn / vượt giới hạn
+DISK_PRUNE_EVERY = 100
+
+
+class ResponseCache:
+    """
+    Cache LRU + TTL trong bộ nhớ, có thể kèm tầng lưu trên đĩa bằng SQLite
+
+    get/set là coroutine: tầng bộ nhớ trả lời ngay, còn đọc/ghi SQLite chạy trong
+    thread pool (asyncio.to_thread) để không chặn event loop. Tầng đĩa được dọn
+    phản hồi hết hạn và giới hạn số dòng mỗi DISK_PRUNE_EVERY lần ghi.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: float = 3600,
+        disk_path: Optional[str] = None,
+        max_disk_entries: int = 10000
+    ):
+        """
+        Khởi tạo cache
+
+        Args:
+            max_entries: Số phản hồi tối đa giữ trong bộ nhớ
+            ttl_seconds: Thời gian sống của một phản hồi (giây)
+            disk_path: Đường dẫn file SQLite cho tầng đĩa (None = chỉ dùng bộ nhớ)
+            max_disk_entries: Số phản hồi tối đa giữ trên đĩa (bỏ các phản hồi cũ nhất)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Kết nối SQLite dùng chung giữa các thread của pool, mỗi lần chỉ một thread dùng
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_pruned = 0
+
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, disk_path: str):
+        """Mở (hoặc tạo) file SQLite cho tầng đĩa"""
+        try:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+            self._db.commit()
+            # Dọn phần còn sót từ lần chạy trước (chạy lúc khởi tạo, chưa có event loop phục vụ request)
+            self._prune_disk(time.time())
+            logger.info(f"Bật cache phản hồi trên đĩa: {disk_path}")
+        except Exception as e:
+            logger.error(f"Không mở được cache trên đĩa, chỉ dùng bộ nhớ: {str(e)}")
+            self._db = None
+
+    async def get(self, key: str) -> Optional[str]:
+        """Lấy phản hồi theo khóa, None nếu chưa có hoặc đã hết hạn"""
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._read_disk, key)
+            if row is not None and now - row[1] <= self.ttl_seconds:
+                with self._lock:
+                    # Đưa lên tầng bộ nhớ cho các lần sau
+                    self._store_memory(key, row[0], row[1])
+                    self.disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        """Lưu phản hồi vào cache (cả tầng bộ nhớ và tầng đĩa nếu có)"""
+        now = time.time()
+
+        with self._lock:
+            self._store_memory(key, value, now)
+
+        if self._db is not None:
+            await asyncio.to_thread(self._write_disk, key, value, now)
+
+    def _read_disk(self, key: str) -> Optional[Tuple[str, float]]:
+        """Đọc một phản hồi từ tầng đĩa (chạy trong thread pool)"""
+        try:
+            with self._db_lock:
+                return self._db.execute(
+                    "SELECT value, stored_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"Lỗi đọc cache phản hồi từ đĩa: {str(e)}")
+            return None
+
+    def _write_disk(self, key: str, value: str, stored_at: float):
+        """Ghi một phản hồi xuống tầng đĩa, định kỳ dọn phản hồi cũ (chạy trong thread pool)"""
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, value, stored_at)
+                )
+                self._db.commit()
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= DISK_PRUNE_EVERY:
+                    self._prune_disk(stored_at)
+        except Exception as e:
+            logger.error(f"Lỗi ghi cache phản hồi xuống đĩa: {str(e)}")
+
+    def _prune_disk(self, now: float):
+        """Xóa phản hồi hết hạn và phản hồi cũ nhất vượt quá max_disk_entries (gọi khi giữ _db_lock hoặc lúc khởi tạo)"""
+        expired = self._db.execute(
+            "DELETE FROM responses WHERE stored_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        overflow = self._db.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        ).rowcount
+        self._db.commit()
+        self._writes_since_prune = 0
+        self.disk_pruned += expired + overflow
+        if expired or overflow:
+            logger.info(f"Dọn cache phản hồi trên đĩa: {expired} hết hạn, {overflow} vượt giới hạn")
+
+    def _store_memory(self, key: str, value: str, stored_at: float):
+        """Lưu vào tầng bộ nhớ và loại bỏ phần tử ít dùng nhất khi đầy"""
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Xóa toàn bộ cache (cả tầng đĩa)"""
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê cache"""
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'disk_pruned': self.disk_pruned
+        }
@@ -0,0 +1,153 @@
+# shop_catalog.py - Ảnh chụp (snapshot) danh mục cửa hàng từ Google Sheets trong bộ nhớ
+# /chat tìm trong danh mục trước, chỉ gọi Overpass khi danh mục không đủ cửa hàng hoặc đã cũ
+
+import os
+import time
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional
+from gsheet_connector import get_connector, get_write_queue
+from spatial_index import SpatialIndex, get_shop_index, prepare_shop
+
+logger = logging.getLogger(__name__)
+
+# Bật chế độ tìm trong danh mục trước khi gọi Overpass
+CATALOG_FIRST_ENABLED = os.getenv('CATALOG_FIRST_ENABLED', 'true').lower() == 'true'
+
+# Chu kỳ đọc lại toàn bộ sheet (giây)
+CATALOG_REFRESH_SECONDS = float(os.getenv('CATALOG_REFRESH_SECONDS', '300'))
+
+# Snapshot cũ hơn thời gian này (ví dụ do đọc sheet lỗi liên tục) thì không dùng một mình (giây)
+CATALOG_MAX_AGE_SECONDS = float(os.getenv('CATALOG_MAX_AGE_SECONDS', '900'))
+
+
+class ShopCatalog:
+    """
+    Snapshot danh mục cửa hàng đã lưu trên Google Sheets, có chỉ mục không gian riêng
+
+    Background task đọc lại sheet theo chu kỳ bằng get_shops_data và thay snapshot cũ.
+    Snapshot mới giữ cả cửa hàng còn trong hàng đợi ghi sheet (chưa có trên sheet).
+    Đọc lỗi thì giữ snapshot cũ; khi quá CATALOG_MAX_AGE_SECONDS snapshot bị coi là cũ.
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float = CATALOG_REFRESH_SECONDS,
+        max_age: float = CATALOG_MAX_AGE_SECONDS
+    ):
+        """
+        Args:
+            refresh_interval: Chu kỳ đọc lại sheet (giây)
+            max_age: Tuổi tối đa của snapshot trước khi bị coi là cũ (giây)
+        """
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._index = SpatialIndex()
+        self._refreshed_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.refresh_count = 0
+        self.failed_refreshes = 0
+
+    async def refresh(self, spreadsheet_id: str, sheet_name: str = "Trang tính 1") -> int:
+        """
+        Đọc toàn bộ sheet và thay snapshot hiện tại
+
+        Returns:
+            Số cửa hàng có tọa độ hợp lệ trong snapshot mới (kể cả cửa hàng chờ ghi)
+        """
+        connector = get_connector(credentials_json=os.getenv('GOOGLE_SHEETS_CREDENTIALS', '').strip())
+        write_queue = get_write_queue()
+        # Lấy trước khi đọc: lô được ghi xong trong lúc đang đọc có thể không có trong kết quả đọc
+        queued = write_queue.pending_shops(spreadsheet_id, sheet_name)
+        # gspread là thư viện đồng bộ, chạy trong thread pool
+        records = await asyncio.to_thread(connector.get_shops_data, spreadsheet_id, sheet_name, False)
+        queued += write_queue.pending_shops(spreadsheet_id, sheet_name)
+
+        # get_shops_data đã ép cột chữ về str; chuẩn hóa tọa độ và điểm ưu tiên tĩnh một lần rồi
+        # dùng chung bản ghi cho snapshot và chỉ mục dùng chung (chat_only, quá hạn Overpass)
+        shops = [shop for shop in map(prepare_shop, records) if shop is not None]
+
+        index = SpatialIndex(self._index.cell_size_deg)
+        # Cửa hàng chưa ghi xong vào sheet vẫn nằm trong snapshot; bản trên sheet (nếu có) được thêm sau nên ghi đè
+        index.insert_many(queued)
+        index.insert_many(shops)
+        count = len(index)
+        self._index = index
+        self._refreshed_at = time.monotonic()
+        self.refresh_count += 1
+
+        # Chỉ mục dùng chung (search_cached_shops) cũng biết các cửa hàng này, không hết hạn như kết quả Overpass
+        get_shop_index().insert_many(shops, pinned=True)
+
+        logger.info(f"[DANH MỤC] Snapshot {count} cửa hàng ({len(records)} dòng Google Sheets, {len(queued)} chờ ghi)")
+        return count
+
+    def insert_many(self, shops: List[Dict[str, Any]]) -> int:
+        """Thêm cửa hàng vừa đưa vào hàng đợi ghi sheet, không chờ lần đọc lại tiếp theo"""
+        return self._index.insert_many(shops)
+
+    def query_radius(self, lat: float, lon: float, radius_km: float) -> List[Dict[str, Any]]:
+        """Cửa hàng trong snapshot nằm trong bán kính, sắp xếp theo khoảng cách"""
+        return self._index.query_radius(lat, lon, radius_km)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def age(self) -> Optional[float]:
+        """Tuổi snapshot (giây), None nếu chưa đọc được lần nào"""
+        if self._refreshed_at is None:
+            return None
+        return time.monotonic() - self._refreshed_at
+
+    def is_stale(self) -> bool:
+        """Chưa có snapshot hoặc snapshot đã quá max_age"""
+        age = self.age()
+        return age is None or age > self.max_age
+
+    async def _run(self, spreadsheet_id: str, sheet_name: str):
+        """Vòng lặp đọc lại sheet định kỳ"""
+        while True:
+            try:
+                await self.refresh(spreadsheet_id, sheet_name)
+            except Exception as e:
+                self.failed_refreshes += 1
+                logger.warning(f"[DANH MỤC] Không đọc được Google Sheets, giữ snapshot cũ: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, spreadsheet_id: str, sheet_name: str = "Trang tính 1"):
+        """Khởi động background task (gọi khi FastAPI startup), lần đọc đầu tiên chạy ngay"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(spreadsheet_id, sheet_name))
+            logger.info(f"[DANH MỤC] Đọc danh mục định kỳ mỗi {self.refresh_interval}s")
+
+    async def stop(self):
+        """Dừng background task (gọi khi FastAPI shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê snapshot"""
+        age = self.age()
+        return {
+            'shops': len(self),
+            'age_seconds': round(age, 1) if age is not None else None,
+            'stale': self.is_stale(),
+            'refreshes': self.refresh_count,
+            'failed_refreshes': self.failed_refreshes
+        }
+
+
+# Singleton instance
+_catalog_instance = None
+
+def get_shop_catalog() -> ShopCatalog:
+    """Lấy instance ShopCatalog (Singleton pattern)"""
+    global _catalog_instance
+    if _catalog_instance is None:
+        _catalog_instance = ShopCatalog()
+    return _catalog_instance
@@ -0,0 +1,201 @@
+# shop_store.py - Kho cửa hàng offline trên đĩa (SQLite + R-tree) nhập từ bản trích xuất OSM
+# Trả lời truy vấn theo bán kính trong vài mili giây, không phụ thuộc Overpass
+
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+import logging
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Đường dẫn file SQLite (rỗng = không dùng kho offline)
+SHOP_STORE_PATH = os.getenv('OSM_SHOP_STORE_PATH', '')
+
+# Dữ liệu cũ hơn số ngày này thì bổ sung thêm từ Overpass
+SHOP_STORE_MAX_AGE_DAYS = float(os.getenv('OSM_SHOP_STORE_MAX_AGE_DAYS', '30'))
+
+# Số km trên 1 độ vĩ (xấp xỉ)
+KM_PER_DEG_LAT = 111.32
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shops (
+    id INTEGER PRIMARY KEY,
+    osm_key TEXT NOT NULL UNIQUE,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS shops_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def _radius_deltas(lat: float, radius_km: float) -> Tuple[float, float]:
+    """Nửa cạnh (độ vĩ, độ kinh) của bounding box bao quanh hình tròn bán kính radius_km"""
+    dlat = radius_km / KM_PER_DEG_LAT
+    dlon = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return dlat, dlon
+
+
+class ShopStore:
+    """Kho cửa hàng chỉ đọc trong lúc phục vụ request, ghi khi chạy lệnh import"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Đường dẫn file SQLite (tạo mới nếu chưa có)
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # Bounding box (south, west, north, east) của dữ liệu đã import, đọc một lần khi cần
+        self._bounds: Optional[Tuple[float, float, float, float]] = None
+        self._bounds_loaded = False
+
+    def insert_many(self, shops: Iterable[Dict[str, Any]], osm_type: str = 'node') -> int:
+        """
+        Thêm (hoặc thay thế) cửa hàng đã chuẩn hóa
+
+        Args:
+            shops: Cửa hàng theo định dạng của places_service._normalize_shop_data,
+                   có thể kèm 'osm_type' để phân biệt node/way cùng id
+
+        Returns:
+            Số cửa hàng đã ghi
+        """
+        count = 0
+        with self._lock:
+            cursor = self._db.cursor()
+            for shop in shops:
+                data = {key: value for key, value in shop.items() if key != 'osm_type'}
+                osm_key = f"{shop.get('osm_type', osm_type)}/{shop.get('osm_id')}"
+                # Upsert giữ nguyên id để cập nhật đúng dòng trong R-tree
+                cursor.execute(
+                    "INSERT INTO shops (osm_key, lat, lon, data) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(osm_key) DO UPDATE SET lat = excluded.lat, lon = excluded.lon, data = excluded.data",
+                    (osm_key, shop['lat'], shop['lon'], json.dumps(data, ensure_ascii=False))
+                )
+                row_id = cursor.execute("SELECT id FROM shops WHERE osm_key = ?", (osm_key,)).fetchone()[0]
+                cursor.execute(
+                    "INSERT OR REPLACE INTO shops_rtree (id, min_lat, max_lat, min_lon, max_lon) VALUES (?, ?, ?, ?, ?)",
+                    (row_id, shop['lat'], shop['lat'], shop['lon'], shop['lon'])
+                )
+                count += 1
+            self._db.commit()
+        return count
+
+    def clear(self):
+        """Xóa toàn bộ dữ liệu (trước khi import lại)"""
+        with self._lock:
+            self._db.execute("DELETE FROM shops")
+            self._db.execute("DELETE FROM shops_rtree")
+            self._db.commit()
+
+    def mark_imported(self, source: str):
+        """Ghi lại thời điểm, nguồn dữ liệu import và vùng phủ của kho"""
+        with self._lock:
+            bounds = self._compute_bounds()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [('imported_at', str(time.time())), ('source', source), ('bounds', json.dumps(bounds))]
+            )
+            self._db.commit()
+            self._bounds = bounds
+            self._bounds_loaded = True
+
+    def _compute_bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        """Bounding box của mọi cửa hàng trong kho, None nếu kho rỗng (gọi khi giữ _lock)"""
+        row = self._db.execute("SELECT MIN(lat), MIN(lon), MAX(lat), MAX(lon) FROM shops").fetchone()
+        return tuple(row) if row and row[0] is not None else None
+
+    def bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        """
+        Vùng phủ (south, west, north, east) của bản trích xuất đã import
+
+        Kho import trước khi có meta 'bounds' thì tính từ bảng shops một lần.
+        """
+        if not self._bounds_loaded:
+            with self._lock:
+                row = self._db.execute("SELECT value FROM meta WHERE key = 'bounds'").fetchone()
+                value = json.loads(row[0]) if row else self._compute_bounds()
+                self._bounds = tuple(value) if value else None
+                self._bounds_loaded = True
+        return self._bounds
+
+    def covers(self, lat: float, lon: float, radius_km: float) -> bool:
+        """Bounding box của hình tròn tìm kiếm nằm trọn trong vùng phủ của kho"""
+        bounds = self.bounds()
+        if bounds is None:
+            return False
+        south, west, north, east = bounds
+        dlat, dlon = _radius_deltas(lat, radius_km)
+        return south <= lat - dlat and north >= lat + dlat and west <= lon - dlon and east >= lon + dlon
+
+    def imported_at(self) -> Optional[float]:
+        """Thời điểm import (epoch giây), None nếu chưa import"""
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'imported_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def is_stale(self, max_age_days: float = SHOP_STORE_MAX_AGE_DAYS) -> bool:
+        """Dữ liệu đã cũ, cần bổ sung từ Overpass"""
+        imported_at = self.imported_at()
+        return imported_at is None or time.time() - imported_at > max_age_days * 86400
+
+    def query_bbox(self, south: float, west: float, north: float, east: float) -> List[Dict[str, Any]]:
+        """Lấy cửa hàng trong bounding box qua chỉ mục R-tree"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT s.data FROM shops_rtree r JOIN shops s ON s.id = r.id "
+                "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?",
+                (south, north, west, east)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def query_radius_candidates(self, lat: float, lon: float, radius_km: float) -> List[Dict[str, Any]]:
+        """
+        Lấy cửa hàng trong bounding box bao quanh hình tròn tìm kiếm
+
+        Kết quả chưa lọc chính xác theo bán kính; caller tính khoảng cách và lọc.
+        """
+        dlat, dlon = _radius_deltas(lat, radius_km)
+        return self.query_bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+
+    def count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM shops").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê kho cửa hàng"""
+        return {
+            'path': self.path,
+            'shops': self.count(),
+            'imported_at': self.imported_at(),
+            'bounds': self.bounds(),
+            'stale': self.is_stale()
+        }
+
+
+# Singleton instance
+_shop_store_instance = None
+_shop_store_checked = False
+
+def get_shop_store() -> Optional[ShopStore]:
+    """Lấy instance ShopStore (Singleton pattern), None nếu chưa cấu hình hoặc chưa import"""
+    global _shop_store_instance, _shop_store_checked
+    if not _shop_store_checked:
+        _shop_store_checked = True
+        if SHOP_STORE_PATH and os.path.exists(SHOP_STORE_PATH):
+            try:
+                _shop_store_instance = ShopStore(SHOP_STORE_PATH)
+                logger.info(f"Dùng kho cửa hàng offline: {SHOP_STORE_PATH} ({_shop_store_instance.count()} cửa hàng)")
+            except Exception as e:
+                logger.error(f"Không mở được kho cửa hàng offline: {str(e)}")
+                _shop_store_instance = None
+    return _shop_store_instance
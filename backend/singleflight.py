@@ -0,0 +1,96 @@
+# singleflight.py - Module gộp các request giống nhau đang chạy đồng thời (request coalescing)
+# Nhiều caller cùng khóa chỉ tạo một lời gọi upstream và dùng chung kết quả
+
+import asyncio
+import functools
+import inspect
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi bất đồng bộ có cùng khóa khi chúng chạy chồng lên nhau
+
+    Lời gọi đầu tiên chạy trong một task riêng; các caller đến sau với cùng khóa
+    chờ chính task đó. Kết quả dùng chung nên caller không được sửa trực tiếp.
+    Task được tách khỏi caller nên một caller bị hủy không làm hủy các caller khác.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        """
+        Args:
+            name: Tên dùng trong log
+        """
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Chạy fn() hoặc chờ lời gọi đang chạy với cùng khóa
+
+        Args:
+            key: Khóa gộp request
+            fn: Hàm tạo coroutine gọi upstream
+
+        Returns:
+            Kết quả của lời gọi (dùng chung giữa các caller)
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+        else:
+            self.coalesced += 1
+            logger.debug(f"[{self.name}] Gộp request với khóa {key}")
+
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        """Dọn khóa khi task xong và đánh dấu exception đã được đọc"""
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        """Số lời gọi upstream đang chạy"""
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê gộp request"""
+        return {
+            'in_flight': self.in_flight(),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced
+        }
+
+
+def coalesce(flight: SingleFlight, key_fn: Callable[[Dict[str, Any]], Hashable]):
+    """
+    Decorator gộp các lời gọi đồng thời của một hàm async qua SingleFlight
+
+    Args:
+        flight: Instance SingleFlight dùng chung
+        key_fn: Hàm nhận dictionary tham số (đã điền giá trị mặc định) và trả về khóa gộp
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return await flight.do(key_fn(bound.arguments), lambda: fn(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,326 @@
+# spatial_index.py - Chỉ mục không gian trong bộ nhớ (lưới ô vuông theo độ) cho danh mục cửa hàng
+# Truy vấn theo bán kính / k cửa hàng gần nhất chỉ xét các ô lân cận thay vì toàn bộ danh sách
+
+import heapq
+import math
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Iterable, Optional, Set, Tuple
+from geofilter import calculate_distances_batch, static_priority_score, STATIC_SCORE_KEY, _validate_coordinates
+from tile_cache import TILE_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Kích thước cạnh ô lưới (độ), ~1.1km theo vĩ độ
+SPATIAL_INDEX_CELL_DEG = float(os.getenv('SPATIAL_INDEX_CELL_DEG', '0.01'))
+
+# Số cửa hàng tối đa (không tính danh mục Google Sheets) trong chỉ mục dùng chung
+SHOP_INDEX_MAX_ENTRIES = int(os.getenv('SHOP_INDEX_MAX_ENTRIES', '100000'))
+
+# Bán kính tối đa khi tìm k cửa hàng gần nhất (km)
+NEAREST_MAX_RADIUS_KM = 50.0
+
+# Số km trên 1 độ vĩ (xấp xỉ)
+KM_PER_DEG_LAT = 111.32
+
+CellKey = Tuple[int, int]
+
+
+def shop_identity(shop: Dict[str, Any]) -> str:
+    """
+    Khóa định danh cửa hàng: tên + tọa độ làm tròn 4 chữ số
+    
+    Cùng cách so trùng với app._merge_shops_without_duplicates, nên một cửa hàng
+    vừa có trong Google Sheets vừa có từ Overpass chỉ được giữ một lần.
+    """
+    return f"{str(shop.get('name', '')).strip().lower()}|{round(float(shop['lat']), 4)}|{round(float(shop['lon']), 4)}"
+
+
+def prepare_shop(shop: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Chuẩn hóa cửa hàng trước khi đưa vào chỉ mục: tọa độ dạng số và điểm ưu tiên tĩnh
+
+    Trả về chính bản ghi nếu đã chuẩn hóa (không sao chép), None nếu tọa độ không hợp lệ.
+    """
+    try:
+        lat = float(shop.get('lat'))
+        lon = float(shop.get('lon'))
+    except (TypeError, ValueError):
+        return None
+    if not _validate_coordinates(lat, lon):
+        return None
+
+    if shop.get('lat') != lat or shop.get('lon') != lon or STATIC_SCORE_KEY not in shop:
+        # Bản sao có tọa độ dạng số và điểm ưu tiên tĩnh (bản ghi từ Google Sheets chưa có)
+        shop = {**shop, 'lat': lat, 'lon': lon}
+        shop.setdefault(STATIC_SCORE_KEY, static_priority_score(shop))
+    return shop
+
+
+class SpatialIndex:
+    """
+    Chỉ mục lưới: mỗi ô giữ các cửa hàng nằm trong ô đó
+
+    Thêm cửa hàng là O(1); cửa hàng trùng khóa (shop_identity) được thay thế.
+    Truy vấn chỉ tính khoảng cách cho các cửa hàng trong những ô giao với vùng tìm kiếm.
+
+    Có ttl_seconds / max_entries thì cửa hàng hết hạn sau ttl_seconds kể từ lần thêm gần nhất
+    và cửa hàng thêm sớm nhất bị loại khi vượt max_entries. Cửa hàng thêm với pinned=True
+    (danh mục Google Sheets) không hết hạn và không bị loại.
+    """
+
+    def __init__(
+        self,
+        cell_size_deg: float = SPATIAL_INDEX_CELL_DEG,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None
+    ):
+        """
+        Args:
+            cell_size_deg: Kích thước cạnh ô lưới (độ)
+            ttl_seconds: Thời gian sống của cửa hàng không pinned (giây), None = không hết hạn
+            max_entries: Số cửa hàng không pinned tối đa, None = không giới hạn
+        """
+        self.cell_size_deg = cell_size_deg
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # {ô: {khóa cửa hàng: cửa hàng}}
+        self._cells: Dict[CellKey, Dict[str, Dict[str, Any]]] = {}
+        # {khóa cửa hàng: ô chứa cửa hàng}
+        self._locations: Dict[str, CellKey] = {}
+        # {khóa cửa hàng không pinned: thời điểm thêm}, theo thứ tự thêm (cũ nhất trước)
+        self._added_at: "OrderedDict[str, float]" = OrderedDict()
+        self._pinned: Set[str] = set()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def cell_key(self, lat: float, lon: float) -> CellKey:
+        """Lấy khóa ô chứa điểm (lat, lon)"""
+        return (math.floor(lat / self.cell_size_deg), math.floor(lon / self.cell_size_deg))
+
+    def insert(self, shop: Dict[str, Any], pinned: bool = False) -> bool:
+        """Thêm hoặc cập nhật một cửa hàng, False nếu tọa độ không hợp lệ"""
+        return self.insert_many([shop], pinned) == 1
+
+    def insert_many(self, shops: Iterable[Dict[str, Any]], pinned: bool = False) -> int:
+        """
+        Thêm hoặc cập nhật nhiều cửa hàng
+
+        Args:
+            shops: Cửa hàng cần thêm
+            pinned: Không hết hạn, không bị loại (cửa hàng trong danh mục Google Sheets);
+                    bản pinned không bị bản không pinned cùng khóa ghi đè
+
+        Returns:
+            Số cửa hàng có tọa độ hợp lệ đã được đưa vào chỉ mục
+        """
+        added = 0
+        now = time.monotonic()
+        with self._lock:
+            for shop in shops:
+                shop = prepare_shop(shop)
+                if shop is None:
+                    continue
+
+                key = shop_identity(shop)
+                if not pinned and key in self._pinned:
+                    added += 1
+                    continue
+
+                cell = self.cell_key(shop['lat'], shop['lon'])
+                previous = self._locations.get(key)
+                if previous is not None and previous != cell:
+                    self._cells[previous].pop(key, None)
+
+                self._cells.setdefault(cell, {})[key] = shop
+                self._locations[key] = cell
+                if pinned:
+                    self._pinned.add(key)
+                    self._added_at.pop(key, None)
+                else:
+                    self._added_at[key] = now
+                    self._added_at.move_to_end(key)
+                added += 1
+            self._evict(now)
+        return added
+
+    def _remove_key(self, key: str) -> bool:
+        """Xóa cửa hàng theo khóa (gọi khi giữ _lock)"""
+        cell = self._locations.pop(key, None)
+        if cell is None:
+            return False
+        bucket = self._cells[cell]
+        bucket.pop(key, None)
+        if not bucket:
+            del self._cells[cell]
+        self._added_at.pop(key, None)
+        self._pinned.discard(key)
+        return True
+
+    def _evict(self, now: float):
+        """Loại cửa hàng đã hết hạn và cửa hàng cũ nhất khi vượt max_entries (gọi khi giữ _lock)"""
+        while self._added_at:
+            key, added_at = next(iter(self._added_at.items()))
+            expired = self.ttl_seconds is not None and now - added_at > self.ttl_seconds
+            overflow = self.max_entries is not None and len(self._added_at) > self.max_entries
+            if not expired and not overflow:
+                break
+            self._remove_key(key)
+            self.evicted += 1
+
+    def remove(self, shop: Dict[str, Any]) -> bool:
+        """Xóa cửa hàng khỏi chỉ mục, False nếu không có"""
+        with self._lock:
+            return self._remove_key(shop_identity(shop))
+
+    def clear(self):
+        """Xóa toàn bộ chỉ mục"""
+        with self._lock:
+            self._cells.clear()
+            self._locations.clear()
+            self._added_at.clear()
+            self._pinned.clear()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def _cell_span(self, lat: float, radius_km: float) -> Tuple[int, int]:
+        """Số ô cần xét theo mỗi chiều (lat, lon) để phủ bán kính radius_km"""
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlon = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        return math.ceil(dlat / self.cell_size_deg), math.ceil(dlon / self.cell_size_deg)
+
+    def _expire(self):
+        """Loại cửa hàng đã hết hạn trước khi truy vấn"""
+        if self.ttl_seconds is not None:
+            with self._lock:
+                self._evict(time.monotonic())
+
+    def _collect(self, cells: Iterable[CellKey]) -> List[Dict[str, Any]]:
+        candidates = []
+        with self._lock:
+            for cell in cells:
+                bucket = self._cells.get(cell)
+                if bucket:
+                    candidates.extend(bucket.values())
+        return candidates
+
+    def _with_distances(
+        self,
+        lat: float,
+        lon: float,
+        candidates: List[Dict[str, Any]],
+        radius_km: float
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        """Tính khoảng cách (haversine) cho các ứng viên và chỉ giữ các cửa hàng trong bán kính"""
+        if not candidates:
+            return []
+        distances = calculate_distances_batch(
+            lat, lon,
+            [shop['lat'] for shop in candidates],
+            [shop['lon'] for shop in candidates]
+        )
+        return [
+            (float(distance), shop) for distance, shop in zip(distances, candidates)
+            if distance <= radius_km
+        ]
+
+    @staticmethod
+    def _result(pairs: List[Tuple[float, Dict[str, Any]]], limit: Optional[int]) -> List[Dict[str, Any]]:
+        """Sắp xếp theo khoảng cách, cắt theo limit và trả về bản sao có distance_km"""
+        pairs.sort(key=lambda pair: pair[0])
+        if limit is not None:
+            pairs = pairs[:limit]
+        return [{**shop, 'distance_km': round(distance, 2)} for distance, shop in pairs]
+
+    def query_radius(self, lat: float, lon: float, radius_km: float, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Lấy cửa hàng trong bán kính, sắp xếp theo khoảng cách
+
+        Args:
+            lat, lon: Vị trí người dùng
+            radius_km: Bán kính (km)
+            limit: Số lượng tối đa (None = tất cả)
+
+        Returns:
+            Bản sao cửa hàng kèm distance_km (haversine)
+        """
+        self._expire()
+        span_lat, span_lon = self._cell_span(lat, radius_km)
+        center_i, center_j = self.cell_key(lat, lon)
+        cells = (
+            (i, j)
+            for i in range(center_i - span_lat, center_i + span_lat + 1)
+            for j in range(center_j - span_lon, center_j + span_lon + 1)
+        )
+        return self._result(self._with_distances(lat, lon, self._collect(cells), radius_km), limit)
+
+    def nearest(self, lat: float, lon: float, k: int, max_radius_km: float = NEAREST_MAX_RADIUS_KM) -> List[Dict[str, Any]]:
+        """
+        Lấy k cửa hàng gần nhất trong phạm vi max_radius_km
+
+        Mở rộng dần theo từng vòng ô quanh vị trí người dùng; dừng khi đã có k cửa hàng
+        nằm trong phần bán kính mà các vòng đã xét chắc chắn phủ kín.
+        """
+        if k <= 0:
+            return []
+
+        self._expire()
+        center_i, center_j = self.cell_key(lat, lon)
+        # Cạnh ngắn nhất của ô (km): kinh độ co lại theo vĩ độ
+        cell_km = self.cell_size_deg * KM_PER_DEG_LAT * min(1.0, max(math.cos(math.radians(lat)), 0.01))
+        max_ring = max(self._cell_span(lat, max_radius_km))
+
+        total = len(self)
+        collected = 0
+        found: List[Tuple[float, Dict[str, Any]]] = []
+        for ring in range(max_ring + 1):
+            if collected >= total:
+                # Đã xét hết mọi cửa hàng trong chỉ mục
+                break
+            if ring == 0:
+                cells = [(center_i, center_j)]
+            else:
+                cells = [
+                    (center_i + di, center_j + dj)
+                    for di in range(-ring, ring + 1)
+                    for dj in range(-ring, ring + 1)
+                    if max(abs(di), abs(dj)) == ring
+                ]
+            candidates = self._collect(cells)
+            collected += len(candidates)
+            found.extend(self._with_distances(lat, lon, candidates, max_radius_km))
+
+            # Sau vòng này mọi điểm cách người dùng dưới ring * cell_km đều đã được xét
+            covered_km = ring * cell_km
+            if len(found) >= k and heapq.nsmallest(k, (distance for distance, _ in found))[-1] <= covered_km:
+                break
+
+        return self._result(found, k)
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê chỉ mục"""
+        return {
+            'shops': len(self._locations),
+            'pinned': len(self._pinned),
+            'cells': sum(1 for bucket in self._cells.values() if bucket),
+            'evicted': self.evicted
+        }
+
+
+# Singleton instance
+_shop_index_instance = None
+
+def get_shop_index() -> SpatialIndex:
+    """
+    Lấy instance SpatialIndex dùng chung (Singleton pattern)
+
+    Cửa hàng từ Overpass hết hạn cùng TTL với tile cache; danh mục Google Sheets được pinned.
+    """
+    global _shop_index_instance
+    if _shop_index_instance is None:
+        _shop_index_instance = SpatialIndex(ttl_seconds=TILE_CACHE_TTL_SECONDS, max_entries=SHOP_INDEX_MAX_ENTRIES)
+    return _shop_index_instance
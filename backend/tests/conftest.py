@@ -0,0 +1,6 @@
+# conftest.py - Cho phép test import các module backend (chạy pytest từ thư mục backend)
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,112 @@
+# test_sheet_records.py - Bản ghi Google Sheets có ô dạng số vẫn đi qua được /chat
+# Chạy (từ thư mục backend): python -m pytest -q tests
+
+import asyncio
+import time
+
+import pytest
+
+import app
+import gemini_service
+import gsheet_connector
+import places_service
+import shop_catalog
+from spatial_index import SpatialIndex
+
+SHEET_ID = 'test-sheet'
+SHEET_NAME = 'Trang tính 1'
+LAT, LON = 21.0245, 105.8530
+
+
+class FakeWorksheet:
+    """Worksheet trả về bản ghi như gspread: ô trông giống số đã bị đổi thành int"""
+
+    title = SHEET_NAME
+
+    def __init__(self, records):
+        self._records = records
+
+    def get_all_records(self):
+        return [dict(record) for record in self._records]
+
+
+def _numeric_records():
+    return [{
+        'name': 2024,
+        'address': '42 Trang Tien, Hoan Kiem, Ha Noi',
+        'lat': LAT,
+        'lon': LON,
+        'category': 'Thoi trang nu',
+        'price_range': 500000,
+        'notes': 20
+    }]
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    instance = gsheet_connector.GoogleSheetsConnector()
+    instance.client = object()
+    instance._worksheet_cache[(SHEET_ID, SHEET_NAME)] = (time.monotonic(), FakeWorksheet(_numeric_records()))
+    monkeypatch.setattr(shop_catalog, 'get_connector', lambda **kwargs: instance)
+    return instance
+
+
+@pytest.fixture
+def shared_index(monkeypatch):
+    index = SpatialIndex()
+    monkeypatch.setattr(shop_catalog, 'get_shop_index', lambda: index)
+    monkeypatch.setattr(places_service, 'get_shop_index', lambda: index)
+    monkeypatch.setattr(places_service, 'get_shop_store', lambda: None)
+    return index
+
+
+def test_get_shops_data_returns_text_fields_as_str(connector):
+    record = connector.get_shops_data(SHEET_ID, SHEET_NAME, fallback_to_sample=False)[0]
+
+    assert record['price_range'] == '500000'
+    assert record['notes'] == '20'
+    assert record['name'] == '2024'
+    assert record['lat'] == LAT
+
+
+def test_catalog_hit_with_numeric_price_range_builds_response(connector, shared_index):
+    catalog = shop_catalog.ShopCatalog()
+    asyncio.run(catalog.refresh(SHEET_ID, SHEET_NAME))
+    shops = catalog.query_radius(LAT, LON, 1.0)
+
+    response = app._format_shops_response(shops, [])
+    assert response[0].price_range == '500000'
+    assert response[0].name == '2024'
+
+    service = gemini_service.GeminiService.__new__(gemini_service.GeminiService)
+    fallback = service._generate_fallback_response(shops, 'áo khoác')
+    assert '🎁 20' in fallback
+
+
+def test_shared_index_serves_text_fields_on_chat_only_path(connector, shared_index):
+    asyncio.run(shop_catalog.ShopCatalog().refresh(SHEET_ID, SHEET_NAME))
+
+    request = app.ChatRequest(lat=LAT, lon=LON, message='chào bạn')
+    shops = asyncio.run(app._find_cached_nearby_shops(request))
+
+    assert len(shops) == 1
+    response = app._format_shops_response(shops, [])
+    assert response[0].price_range == '500000'
+    assert response[0].address == '42 Trang Tien, Hoan Kiem, Ha Noi'
+
+
+def test_refresh_keeps_shops_still_queued_for_the_sheet(connector, shared_index, monkeypatch):
+    queue = gsheet_connector.SheetWriteQueue()
+    monkeypatch.setattr(shop_catalog, 'get_write_queue', lambda: queue)
+    queued_shop = {
+        'name': 'Shop Moi', 'address': '1 Hang Bai', 'lat': LAT + 0.001, 'lon': LON,
+        'category': 'Quần áo', 'price_range': '', 'notes': ''
+    }
+    queue.enqueue(SHEET_ID, [queued_shop], SHEET_NAME)
+
+    catalog = shop_catalog.ShopCatalog()
+    catalog.insert_many([queued_shop])
+    asyncio.run(catalog.refresh(SHEET_ID, SHEET_NAME))
+
+    names = {shop['name'] for shop in catalog.query_radius(LAT, LON, 1.0)}
+    assert names == {'2024', 'Shop Moi'}
@@ -0,0 +1,11 @@
+# text_utils.py - Hàm xử lý chuỗi dùng chung (không phụ thuộc thư viện ngoài)
+# Dùng bởi intent_classifier (phân loại câu hỏi) và gemini_service (khóa cache, xếp hạng cửa hàng)
+
+import unicodedata
+
+
+def normalize_query(text: str) -> str:
+    """Chuẩn hóa câu hỏi: bỏ dấu tiếng Việt, viết thường, gộp khoảng trắng"""
+    text = unicodedata.normalize('NFD', text.replace('đ', 'd').replace('Đ', 'D'))
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return ' '.join(text.lower().split())
@@ -0,0 +1,135 @@
+# tile_cache.py - Module cache kết quả OpenStreetMap theo ô lưới (grid tile)
+# Mỗi ô lưới lưu danh sách cửa hàng đã chuẩn hóa, có TTL và loại bỏ theo LRU
+
+import math
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from geofilter import calculate_distances_batch
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình cache
+TILE_SIZE_DEG = float(os.getenv('OSM_TILE_SIZE_DEG', '0.05'))  # ~5.5km theo vĩ độ
+TILE_CACHE_TTL_SECONDS = float(os.getenv('OSM_TILE_CACHE_TTL_SECONDS', '3600'))
+TILE_CACHE_MAX_TILES = int(os.getenv('OSM_TILE_CACHE_MAX_TILES', '5000'))
+
+# Số km trên 1 độ vĩ (xấp xỉ)
+KM_PER_DEG_LAT = 111.32
+
+TileKey = Tuple[int, int]
+
+
+class TileCache:
+    """Cache LRU + TTL cho cửa hàng OSM, khóa theo ô lưới (lat, lon)"""
+
+    def __init__(
+        self,
+        tile_size_deg: float = TILE_SIZE_DEG,
+        ttl_seconds: float = TILE_CACHE_TTL_SECONDS,
+        max_tiles: int = TILE_CACHE_MAX_TILES
+    ):
+        """
+        Khởi tạo cache
+
+        Args:
+            tile_size_deg: Kích thước cạnh ô lưới (độ)
+            ttl_seconds: Thời gian sống của một ô (giây)
+            max_tiles: Số ô tối đa giữ trong bộ nhớ
+        """
+        self.tile_size_deg = tile_size_deg
+        self.ttl_seconds = ttl_seconds
+        self.max_tiles = max_tiles
+        self._tiles: "OrderedDict[TileKey, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def tile_key(self, lat: float, lon: float) -> TileKey:
+        """Lấy khóa ô lưới chứa điểm (lat, lon)"""
+        return (math.floor(lat / self.tile_size_deg), math.floor(lon / self.tile_size_deg))
+
+    def tile_bounds(self, key: TileKey) -> Tuple[float, float, float, float]:
+        """Trả về bounding box (south, west, north, east) của ô lưới"""
+        south = key[0] * self.tile_size_deg
+        west = key[1] * self.tile_size_deg
+        return (south, west, south + self.tile_size_deg, west + self.tile_size_deg)
+
+    def tiles_for_circle(self, lat: float, lon: float, radius_km: float) -> List[TileKey]:
+        """
+        Liệt kê các ô lưới giao với hình tròn tìm kiếm
+
+        Args:
+            lat, lon: Tâm hình tròn
+            radius_km: Bán kính (km)
+
+        Returns:
+            Danh sách khóa ô lưới
+        """
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlon = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+
+        south, west = self.tile_key(max(lat - dlat, -90.0), max(lon - dlon, -180.0))
+        north, east = self.tile_key(min(lat + dlat, 90.0), min(lon + dlon, 180.0))
+
+        keys = [(i, j) for i in range(south, north + 1) for j in range(west, east + 1)]
+
+        # Bỏ các ô ở góc bounding box nằm hoàn toàn ngoài hình tròn
+        nearest_lats = []
+        nearest_lons = []
+        for key in keys:
+            s, w, n, e = self.tile_bounds(key)
+            nearest_lats.append(min(max(lat, s), n))
+            nearest_lons.append(min(max(lon, w), e))
+        distances = calculate_distances_batch(lat, lon, nearest_lats, nearest_lons)
+
+        return [key for key, distance in zip(keys, distances) if distance <= radius_km]
+
+    def get(self, key: TileKey) -> Optional[List[Dict[str, Any]]]:
+        """Lấy danh sách cửa hàng của ô, None nếu chưa có hoặc đã hết hạn"""
+        with self._lock:
+            entry = self._tiles.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, shops = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._tiles[key]
+                self.misses += 1
+                return None
+
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return shops
+
+    def put(self, key: TileKey, shops: List[Dict[str, Any]]):
+        """Lưu danh sách cửa hàng cho ô (kể cả danh sách rỗng)"""
+        with self._lock:
+            self._tiles[key] = (time.monotonic(), shops)
+            self._tiles.move_to_end(key)
+
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._tiles.clear()
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+
+# Singleton instance
+_tile_cache_instance = None
+
+def get_tile_cache() -> TileCache:
+    """Lấy instance TileCache (Singleton pattern)"""
+    global _tile_cache_instance
+    if _tile_cache_instance is None:
+        _tile_cache_instance = TileCache()
+    return _tile_cache_instance
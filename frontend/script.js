@@ -326,9 +326,12 @@ function updateWelcomeMessage(hasLocation) {
 }
 
 /**
- * Helper: Gọi API chat với message
+ * Helper: Gọi API chat với message (streaming qua Server-Sent Events)
+ * - handlers.onShops(shops): gọi ngay khi backend lọc xong cửa hàng
+ * - handlers.onToken(text, fullText): gọi mỗi khi nhận thêm nội dung AI
+ * Trả về { shops, ai_message } khi stream kết thúc
  */
-async function callChatAPI(message) {
+async function callChatAPI(message, handlers = {}) {
     // Validate và chuẩn bị data
     const requestData = {
         lat: parseFloat(state.userLocation.lat),
@@ -344,10 +347,11 @@ async function callChatAPI(message) {
         throw new Error('Vị trí không hợp lệ. Vui lòng lấy lại vị trí.');
     }
 
-    const response = await fetch(`${CONFIG.API_BASE_URL}/chat`, {
+    const response = await fetch(`${CONFIG.API_BASE_URL}/chat/stream`, {
         method: 'POST',
         headers: {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
         },
         body: JSON.stringify(requestData)
     });
@@ -366,7 +370,56 @@ async function callChatAPI(message) {
         throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
     }
 
-    return await response.json();
+    const result = { shops: [], ai_message: '' };
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+
+        buffer += decoder.decode(value, { stream: true });
+
+        // Mỗi sự kiện SSE kết thúc bằng một dòng trống
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const event = parseSSEEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+
+            if (event.type === 'shops') {
+                result.shops = event.data;
+                if (handlers.onShops) handlers.onShops(event.data);
+            } else if (event.type === 'token') {
+                result.ai_message += event.data.text;
+                if (handlers.onToken) handlers.onToken(event.data.text, result.ai_message);
+            } else if (event.type === 'error') {
+                throw new Error(event.data.detail || 'Lỗi xử lý yêu cầu');
+            }
+        }
+    }
+
+    return result;
+}
+
+/**
+ * Parse một sự kiện Server-Sent Events thành { type, data }
+ */
+function parseSSEEvent(block) {
+    let type = 'message';
+    const dataLines = [];
+
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            type = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+
+    return { type, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
 }
 
 /**
@@ -384,10 +437,29 @@ async function sendMessage() {
     elements.sendBtn.disabled = true;
     showTypingIndicator();
 
+    let botMessageEl = null;
+
     try {
-        const data = await callChatAPI(message);
-        hideTypingIndicator();
-        addBotMessage(data.ai_message);
+        const data = await callChatAPI(message, {
+            // Hiển thị cửa hàng ngay khi có, trước khi AI trả lời xong
+            onShops: (shops) => {
+                displayShopsOnMap(shops);
+                displayShopsList(shops);
+            },
+            onToken: (text, fullText) => {
+                if (!botMessageEl) {
+                    hideTypingIndicator();
+                    botMessageEl = addBotMessage(fullText);
+                } else {
+                    updateBotMessage(botMessageEl, fullText);
+                }
+            }
+        });
+
+        if (!botMessageEl) {
+            hideTypingIndicator();
+            addBotMessage(data.ai_message);
+        }
     } catch (error) {
         console.error('Lỗi gửi tin nhắn:', error);
         hideTypingIndicator();
@@ -409,12 +481,14 @@ async function searchNearbyShops() {
     updateLocationStatus('Đang tìm kiếm cửa hàng...', 'loading');
 
     try {
-        const data = await callChatAPI('Tìm cửa hàng gần đây');
-        
-        displayShopsOnMap(data.shops);
-        displayShopsList(data.shops);
-        
-        updateLocationStatus(`Tìm thấy ${data.shops.length} cửa hàng`, 'success');
+        await callChatAPI('Tìm cửa hàng gần đây', {
+            // Hiển thị cửa hàng ngay khi nhận được, không chờ AI
+            onShops: (shops) => {
+                displayShopsOnMap(shops);
+                displayShopsList(shops);
+                updateLocationStatus(`Tìm thấy ${shops.length} cửa hàng`, 'success');
+            }
+        });
     } catch (error) {
         console.error('Lỗi tìm kiếm:', error);
         updateLocationStatus('Lỗi tìm kiếm cửa hàng', 'error');
@@ -591,6 +665,15 @@ function addBotMessage(message) {
     
     elements.chatHistory.appendChild(messageEl);
     scrollToBottom();
+    return messageEl;
+}
+
+/**
+ * Cập nhật nội dung tin nhắn bot đang stream
+ */
+function updateBotMessage(messageEl, message) {
+    messageEl.querySelector('.message-content p').innerHTML = formatBotMessage(message);
+    scrollToBottom();
 }
 
 /**